@@ -0,0 +1,10 @@
+from .harness import (
+    BenchmarkResult,
+    benchmark,
+    find_regressions,
+    load_baseline,
+    log_benchmark_results,
+    save_baseline,
+)
+from .evaluator_benchmarks import run_evaluator_benchmarks
+from .run_benchmarks import run_pipeline_benchmarks
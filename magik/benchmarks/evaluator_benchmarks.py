@@ -0,0 +1,154 @@
+import json
+import random
+from typing import Any, Callable, List, Optional, Tuple
+from .. import evaluators
+from .harness import BenchmarkResult, benchmark
+
+# Sizes of the synthetic outputs, in bytes
+OUTPUT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog model output answer customer "
+    "order refund policy please contact support thanks hello world"
+).split()
+
+
+def generate_text(size: int, seed: int = 0) -> str:
+    """
+    Deterministic prose-like text of about `size` characters, with no links,
+    emails or numbers, so that "contains" style evaluators scan all of it.
+    """
+    generator = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = generator.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def generate_json(size: int, seed: int = 0) -> str:
+    """
+    A JSON array of objects of about `size` characters.
+    """
+    generator = random.Random(seed)
+    items = []
+    length = 2
+    while length < size:
+        item = {
+            "id": len(items),
+            "name": generator.choice(WORDS),
+            "score": round(generator.random(), 3),
+        }
+        items.append(item)
+        length += len(json.dumps(item)) + 2
+    return json.dumps(items)
+
+
+# (name, evaluator, output generator, largest output size to run it on).
+# Evaluators that are quadratic in the output size are capped, otherwise a
+# single call on 1 MB would take minutes.
+EVALUATOR_CASES: List[Tuple[str, Callable[[str], Any], Callable, Optional[int]]] = [
+    ("equals", evaluators.equals("expected output"), generate_text, None),
+    ("contains", evaluators.contains("refunded"), generate_text, None),
+    (
+        "contains_all",
+        evaluators.contains_all(["refund", "policy", "missing keyword"]),
+        generate_text,
+        None,
+    ),
+    (
+        "contains_any",
+        evaluators.contains_any(["missing", "keywords", "only"]),
+        generate_text,
+        None,
+    ),
+    (
+        "contains_none",
+        evaluators.contains_none(["missing", "keywords", "only"]),
+        generate_text,
+        None,
+    ),
+    (
+        "contains_none[500 keywords]",
+        evaluators.contains_none([f"blocked{index}" for index in range(500)]),
+        generate_text,
+        None,
+    ),
+    ("regex", evaluators.regex(r"order #\d+"), generate_text, None),
+    (
+        "contains_none_of_patterns[pii]",
+        evaluators.contains_none_of_patterns("pii"),
+        generate_text,
+        None,
+    ),
+    ("starts_with", evaluators.starts_with("the"), generate_text, None),
+    ("ends_with", evaluators.ends_with("thanks"), generate_text, None),
+    ("is_email", evaluators.is_email(), generate_text, None),
+    ("is_phone_number", evaluators.is_phone_number(), generate_text, None),
+    ("contains_email", evaluators.contains_email(), generate_text, None),
+    ("contains_phone_number", evaluators.contains_phone_number(), generate_text, None),
+    ("contains_link", evaluators.contains_link(), generate_text, 10_000),
+    (
+        "contains_credit_card_number",
+        evaluators.contains_credit_card_number(),
+        generate_text,
+        None,
+    ),
+    ("length_less_than", evaluators.length_less_than(500), generate_text, None),
+    ("is_json", evaluators.is_json(), generate_json, None),
+    ("contains_json", evaluators.contains_json(), generate_json, None),
+    (
+        "levenshtein_distance_below_threshold",
+        evaluators.levenshtein_distance_below_threshold(
+            "the expected answer to the question", 10
+        ),
+        generate_text,
+        None,
+    ),
+    (
+        "levenshtein_distance_below_threshold.evaluate_many[64 outputs]",
+        lambda output: evaluators.levenshtein_distance_below_threshold(
+            generate_text(1_000, seed=1), 10
+        ).evaluate_many([output] * 64),
+        generate_text,
+        10_000,
+    ),
+    (
+        "_and",
+        evaluators._and(
+            [evaluators.contains("refund"), evaluators.length_less_than(500)]
+        ),
+        generate_text,
+        None,
+    ),
+]
+
+
+def run_evaluator_benchmarks(
+    sizes: List[int] = OUTPUT_SIZES,
+    name_filter: Optional[str] = None,
+    min_time: float = 0.5,
+) -> List[BenchmarkResult]:
+    results = []
+    for name, evaluator, generate_output, max_size in EVALUATOR_CASES:
+        for size in sizes:
+            if max_size is not None and size > max_size:
+                continue
+            benchmark_name = f"evaluators.{name}[{_format_size(size)}]"
+            if name_filter and name_filter not in benchmark_name:
+                continue
+            output = generate_output(size)
+            results.append(
+                benchmark(benchmark_name, lambda: evaluator(output), min_time=min_time)
+            )
+    return results
+
+
+def _format_size(size: int) -> str:
+    if size >= 1_000_000:
+        return f"{size // 1_000_000}MB"
+    if size >= 1_000:
+        return f"{size // 1_000}KB"
+    return f"{size}B"
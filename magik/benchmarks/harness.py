@@ -0,0 +1,112 @@
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, TypedDict
+from ..internal_logger import logger
+from ..metrics import percentile
+
+
+class BenchmarkResult(TypedDict):
+    name: str
+    iterations: int
+    ops_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    peak_memory_kb: float
+
+
+def benchmark(
+    name: str,
+    fn: Callable[[], Any],
+    min_time: float = 0.5,
+    min_iterations: int = 3,
+    max_iterations: int = 10000,
+) -> BenchmarkResult:
+    """
+    Call fn repeatedly for at least min_time seconds and min_iterations calls,
+    then once more under tracemalloc to measure its peak memory.
+    """
+    fn()  # warm up caches and lazy imports
+    timings = []
+    started_at = time.perf_counter()
+    while len(timings) < max_iterations and (
+        len(timings) < min_iterations or time.perf_counter() - started_at < min_time
+    ):
+        call_started_at = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - call_started_at)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "name": name,
+        "iterations": len(timings),
+        "ops_per_sec": len(timings) / sum(timings) if sum(timings) > 0 else 0.0,
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "peak_memory_kb": peak_memory / 1024,
+    }
+
+
+def load_baseline(path: str) -> Optional[Dict[str, BenchmarkResult]]:
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_baseline(path: str, results: List[BenchmarkResult]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump({result["name"]: result for result in results}, file, indent=2)
+
+
+def find_regressions(
+    results: List[BenchmarkResult],
+    baseline: Dict[str, BenchmarkResult],
+    threshold: float,
+) -> List[str]:
+    """
+    Returns a description of every benchmark whose throughput dropped by more
+    than threshold percent compared to the baseline.
+    """
+    regressions = []
+    for result in results:
+        baseline_result = baseline.get(result["name"])
+        if baseline_result is None or not baseline_result["ops_per_sec"]:
+            continue
+        change = (result["ops_per_sec"] / baseline_result["ops_per_sec"] - 1) * 100
+        if change < -threshold:
+            regressions.append(
+                f"{result['name']}: {result['ops_per_sec']:.1f} ops/sec, "
+                f"{-change:.1f}% slower than the baseline "
+                f"({baseline_result['ops_per_sec']:.1f} ops/sec)"
+            )
+    return regressions
+
+
+def log_benchmark_results(results: List[BenchmarkResult]):
+    if not results:
+        logger.info("No benchmarks matched")
+        return
+    name_width = max(len(result["name"]) for result in results)
+    logger.info(
+        f"{'benchmark'.ljust(name_width)}  {'ops/sec':>12}  {'p50 ms':>10}  "
+        f"{'p99 ms':>10}  {'peak KB':>10}"
+    )
+    for result in results:
+        logger.info(
+            f"{result['name'].ljust(name_width)}  {result['ops_per_sec']:>12.1f}  "
+            f"{result['p50_ms']:>10.3f}  {result['p99_ms']:>10.3f}  "
+            f"{result['peak_memory_kb']:>10.1f}"
+        )
+    logger.info("")
@@ -0,0 +1,141 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+from typing import List, Optional
+import openai
+from ..cache import CACHE_MODE_OFF
+from ..internal_logger import logger
+from ..mock_llm import MockLLM, MockLLMServer
+from ..run import Run
+from ..test_loader import TestLoader
+from ..utils import substitute_vars
+from .harness import BenchmarkResult, benchmark
+
+BENCHMARK_SUITE_NAME = "benchmark"
+
+BENCHMARK_PROMPT = "Answer the question of customer {name} about order {order}"
+
+BENCHMARK_ASSERTIONS = """from magik.evaluators import contains, contains_any, length_less_than, _and
+
+
+def define_tests(context):
+    return [
+        {
+            "description": f"test {index}",
+            "eval": _and([contains("order"), length_less_than(500)])
+            if index % 2
+            else contains_any(["customer", "refund"]),
+            "prompt_vars": {"name": f"customer {index}", "order": index},
+            "failure_labels": ["benchmark"],
+        }
+        for index in range(NUMBER_OF_TESTS)
+    ]
+"""
+
+
+@contextlib.contextmanager
+def benchmark_project(api_base: str, number_of_tests: int):
+    """
+    A throwaway magik project whose config points at the mock LLM.
+    The working directory is switched to it, since magik reads its config
+    from ./magik_tests.
+    """
+    previous_dir = os.getcwd()
+    previous_api_base = openai.api_base
+    previous_api_key = openai.api_key
+    with tempfile.TemporaryDirectory() as project_dir:
+        suite_dir = os.path.join(
+            project_dir, "magik_tests", "tests", BENCHMARK_SUITE_NAME
+        )
+        os.makedirs(suite_dir)
+        with open(os.path.join(suite_dir, "prompt.txt"), "w") as file:
+            file.write(BENCHMARK_PROMPT)
+        with open(os.path.join(suite_dir, "assertions.py"), "w") as file:
+            file.write(
+                BENCHMARK_ASSERTIONS.replace("NUMBER_OF_TESTS", str(number_of_tests))
+            )
+        with open(
+            os.path.join(project_dir, "magik_tests", "magik_config.json"), "w"
+        ) as file:
+            json.dump({"OPEN_AI_API_KEY": "mock", "OPEN_AI_API_BASE": api_base}, file)
+
+        os.chdir(project_dir)
+        try:
+            _assert_distinct_prompts(os.path.join(project_dir, "magik_tests", "tests"))
+            yield project_dir
+        finally:
+            os.chdir(previous_dir)
+            openai.api_base = previous_api_base
+            openai.api_key = previous_api_key
+
+
+def _assert_distinct_prompts(test_dir: str):
+    # Tests sharing a prompt share their responses, so the benchmark would
+    # skip most of the generation path
+    test_loader = TestLoader(test_dir)
+    test_suite = test_loader._load_test_suite(BENCHMARK_SUITE_NAME, None)
+    prompts = [
+        substitute_vars(BENCHMARK_PROMPT, test["prompt_vars"]) for test in test_suite
+    ]
+    assert len(set(prompts)) == len(prompts), "benchmark tests share prompts"
+
+
+@contextlib.contextmanager
+def _quiet():
+    # Test results are printed for every test run, which would drown the
+    # benchmark results and slow the run down
+    only_warnings = lambda record: record.levelno >= logging.WARNING
+    logger.addFilter(only_warnings)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logger.removeFilter(only_warnings)
+
+
+def run_pipeline_benchmarks(
+    name_filter: Optional[str] = None,
+    min_time: float = 0.5,
+    number_of_tests: int = 20,
+    number_of_runs: int = 5,
+    concurrencies: List[int] = [1, 8],
+) -> List[BenchmarkResult]:
+    """
+    Benchmark Run.run_tests end to end against a local mock LLM, so the
+    numbers measure the runner itself rather than model latency.
+    """
+    names = [
+        f"run.run_tests[{number_of_tests}x{number_of_runs},concurrency={concurrency}]"
+        for concurrency in concurrencies
+    ]
+    if name_filter and not any(name_filter in name for name in names):
+        return []
+
+    server = MockLLMServer(MockLLM(seed=0), port=0).start()
+    results = []
+    try:
+        with benchmark_project(server.api_base, number_of_tests) as project_dir:
+            test_dir = os.path.join(project_dir, "magik_tests", "tests")
+            test_runs_dir = os.path.join(project_dir, "magik_tests", "test_runs")
+            for name, concurrency in zip(names, concurrencies):
+                if name_filter and name_filter not in name:
+                    continue
+                test_runner = Run(
+                    test_dir=test_dir,
+                    test_runs_dir=test_runs_dir,
+                    cache_mode=CACHE_MODE_OFF,
+                )
+                run_tests = lambda: test_runner.run_tests(
+                    BENCHMARK_SUITE_NAME,
+                    model="gpt-3.5-turbo",
+                    number_of_runs=number_of_runs,
+                    concurrency=concurrency,
+                )
+                with _quiet():
+                    results.append(benchmark(name, run_tests, min_time=min_time))
+    finally:
+        server.stop()
+    return results
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from .internal_logger import logger
+from .constants import CACHE_DIR, DEFAULT_CACHE_MAX_SIZE_MB
+from .config import get_cache_max_size_mb, get_cache_ttl_seconds
+
+# Cache modes for LLM responses
+CACHE_MODE_ON = "on"  # read from and write to the cache
+CACHE_MODE_OFF = "off"  # never touch the cache
+CACHE_MODE_REFRESH = "refresh"  # ignore cached values, but store new ones
+
+
+def make_cache_key(*parts: Any) -> str:
+    """
+    Build a content-addressed key from any JSON serializable values.
+    """
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    A persistent key-value store with one JSON file per entry.
+
+    Entries are evicted least-recently-used first once the cache grows beyond
+    max_size_bytes, and are treated as missing once they are older than
+    ttl_seconds. Reading an entry refreshes its access time.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_size_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+    ):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._size_bytes: Optional[int] = None
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._entry_path(key)
+        try:
+            with open(path, "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if self._is_expired(entry):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return None
+            with self._lock:
+                self._remove(path, size)
+            return None
+
+        try:
+            # mtime doubles as the last access time for LRU eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["value"]
+
+    def set(self, key: str, value: Any):
+        path = self._entry_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        data = json.dumps({"created_at": time.time(), "value": value}).encode("utf-8")
+
+        # Write to a temp file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+
+        with self._lock:
+            # The entry being rewritten, if any, no longer counts
+            try:
+                replaced_size = os.path.getsize(path)
+            except OSError:
+                replaced_size = 0
+            os.replace(temp_path, path)
+            if self._size_bytes is not None:
+                self._size_bytes += len(data) - replaced_size
+        self._evict_if_needed()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        if self.ttl_seconds is None:
+            return False
+        return time.time() - entry.get("created_at", 0) > self.ttl_seconds
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict_if_needed(self):
+        if self.max_size_bytes is None:
+            return
+
+        with self._lock:
+            if self._size_bytes is None:
+                self._size_bytes = sum(size for _, size, _ in self._entries())
+            if self._size_bytes <= self.max_size_bytes:
+                return
+
+            # Evict down to 90% of the limit so we don't evict on every write
+            target_size = int(self.max_size_bytes * 0.9)
+            for _, size, path in sorted(self._entries()):
+                if self._size_bytes <= target_size:
+                    break
+                self._remove(path, size)
+
+    def _remove(self, path: str, size: int):
+        # Called with the lock held
+        try:
+            os.remove(path)
+            if self._size_bytes is not None:
+                self._size_bytes -= size
+        except OSError as e:
+            logger.debug(f"Failed to remove cache entry {path}: {e}")
+
+
+class ResponseCache:
+    """
+    Caches LLM responses keyed by model, rendered prompt, sampling params and
+    repetition index.
+    """
+
+    def __init__(self, disk_cache: DiskCache, mode: str = CACHE_MODE_ON):
+        self.disk_cache = disk_cache
+        self.mode = mode
+
+    def get(
+        self, model: str, prompt: str, params: Dict[str, Any], run_index: int
+    ) -> Optional[str]:
+        if self.mode != CACHE_MODE_ON:
+            return None
+        return self.disk_cache.get(self._key(model, prompt, params, run_index))
+
+    def set(
+        self,
+        model: str,
+        prompt: str,
+        params: Dict[str, Any],
+        run_index: int,
+        response: str,
+    ):
+        if self.mode == CACHE_MODE_OFF:
+            return
+        self.disk_cache.set(self._key(model, prompt, params, run_index), response)
+
+    def _key(
+        self, model: str, prompt: str, params: Dict[str, Any], run_index: int
+    ) -> str:
+        return make_cache_key("response", model, prompt, params, run_index)
+
+
+def create_response_cache(mode: str = CACHE_MODE_ON) -> Optional[ResponseCache]:
+    """
+    Create the LLM response cache using the limits from magik_config.json.
+    """
+    if mode == CACHE_MODE_OFF:
+        return None
+    max_size_mb = get_cache_max_size_mb() or DEFAULT_CACHE_MAX_SIZE_MB
+    disk_cache = DiskCache(
+        cache_dir=f"{CACHE_DIR}/responses",
+        max_size_bytes=int(max_size_mb * 1024 * 1024),
+        ttl_seconds=get_cache_ttl_seconds(),
+    )
+    return ResponseCache(disk_cache, mode=mode)
@@ -0,0 +1,208 @@
+import gzip
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+import requests
+from .cache import make_cache_key
+from .internal_logger import logger
+from .utils import json_default
+
+CASSETTE_MODE_RECORD = "record"
+CASSETTE_MODE_REPLAY = "replay"
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+
+class ReplayedError(Exception):
+    """Re-raises an error that was recorded for a request."""
+
+
+class ReplayedHTTPResponse:
+    """
+    Stands in for a requests.Response that was recorded in a cassette.
+    """
+
+    def __init__(self, status_code: int, headers: Dict[str, str], text: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class Cassette:
+    """
+    Records outbound requests and their responses to a file, and serves them
+    back without touching the network.
+
+    The file is gzipped JSON lines, one interaction per line, indexed by a hash
+    of the request. Identical requests that were recorded several times are
+    replayed in the order they were recorded (the last response is reused once
+    they run out).
+    """
+
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._interactions: Dict[str, List[Dict[str, Any]]] = {}
+        self._replay_positions: Dict[str, int] = {}
+
+        if mode == CASSETTE_MODE_REPLAY:
+            self._load()
+        elif mode == CASSETTE_MODE_RECORD:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Start a fresh recording
+            open(path, "wb").close()
+        else:
+            raise ValueError(f"Invalid cassette mode: {mode}")
+
+    def call(
+        self,
+        kind: str,
+        request: Dict[str, Any],
+        send: Callable[[], Any],
+        serialize: Callable[[Any], Any] = lambda response: response,
+        deserialize: Callable[[Any], Any] = lambda data: data,
+        record_errors: bool = False,
+    ) -> Any:
+        """
+        Send a request through the cassette.
+
+        kind and request identify the request. send performs it for real, and
+        serialize / deserialize convert its response to and from JSON.
+        If record_errors is set, exceptions are recorded and re-raised on replay.
+        """
+        key = make_cache_key(kind, request)
+        if self.mode == CASSETTE_MODE_REPLAY:
+            return self._replay(key, kind, request, deserialize)
+
+        try:
+            response = send()
+        except Exception as e:
+            if record_errors:
+                self._record(
+                    key,
+                    kind,
+                    request,
+                    {"error": {"type": type(e).__name__, "message": str(e)}},
+                )
+            raise
+        self._record(key, kind, request, {"response": serialize(response)})
+        return response
+
+    def _replay(self, key, kind, request, deserialize):
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                raise CassetteMissError(
+                    f"No recorded {kind} request in {self.path} matches: "
+                    f"{json.dumps(request, default=json_default)[:500]}"
+                )
+            position = self._replay_positions.get(key, 0)
+            self._replay_positions[key] = position + 1
+            interaction = interactions[min(position, len(interactions) - 1)]
+
+        if "error" in interaction:
+            error = interaction["error"]
+            raise ReplayedError(f"{error['type']}: {error['message']}")
+        return deserialize(interaction["response"])
+
+    def _record(self, key, kind, request, outcome: Dict[str, Any]):
+        interaction = {"key": key, "kind": kind, "request": request, **outcome}
+        line = json.dumps(interaction, default=json_default) + "\n"
+        with self._lock:
+            self._interactions.setdefault(key, []).append(interaction)
+            # Each write appends a gzip member, so a crash never loses earlier
+            # interactions
+            with gzip.open(self.path, "at") as file:
+                file.write(line)
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            raise Exception(f"Cassette does not exist at {self.path}")
+        with gzip.open(self.path, "rt") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                self._interactions.setdefault(interaction["key"], []).append(
+                    interaction
+                )
+        logger.debug(
+            f"Loaded {sum(map(len, self._interactions.values()))} interactions from {self.path}"
+        )
+
+
+# The cassette used by every outbound request of this process, if any
+_active_cassette: Optional[Cassette] = None
+
+
+def use_cassette(path: str, mode: str) -> Cassette:
+    global _active_cassette
+    _active_cassette = Cassette(path, mode)
+    return _active_cassette
+
+
+def get_active_cassette() -> Optional[Cassette]:
+    return _active_cassette
+
+
+def is_recording() -> bool:
+    """
+    Local caches should not serve responses while recording, otherwise the
+    cached requests would be missing from the cassette.
+    """
+    return (
+        _active_cassette is not None and _active_cassette.mode == CASSETTE_MODE_RECORD
+    )
+
+
+def _serialize_http_response(response: requests.Response) -> Dict[str, Any]:
+    return {
+        "status_code": response.status_code,
+        "headers": dict(response.headers),
+        "text": response.text,
+    }
+
+
+def _deserialize_http_response(data: Dict[str, Any]) -> ReplayedHTTPResponse:
+    return ReplayedHTTPResponse(data["status_code"], data["headers"], data["text"])
+
+
+def send_http_request(
+    method: str, url: str, session: Optional[requests.Session] = None, **kwargs
+):
+    """
+    Send an HTTP request with requests, through the active cassette if there is one.
+    """
+    http = session if session is not None else requests
+    send = lambda: http.request(method, url, **kwargs)
+    if _active_cassette is None:
+        return send()
+
+    request = {
+        "method": method.upper(),
+        "url": url,
+        "json": kwargs.get("json"),
+        "data": kwargs.get("data"),
+        "params": kwargs.get("params"),
+    }
+    return _active_cassette.call(
+        "http",
+        request,
+        send,
+        serialize=_serialize_http_response,
+        deserialize=_deserialize_http_response,
+        record_errors=True,
+    )
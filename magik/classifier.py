@@ -1,4 +1,4 @@
-from .openai_helper import OpenAI
+from .openai_helper import get_shared_openai
 
 classifier_prompt = """
 You are acting as a classifier. 
@@ -38,7 +38,7 @@ def classify_output(
     task_description: str,
     output_to_test=None,
 ):
-    openai = OpenAI()
+    openai = get_shared_openai()
     response_message = openai.openai_chat_completion_message(
         model="gpt-3.5-turbo",
         prompt=f"""
@@ -1,12 +1,38 @@
 #!/usr/bin/env python3
 
 import argparse
+import sys
 from .initialize import initialize
 from .generate import generate_test
 from .deploy import deploy_test
 from .internal_logger import logger
-from .constants import TEST_DIR, TEST_RUNS_DIR
+from .constants import (
+    TEST_DIR,
+    TEST_RUNS_DIR,
+    ADAPTIVE_DEFAULT_CI_WIDTH,
+    ADAPTIVE_DEFAULT_PASS_THRESHOLD,
+    BENCHMARK_BASELINE_PATH,
+    BENCHMARK_DEFAULT_REGRESSION_THRESHOLD,
+)
 from .run import Run
+from .cache import CACHE_MODE_ON, CACHE_MODE_OFF, CACHE_MODE_REFRESH
+from .cassette import CASSETTE_MODE_RECORD, CASSETTE_MODE_REPLAY, use_cassette
+from .mock_llm import (
+    DEFAULT_RESPONSE_TEMPLATE,
+    LATENCY_DISTRIBUTIONS,
+    LATENCY_FIXED,
+    MockLLM,
+    MockLLMServer,
+)
+from .sys_exec import read_json_file
+from .benchmarks import (
+    find_regressions,
+    load_baseline,
+    log_benchmark_results,
+    run_evaluator_benchmarks,
+    run_pipeline_benchmarks,
+    save_baseline,
+)
 
 
 def main():
@@ -38,8 +64,213 @@ def main():
     parser_run.add_argument(
         "--csv", dest="csv_file_path", help="CSV file to store results in"
     )
+    parser_run.add_argument(
+        "--timings-json",
+        dest="timings_json_path",
+        help="JSON file to store the timing of every phase of every test run in",
+    )
+    parser_run.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        help="maximum number of test runs to execute in parallel",
+    )
+    parser_run.add_argument(
+        "--adaptive",
+        dest="adaptive",
+        action="store_true",
+        help="stop running a test early once its pass rate is known with confidence",
+    )
+    parser_run.add_argument(
+        "--ci-width",
+        dest="ci_width",
+        help="(adaptive) stop once the 95%% confidence interval is narrower than this, in percentage points",
+    )
+    parser_run.add_argument(
+        "--pass-threshold",
+        dest="pass_threshold",
+        help="(adaptive) stop once the pass rate is clearly above or below this percentage",
+    )
+    parser_run.add_argument(
+        "--shard",
+        dest="shard",
+        help="only run shard i of N (ex: 2/4) and write its partial results for magik merge",
+    )
+    parser_run.add_argument(
+        "--shard-output",
+        dest="shard_output",
+        help="file to write the partial results of this shard to",
+    )
+    parser_run.add_argument(
+        "--resume",
+        dest="resume_run_id",
+        help="id of an interrupted run to resume, skipping completed test runs",
+    )
+    cassette_group = parser_run.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        dest="record_path",
+        help="record every outbound LLM, embedding and HTTP request to this cassette file",
+    )
+    cassette_group.add_argument(
+        "--replay",
+        dest="replay_path",
+        help="serve outbound requests from this cassette file instead of the network",
+    )
+    cache_group = parser_run.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--cache",
+        dest="cache_mode",
+        action="store_const",
+        const=CACHE_MODE_ON,
+        help="reuse cached LLM responses, embeddings, verdicts and link checks from previous runs (default)",
+    )
+    cache_group.add_argument(
+        "--no-cache",
+        dest="cache_mode",
+        action="store_const",
+        const=CACHE_MODE_OFF,
+        help="do not read or write the LLM response, embedding, verdict and link caches",
+    )
+    cache_group.add_argument(
+        "--refresh-cache",
+        dest="cache_mode",
+        action="store_const",
+        const=CACHE_MODE_REFRESH,
+        help="regenerate all LLM responses, embeddings, verdicts and link checks and overwrite the caches",
+    )
     parser_run.set_defaults(func=run)
 
+    # magik merge <shard-result-files>
+    parser_merge = subparsers.add_parser(
+        "merge", help="Merge the partial results of a sharded run"
+    )
+    parser_merge.add_argument(
+        "shard_result_paths", nargs="+", help="Partial result files of every shard"
+    )
+    parser_merge.add_argument(
+        "--csv", dest="csv_file_path", help="CSV file to store results in"
+    )
+    parser_merge.set_defaults(func=merge)
+
+    # magik mock-llm
+    parser_mock_llm = subparsers.add_parser(
+        "mock-llm",
+        help="Serve a local stand-in for the OpenAI API, for benchmarking without a network",
+    )
+    parser_mock_llm.add_argument("--host", dest="host", default="127.0.0.1")
+    parser_mock_llm.add_argument("--port", dest="port", type=int, default=8000)
+    parser_mock_llm.add_argument(
+        "--latency-ms",
+        dest="latency_ms",
+        type=float,
+        default=0,
+        help="mean latency of a response, in milliseconds",
+    )
+    parser_mock_llm.add_argument(
+        "--latency-jitter-ms",
+        dest="latency_jitter_ms",
+        type=float,
+        default=0,
+        help="spread of the latency, in milliseconds",
+    )
+    parser_mock_llm.add_argument(
+        "--latency-distribution",
+        dest="latency_distribution",
+        choices=LATENCY_DISTRIBUTIONS,
+        default=LATENCY_FIXED,
+    )
+    parser_mock_llm.add_argument(
+        "--error-rate",
+        dest="error_rate",
+        type=float,
+        default=0,
+        help="fraction of requests that fail with a 500 error",
+    )
+    parser_mock_llm.add_argument(
+        "--rate-limit-rate",
+        dest="rate_limit_rate",
+        type=float,
+        default=0,
+        help="fraction of requests that fail with a 429 error",
+    )
+    parser_mock_llm.add_argument(
+        "--rpm",
+        dest="rpm",
+        type=float,
+        help="requests per minute above which requests fail with a 429 error",
+    )
+    parser_mock_llm.add_argument(
+        "--tpm",
+        dest="tpm",
+        type=float,
+        help="tokens per minute above which requests fail with a 429 error",
+    )
+    parser_mock_llm.add_argument(
+        "--retry-after",
+        dest="retry_after",
+        type=float,
+        default=1,
+        help="Retry-After header of 429 responses, in seconds",
+    )
+    parser_mock_llm.add_argument(
+        "--responses",
+        dest="responses_path",
+        help="JSON file mapping prompts to canned responses",
+    )
+    parser_mock_llm.add_argument(
+        "--template",
+        dest="template",
+        default=DEFAULT_RESPONSE_TEMPLATE,
+        help="response to other prompts, can use {prompt}, {model}, {index} and {hash}",
+    )
+    parser_mock_llm.add_argument(
+        "--seed", dest="seed", type=int, help="seed for latencies and injected errors"
+    )
+    parser_mock_llm.set_defaults(func=mock_llm)
+
+    # magik bench
+    parser_bench = subparsers.add_parser(
+        "bench", help="Benchmark the evaluators and the test runner"
+    )
+    parser_bench.add_argument(
+        "--filter",
+        dest="name_filter",
+        help="only run benchmarks whose name contains this",
+    )
+    parser_bench.add_argument(
+        "--min-time",
+        dest="min_time",
+        type=float,
+        default=0.5,
+        help="minimum number of seconds to spend on each benchmark",
+    )
+    parser_bench.add_argument(
+        "--skip-pipeline",
+        dest="skip_pipeline",
+        action="store_true",
+        help="only benchmark the evaluators, not run_tests end to end",
+    )
+    parser_bench.add_argument(
+        "--baseline",
+        dest="baseline_path",
+        default=BENCHMARK_BASELINE_PATH,
+        help="baseline file to compare the results against",
+    )
+    parser_bench.add_argument(
+        "--save-baseline",
+        dest="save_baseline",
+        action="store_true",
+        help="store the results as the new baseline",
+    )
+    parser_bench.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        default=BENCHMARK_DEFAULT_REGRESSION_THRESHOLD,
+        help="throughput drop compared to the baseline that fails the benchmark, in percent",
+    )
+    parser_bench.set_defaults(func=bench)
+
     # magik deploy <test-name>
     parser_deploy = subparsers.add_parser("deploy", help="Deploy a test")
     parser_deploy.add_argument("test_name", help="Name of the test")
@@ -72,18 +303,120 @@ def generate(args):
 
 
 def run(args):
-    test_runner = Run(test_dir=TEST_DIR, test_runs_dir=TEST_RUNS_DIR)
+    cache_mode = args.cache_mode if args.cache_mode else CACHE_MODE_ON
+    if args.record_path:
+        use_cassette(args.record_path, CASSETTE_MODE_RECORD)
+        # Cached responses would never reach the network, and so the cassette
+        if cache_mode == CACHE_MODE_ON:
+            cache_mode = CACHE_MODE_REFRESH
+    elif args.replay_path:
+        use_cassette(args.replay_path, CASSETTE_MODE_REPLAY)
+    test_runner = Run(
+        test_dir=TEST_DIR, test_runs_dir=TEST_RUNS_DIR, cache_mode=cache_mode
+    )
     number_of_runs = int(args.number_of_runs) if args.number_of_runs else 1
     model = args.model if args.model else "gpt-3.5-turbo"
     response = args.response if args.response else None
     csv_file_path = args.csv_file_path if args.csv_file_path else None
+    concurrency = int(args.concurrency) if args.concurrency else 1
+    ci_width = float(args.ci_width) if args.ci_width else ADAPTIVE_DEFAULT_CI_WIDTH
+    pass_threshold = (
+        float(args.pass_threshold)
+        if args.pass_threshold
+        else ADAPTIVE_DEFAULT_PASS_THRESHOLD
+    )
+    if args.resume_run_id:
+        test_runner.resume_tests(
+            args.test_name,
+            run_id=args.resume_run_id,
+            csv_file_path=csv_file_path,
+            concurrency=concurrency,
+            timings_json_path=args.timings_json_path,
+        )
+        return
+
     test_runner.run_tests(
         args.test_name,
         model=model,
         response=response,
         number_of_runs=number_of_runs,
         csv_file_path=csv_file_path,
+        concurrency=concurrency,
+        timings_json_path=args.timings_json_path,
+        adaptive=args.adaptive,
+        ci_width=ci_width,
+        pass_threshold=pass_threshold,
+        shard=args.shard,
+        shard_output=args.shard_output,
+    )
+
+
+def merge(args):
+    test_runner = Run(test_dir=TEST_DIR, test_runs_dir=TEST_RUNS_DIR)
+    test_runner.merge_shard_results(
+        args.shard_result_paths, csv_file_path=args.csv_file_path
+    )
+
+
+def mock_llm(args):
+    responses = read_json_file(args.responses_path) if args.responses_path else None
+    server = MockLLMServer(
+        MockLLM(
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.latency_jitter_ms,
+            latency_distribution=args.latency_distribution,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            rpm=args.rpm,
+            tpm=args.tpm,
+            retry_after=args.retry_after,
+            responses=responses,
+            template=args.template,
+            seed=args.seed,
+        ),
+        host=args.host,
+        port=args.port,
+    )
+    logger.info(
+        f"Mock LLM listening at {server.api_base}, "
+        f'set "OPEN_AI_API_BASE": "{server.api_base}" in your magik config to use it'
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        logger.info(f"Requests served: {server.mock_llm.stats}")
+
+
+def bench(args):
+    results = run_evaluator_benchmarks(
+        name_filter=args.name_filter, min_time=args.min_time
     )
+    if not args.skip_pipeline:
+        results += run_pipeline_benchmarks(
+            name_filter=args.name_filter, min_time=args.min_time
+        )
+    log_benchmark_results(results)
+
+    if args.save_baseline:
+        save_baseline(args.baseline_path, results)
+        logger.info(f"Saved baseline to {args.baseline_path}")
+        return
+
+    baseline = load_baseline(args.baseline_path)
+    if baseline is None:
+        logger.info(
+            f"No baseline found at {args.baseline_path}, run with --save-baseline to create one"
+        )
+        return
+    regressions = find_regressions(results, baseline, args.threshold)
+    if regressions:
+        for regression in regressions:
+            logger.error(regression)
+        sys.exit(1)
+    logger.success(f"No regressions above {args.threshold}% against the baseline")
 
 
 def deploy(args):
@@ -19,3 +19,53 @@ def get_open_ai_api_key():
 def get_open_ai_default_model():
     config = _load_config()
     return config.get("OPEN_AI_DEFAULT_MODEL")
+
+
+def get_cache_max_size_mb():
+    config = _load_config()
+    return config.get("CACHE_MAX_SIZE_MB")
+
+
+def get_cache_ttl_seconds():
+    config = _load_config()
+    return config.get("CACHE_TTL_SECONDS")
+
+
+def get_embedding_cache_max_size_mb():
+    config = _load_config()
+    return config.get("EMBEDDING_CACHE_MAX_SIZE_MB")
+
+
+def get_link_cache_ttl_seconds():
+    config = _load_config()
+    return config.get("LINK_CACHE_TTL_SECONDS")
+
+
+def get_open_ai_max_choices_per_request():
+    config = _load_config()
+    return config.get("OPEN_AI_MAX_CHOICES_PER_REQUEST")
+
+
+def get_open_ai_rate_limits():
+    config = _load_config()
+    return config.get("OPEN_AI_RATE_LIMITS")
+
+
+def get_open_ai_max_retries():
+    config = _load_config()
+    return config.get("OPEN_AI_MAX_RETRIES")
+
+
+def get_open_ai_request_timeout():
+    config = _load_config()
+    return config.get("OPEN_AI_REQUEST_TIMEOUT")
+
+
+def get_open_ai_api_base():
+    config = _load_config()
+    return config.get("OPEN_AI_API_BASE")
+
+
+def get_open_ai_prices():
+    config = _load_config()
+    return config.get("OPEN_AI_PRICES")
@@ -9,6 +9,8 @@ TEST_DIR = "./magik_tests/tests"
 TEST_RUNS_DIR = "./magik_tests/test_runs"
 CONFIG_FILE_PATH = f"./magik_tests/magik_config.json"
 SCHEDULE_CONFIG_FILE_PATH = f"./magik_tests/schedule.json"
+CACHE_DIR = "./magik_tests/.cache"
+BENCHMARK_BASELINE_PATH = "./magik_tests/benchmarks/baseline.json"
 # TODO: This should come from the directory that one will have on running pip install magik
 MAGIK_SDK_DIR = "./magik"
 EXAMPLES_DIR = f"{MAGIK_SDK_DIR}/examples"
@@ -16,3 +18,54 @@ EXAMPLE_CONFIG_PATH = f"{EXAMPLES_DIR}/magik_config.example.json"
 
 # Open AI defaults
 OPEN_AI_DEFAULT_MODEL = "gpt-3.5-turbo"
+# Maximum number of choices (n) to request in a single completion call
+OPEN_AI_DEFAULT_MAX_CHOICES_PER_REQUEST = 10
+OPEN_AI_DEFAULT_MAX_RETRIES = 5
+OPEN_AI_DEFAULT_REQUEST_TIMEOUT = 60  # in seconds
+# Limits of a single embedding request: inputs per request (the API maximum)
+# and estimated tokens of all the inputs
+OPEN_AI_EMBEDDING_MAX_BATCH_SIZE = 2048
+OPEN_AI_EMBEDDING_MAX_BATCH_TOKENS = 100_000
+# Price in USD per 1K tokens, can be overridden with OPEN_AI_PRICES in the config
+OPEN_AI_DEFAULT_PRICES = {
+    "gpt-3.5-turbo": {"prompt": 0.0015, "completion": 0.002},
+    "gpt-4": {"prompt": 0.03, "completion": 0.06},
+    "text-davinci-003": {"prompt": 0.02, "completion": 0.02},
+    "text-embedding-ada-002": {"prompt": 0.0001, "completion": 0.0},
+}
+
+# Grading with an LLM (see BatchGrader): outputs per grading request, and
+# estimated tokens of the outputs and rubrics of a request
+GRADING_BATCH_SIZE = 20
+GRADING_BATCH_MAX_TOKENS = 2000
+
+# Embeddings computed locally, without the API (see LocalEmbeddingBackend)
+LOCAL_EMBEDDING_MODEL = "local"
+LOCAL_EMBEDDING_DIMENSIONS = 1024
+
+# Largest (outputs x references) similarity matrix computed at once, in cells
+SIMILARITY_MAX_MATRIX_CELLS = 16_000_000
+
+# Cache defaults
+DEFAULT_CACHE_MAX_SIZE_MB = 500
+EMBEDDING_CACHE_DIR = f"{CACHE_DIR}/embeddings"
+DEFAULT_EMBEDDING_CACHE_MAX_SIZE_MB = 200
+VERDICT_CACHE_DIR = f"{CACHE_DIR}/verdicts"
+DEFAULT_VERDICT_CACHE_MAX_SIZE_MB = 50
+LINK_CACHE_DIR = f"{CACHE_DIR}/links"
+DEFAULT_LINK_CACHE_MAX_SIZE_MB = 10
+DEFAULT_LINK_CACHE_TTL_SECONDS = 24 * 3600
+
+# Link checks (see LinkChecker)
+LINK_CHECK_TIMEOUT = 10  # in seconds
+LINK_CHECK_CONCURRENCY = 16
+LINK_CHECK_MAX_CONNECTIONS_PER_HOST = 4
+
+# Adaptive sampling defaults
+ADAPTIVE_MIN_RUNS = 3
+ADAPTIVE_DEFAULT_CI_WIDTH = 20.0  # in percentage points
+ADAPTIVE_DEFAULT_PASS_THRESHOLD = 50.0  # in percent
+
+# Benchmark defaults
+# Throughput drop (in percent) compared to the baseline that counts as a regression
+BENCHMARK_DEFAULT_REGRESSION_THRESHOLD = 20.0
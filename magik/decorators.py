@@ -1,7 +1,38 @@
-def magik_eval(func):
+def magik_eval(func=None, prepare=None, batch=None, embeddings=None, rubric=None):
+    """
+    Turns an evaluator function into a factory: calling it with the evaluator
+    arguments returns a function of output_to_test.
+
+    prepare, if given, is called once per evaluator with the same arguments,
+    and returns extra keyword arguments for every call. Use it for work that
+    only depends on the arguments, like compiling patterns.
+
+    batch, if given, evaluates many outputs at once. It takes the same
+    arguments with outputs_to_test instead of output_to_test, and returns a
+    result per output. It is exposed as the evaluate_many attribute of the
+    evaluator, which the runner uses when it has several outputs to evaluate.
+
+    embeddings, if given, takes the same arguments as batch and returns the
+    texts the evaluator will embed, as {model: [text, ...]}. It is exposed as
+    the embedding_texts attribute of the evaluator, which the runner uses to
+    embed the texts of all evaluators in a few batched requests.
+
+    rubric, if given, marks the evaluator as graded by an LLM. It takes the
+    evaluator arguments and returns the rubric to grade outputs by. It is
+    exposed as the grading_rubric attribute of the evaluator, which the runner
+    uses to grade the outputs of all such evaluators together, with the
+    rubrics of an output in a single request.
+    """
+    # Supports both @magik_eval and @magik_eval(prepare=..., batch=..., ...)
+    if func is None:
+        return lambda func: magik_eval(
+            func, prepare=prepare, batch=batch, embeddings=embeddings, rubric=rubric
+        )
+
     def wrapper(*args, **kwargs):
+        prepared_kwargs = prepare(*args, **kwargs) if prepare is not None else {}
         wrapped_func = lambda output_to_test: func(
-            *args, **kwargs, output_to_test=output_to_test
+            *args, **kwargs, **prepared_kwargs, output_to_test=output_to_test
         )
 
         # Convert each value to a string and join them with commas, with strings wrapped in quotes
@@ -15,6 +46,16 @@ def magik_eval(func):
         )
 
         wrapped_func.__name__ = f"{func.__name__}({arg_string})"
+        if batch is not None:
+            wrapped_func.evaluate_many = lambda outputs_to_test: batch(
+                *args, **kwargs, **prepared_kwargs, outputs_to_test=outputs_to_test
+            )
+        if embeddings is not None:
+            wrapped_func.embedding_texts = lambda outputs_to_test: embeddings(
+                *args, **kwargs, **prepared_kwargs, outputs_to_test=outputs_to_test
+            )
+        if rubric is not None:
+            wrapped_func.grading_rubric = rubric(*args, **kwargs)
         return wrapped_func
 
     return wrapper
@@ -0,0 +1,101 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from .constants import (
+    OPEN_AI_EMBEDDING_MAX_BATCH_SIZE,
+    OPEN_AI_EMBEDDING_MAX_BATCH_TOKENS,
+)
+from .rate_limiter import estimate_tokens
+
+
+def split_embedding_batches(
+    texts: Sequence[str],
+    max_batch_size: int = OPEN_AI_EMBEDDING_MAX_BATCH_SIZE,
+    max_batch_tokens: int = OPEN_AI_EMBEDDING_MAX_BATCH_TOKENS,
+) -> List[List[str]]:
+    """
+    Split texts into batches of at most max_batch_size texts and (estimated)
+    max_batch_tokens tokens. A text that is larger than max_batch_tokens on its
+    own gets a batch of its own.
+    """
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (
+            len(batch) >= max_batch_size or batch_tokens + tokens > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EmbeddingBatcher:
+    """
+    Collects the texts that evaluators of a run will embed, so they can be
+    embedded together, in a few batched requests, before evaluating.
+
+    While the batcher is active (see use_embedding_batcher), OpenAI resolves
+    texts from its results.
+    """
+
+    def __init__(self):
+        self._texts_by_model: Dict[str, Dict[str, None]] = {}
+        self._embeddings: Dict[Tuple[str, str], np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def add(self, model: str, texts: Sequence[str]):
+        with self._lock:
+            # A dict keeps the texts unique, in the order they were added
+            self._texts_by_model.setdefault(model, {}).update(dict.fromkeys(texts))
+
+    def flush(self, embed: Callable[[List[str], str], List[np.ndarray]]) -> int:
+        """
+        Embed every text added since the last flush with embed(texts, model).
+        Returns the number of texts that were embedded.
+        """
+        with self._lock:
+            texts_by_model = self._texts_by_model
+            self._texts_by_model = {}
+        count = 0
+        for model, texts in texts_by_model.items():
+            texts = [text for text in texts if (model, text) not in self._embeddings]
+            embeddings = embed(texts, model)
+            with self._lock:
+                for text, embedding in zip(texts, embeddings):
+                    self._embeddings[(model, text)] = embedding
+            count += len(texts)
+        return count
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self._embeddings.get((model, text))
+
+
+# The batcher of the run being evaluated. Evaluations run on worker threads,
+# so it is shared by the whole process rather than by thread.
+_active_batcher: Optional[EmbeddingBatcher] = None
+
+
+@contextmanager
+def use_embedding_batcher(batcher: EmbeddingBatcher) -> Iterator[EmbeddingBatcher]:
+    global _active_batcher
+    previous_batcher = _active_batcher
+    _active_batcher = batcher
+    try:
+        yield batcher
+    finally:
+        _active_batcher = previous_batcher
+
+
+def get_batched_embedding(model: str, text: str) -> Optional[np.ndarray]:
+    batcher = _active_batcher
+    if batcher is None:
+        return None
+    return batcher.get(model, text)
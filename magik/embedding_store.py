@@ -0,0 +1,324 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, TypedDict
+import numpy as np
+from .internal_logger import logger
+from .cache import CACHE_MODE_OFF, CACHE_MODE_ON, make_cache_key
+from .cassette import is_recording
+from .config import get_embedding_cache_max_size_mb
+from .constants import EMBEDDING_CACHE_DIR, DEFAULT_EMBEDDING_CACHE_MAX_SIZE_MB
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where the store is only locked within the process
+    fcntl = None
+
+INDEX_FILE_NAME = "index.jsonl"
+LOCK_FILE_NAME = "store.lock"
+
+# The last use of an entry is written to the index at most this often, so
+# reading embeddings doesn't turn into a write per read
+TOUCH_INTERVAL_SECONDS = 3600
+
+_DTYPE = np.float32
+
+
+class EmbeddingEntry(TypedDict):
+    model: str
+    row: int  # row of the vector in the model's vectors file
+    used_at: float
+
+
+class EmbeddingStore:
+    """
+    A persistent store of embeddings keyed by model and text.
+
+    The vectors of each model are rows of a float32 file that is memory mapped
+    on first use, so lookups don't read the whole store. An index sidecar,
+    with a JSON line per entry or access, maps keys to rows. It is loaded
+    lazily, on the first lookup.
+
+    Once the vectors grow beyond max_size_bytes, the least recently used
+    entries are evicted and the vectors files are compacted.
+
+    Processes sharing the store take an exclusive lock on a lock file around
+    every access. The lock file holds a generation, bumped whenever the index
+    is rewritten, so other processes know to reload the index and remap the
+    vectors instead of reading lines appended since.
+    """
+
+    def __init__(
+        self,
+        store_dir: str,
+        max_size_bytes: Optional[int] = None,
+        mode: str = CACHE_MODE_ON,
+    ):
+        self.store_dir = store_dir
+        self.max_size_bytes = max_size_bytes
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, EmbeddingEntry]] = None
+        # Number of floats per vector, by model
+        self._dimensions: Dict[str, int] = {}
+        self._vectors: Dict[str, np.memmap] = {}
+        self._index_lines = 0
+        # Generation and length of the index as last read
+        self._generation: Optional[int] = None
+        self._index_offset = 0
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        # While recording, requests must reach the cassette
+        if self.mode != CACHE_MODE_ON or is_recording():
+            return None
+        key = make_cache_key("embedding", model, text)
+        with self._lock, self._file_lock() as lock_fd:
+            entry = self._load_index(lock_fd).get(key)
+            if entry is None:
+                return None
+            vectors = self._mapped_vectors(model, entry["row"])
+            if vectors is None:
+                return None
+            now = time.time()
+            if now - entry["used_at"] > TOUCH_INTERVAL_SECONDS:
+                entry["used_at"] = now
+                self._append_index_line(lock_fd, key, entry)
+            return np.array(vectors[entry["row"]])
+
+    def set(self, model: str, text: str, embedding: Sequence[float]) -> np.ndarray:
+        """
+        Stores the embedding and returns it as stored, in float32.
+        """
+        vector = np.asarray(embedding, dtype=_DTYPE)
+        if self.mode == CACHE_MODE_OFF:
+            return vector
+        key = make_cache_key("embedding", model, text)
+        with self._lock, self._file_lock() as lock_fd:
+            entries = self._load_index(lock_fd)
+            dimensions = self._dimensions.setdefault(model, len(vector))
+            if len(vector) != dimensions:
+                logger.debug(
+                    f"Not caching embedding with {len(vector)} dimensions for model {model}, which has {dimensions}"
+                )
+                return vector
+
+            row = self._append_vector(model, vector)
+            entry: EmbeddingEntry = {"model": model, "row": row, "used_at": time.time()}
+            entries[key] = entry
+            self._append_index_line(lock_fd, key, entry)
+            self._evict_if_needed(lock_fd)
+        return vector
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """
+        Holds the lock file of the store, and yields its descriptor.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        fd = os.open(
+            os.path.join(self.store_dir, LOCK_FILE_NAME), os.O_RDWR | os.O_CREAT
+        )
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield fd
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def _read_generation(self, lock_fd: int) -> int:
+        os.lseek(lock_fd, 0, os.SEEK_SET)
+        try:
+            return int(os.read(lock_fd, 32) or 0)
+        except ValueError:
+            return 0
+
+    def _bump_generation(self, lock_fd: int):
+        self._generation = self._read_generation(lock_fd) + 1
+        os.ftruncate(lock_fd, 0)
+        os.lseek(lock_fd, 0, os.SEEK_SET)
+        os.write(lock_fd, str(self._generation).encode())
+
+    def _load_index(self, lock_fd: int) -> Dict[str, EmbeddingEntry]:
+        """
+        Returns the entries, with the changes other processes made to the
+        index since it was last read. Must be called with the file lock held.
+        """
+        generation = self._read_generation(lock_fd)
+        if self._entries is None or generation != self._generation:
+            # The index was rewritten, and rows may have moved
+            self._entries = {}
+            self._vectors = {}
+            self._index_lines = 0
+            self._index_offset = 0
+            self._generation = generation
+        try:
+            with open(self._index_path(), "rb") as file:
+                file.seek(self._index_offset)
+                for line in file:
+                    self._index_lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self._dimensions.setdefault(record["model"], record["dimensions"])
+                    self._entries[record["key"]] = {
+                        "model": record["model"],
+                        "row": record["row"],
+                        "used_at": record["used_at"],
+                    }
+                self._index_offset = file.tell()
+        except OSError:
+            pass
+        return self._entries
+
+    def _append_index_line(self, lock_fd: int, key: str, entry: EmbeddingEntry):
+        record = {
+            "key": key,
+            **entry,
+            "dimensions": self._dimensions[entry["model"]],
+        }
+        with open(self._index_path(), "a") as file:
+            file.write(json.dumps(record) + "\n")
+            self._index_offset = file.tell()
+        self._index_lines += 1
+        # Accesses pile up in the index, rewrite it once most lines are stale
+        if self._index_lines > 2 * len(self._entries) + 1000:
+            self._write_index(lock_fd)
+
+    def _write_index(self, lock_fd: int):
+        fd, temp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            for key, entry in self._entries.items():
+                record = {
+                    "key": key,
+                    **entry,
+                    "dimensions": self._dimensions[entry["model"]],
+                }
+                file.write(json.dumps(record) + "\n")
+        os.replace(temp_path, self._index_path())
+        self._index_lines = len(self._entries)
+        self._index_offset = os.path.getsize(self._index_path())
+        self._bump_generation(lock_fd)
+
+    def _mapped_vectors(self, model: str, row: int) -> Optional[np.memmap]:
+        vectors = self._vectors.get(model)
+        if vectors is None or row >= len(vectors):
+            # Map the file again to see the rows appended since
+            path = self._vectors_path(model)
+            row_bytes = self._dimensions[model] * _DTYPE().itemsize
+            try:
+                rows = os.path.getsize(path) // row_bytes
+            except OSError:
+                return None
+            if row >= rows:
+                return None
+            vectors = np.memmap(
+                path, dtype=_DTYPE, mode="r", shape=(rows, self._dimensions[model])
+            )
+            self._vectors[model] = vectors
+        return vectors
+
+    def _append_vector(self, model: str, vector: np.ndarray) -> int:
+        path = self._vectors_path(model)
+        row_bytes = vector.nbytes
+        with open(path, "ab") as file:
+            size = file.tell()
+            if size % row_bytes:
+                # Drop a row cut short by a crash
+                size -= size % row_bytes
+                file.truncate(size)
+            file.write(vector.tobytes())
+        return size // row_bytes
+
+    def _size_bytes(self) -> int:
+        size = 0
+        for model in self._dimensions:
+            try:
+                size += os.path.getsize(self._vectors_path(model))
+            except OSError:
+                pass
+        return size
+
+    def _evict_if_needed(self, lock_fd: int):
+        if self.max_size_bytes is None or self._size_bytes() <= self.max_size_bytes:
+            return
+
+        # Keep the most recently used entries that fit in 90% of the limit, so
+        # we don't evict on every write
+        target_size = int(self.max_size_bytes * 0.9)
+        kept_entries: Dict[str, EmbeddingEntry] = {}
+        size = 0
+        for key, entry in sorted(
+            self._entries.items(), key=lambda item: item[1]["used_at"], reverse=True
+        ):
+            row_bytes = self._dimensions[entry["model"]] * _DTYPE().itemsize
+            if size + row_bytes > target_size:
+                break
+            kept_entries[key] = entry
+            size += row_bytes
+
+        # Rewrite every vectors file with only the kept rows
+        keys_by_model: Dict[str, List[str]] = {}
+        for key, entry in kept_entries.items():
+            keys_by_model.setdefault(entry["model"], []).append(key)
+        for model in list(self._dimensions):
+            keys = keys_by_model.get(model, [])
+            # Map the whole file, including the rows appended since last time
+            self._vectors.pop(model, None)
+            old_vectors = self._mapped_vectors(model, 0)
+            rows = np.empty((len(keys), self._dimensions[model]), dtype=_DTYPE)
+            for new_row, key in enumerate(keys):
+                rows[new_row] = old_vectors[kept_entries[key]["row"]]
+                kept_entries[key]["row"] = new_row
+            self._vectors.pop(model, None)
+            del old_vectors
+            fd, temp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(rows.tobytes())
+            os.replace(temp_path, self._vectors_path(model))
+
+        logger.debug(
+            f"Evicted {len(self._entries) - len(kept_entries)} embeddings from {self.store_dir}"
+        )
+        self._entries = kept_entries
+        self._write_index(lock_fd)
+
+    def _index_path(self) -> str:
+        return os.path.join(self.store_dir, INDEX_FILE_NAME)
+
+    def _vectors_path(self, model: str) -> str:
+        return os.path.join(
+            self.store_dir, f"{make_cache_key('vectors', model)[:16]}.f32"
+        )
+
+
+# Process-wide store shared by every OpenAI instance, so evaluators reuse the
+# embeddings of each other and of previous runs
+_embedding_store: Optional[EmbeddingStore] = None
+_embedding_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> EmbeddingStore:
+    global _embedding_store
+    with _embedding_store_lock:
+        if _embedding_store is None:
+            max_size_mb = (
+                get_embedding_cache_max_size_mb() or DEFAULT_EMBEDDING_CACHE_MAX_SIZE_MB
+            )
+            _embedding_store = EmbeddingStore(
+                EMBEDDING_CACHE_DIR, max_size_bytes=int(max_size_mb * 1024 * 1024)
+            )
+        return _embedding_store
+
+
+def set_embedding_cache_mode(mode: str):
+    """
+    Apply a cache mode (on, off or refresh) to the embedding store.
+    """
+    get_embedding_store().mode = mode
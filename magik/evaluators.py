@@ -1,16 +1,17 @@
 # Contains functions to evaluate assertions.
-import requests
 import json
-import re
-import ast
+import math
 import numpy as np
-from .openai_helper import OpenAI
-from .utils import standardize_url, generate_grading_prompt
-from .constants import OPEN_AI_DEFAULT_MODEL
 from .decorators import magik_eval
-from .similarity import similarity_score
+from .keyword_matcher import KeywordMatcher
+from .patterns import PatternScanner, compile_pattern, get_pattern, get_pattern_set
+from .cassette import send_http_request
+from .link_checker import extract_links, get_link_checker
+from .timing import PHASE_LINK_CHECK, time_phase
+from .similarity import SimilarityIndex, get_embeddings, similarity_score
 from .classifier import classify_output
-from .similarity import levenshtein_distance
+from .grader import get_grader
+from .similarity import levenshtein_distance, levenshtein_distances
 from typing import Any
 
 
@@ -28,16 +29,19 @@ def equals(expected_output, case_sensitive=False, output_to_test=None):
     return {"result": result, "reason": reason}
 
 
-@magik_eval
-def contains_all(keywords, case_sensitive=False, output_to_test=None):
-    if case_sensitive == False:
-        output_to_test = output_to_test.lower()
-        keywords = list(map(lambda k: k.lower(), keywords))
-    missing_keywords = []
-    for keyword in keywords:
-        if keyword not in output_to_test:
-            result = False
-            missing_keywords.append(keyword)
+def _prepare_keyword_matcher(keywords, case_sensitive=False, whole_words=False):
+    return {"matcher": KeywordMatcher(keywords, case_sensitive, whole_words)}
+
+
+@magik_eval(prepare=_prepare_keyword_matcher)
+def contains_all(
+    keywords,
+    case_sensitive=False,
+    whole_words=False,
+    matcher=None,
+    output_to_test=None,
+):
+    missing_keywords = matcher.missing_keywords(output_to_test)
     if (len(missing_keywords)) > 0:
         result = False
         reason = f"keywords not found in output: " + ", ".join(missing_keywords)
@@ -48,16 +52,15 @@ def contains_all(keywords, case_sensitive=False, output_to_test=None):
     return {"result": result, "reason": reason}
 
 
-@magik_eval
-def contains_any(keywords, case_sensitive=False, output_to_test=None):
-    if not case_sensitive:
-        output_to_test = output_to_test.lower()
-        keywords = list(map(lambda k: k.lower(), keywords))
-
-    found_keywords = []
-    for keyword in keywords:
-        if keyword in output_to_test:
-            found_keywords.append(keyword)
+@magik_eval(prepare=_prepare_keyword_matcher)
+def contains_any(
+    keywords,
+    case_sensitive=False,
+    whole_words=False,
+    matcher=None,
+    output_to_test=None,
+):
+    found_keywords = matcher.found_keywords(output_to_test)
 
     if found_keywords:
         result = True
@@ -71,16 +74,15 @@ def contains_any(keywords, case_sensitive=False, output_to_test=None):
     return {"result": result, "reason": reason}
 
 
-@magik_eval
-def contains_none(keywords, case_sensitive=False, output_to_test=None):
-    if not case_sensitive:
-        output_to_test = output_to_test.lower()
-        keywords = list(map(lambda k: k.lower(), keywords))
-
-    found_keywords = []
-    for keyword in keywords:
-        if keyword in output_to_test:
-            found_keywords.append(keyword)
+@magik_eval(prepare=_prepare_keyword_matcher)
+def contains_none(
+    keywords,
+    case_sensitive=False,
+    whole_words=False,
+    matcher=None,
+    output_to_test=None,
+):
+    found_keywords = matcher.found_keywords(output_to_test)
 
     if found_keywords:
         result = False
@@ -118,10 +120,9 @@ def contains(keyword, case_sensitive=False, output_to_test=None):
     return {"result": result, "reason": reason}
 
 
-@magik_eval
-def regex(pattern, output_to_test=None):
-    match = re.search(pattern, output_to_test)
-    if match:
+def _search_pattern(compiled_pattern, output_to_test):
+    pattern = compiled_pattern.pattern
+    if compiled_pattern.search(output_to_test):
         return {"result": True, "reason": f"regex pattern {pattern} found in output"}
     else:
         return {
@@ -130,6 +131,41 @@ def regex(pattern, output_to_test=None):
         }
 
 
+def _prepare_regex(pattern, flags=0):
+    return {"compiled_pattern": compile_pattern(pattern, flags)}
+
+
+# pattern can be a string or a precompiled pattern
+@magik_eval(prepare=_prepare_regex)
+def regex(pattern, flags=0, compiled_pattern=None, output_to_test=None):
+    return _search_pattern(compiled_pattern, output_to_test)
+
+
+def _prepare_pattern_scanner(patterns):
+    # patterns is the name of a registered pattern set, a {name: pattern}
+    # dict or a list of patterns
+    if isinstance(patterns, str):
+        patterns = get_pattern_set(patterns)
+    elif not isinstance(patterns, dict):
+        patterns = {
+            getattr(pattern, "pattern", pattern): pattern for pattern in patterns
+        }
+    return {"scanner": PatternScanner(patterns)}
+
+
+@magik_eval(prepare=_prepare_pattern_scanner)
+def contains_none_of_patterns(patterns, scanner=None, output_to_test=None):
+    found_patterns = [
+        name for name in scanner.patterns if name in scanner.scan(output_to_test)
+    ]
+    if found_patterns:
+        return {
+            "result": False,
+            "reason": "patterns found in output: " + ", ".join(found_patterns),
+        }
+    return {"result": True, "reason": "no patterns found in output"}
+
+
 @magik_eval
 def starts_with(substring, case_sensitive=False, output_to_test=None):
     if case_sensitive == False:
@@ -154,160 +190,170 @@ def ends_with(substring, case_sensitive=False, output_to_test=None):
         return {"result": result, "reason": "output does not end with " + substring}
 
 
-@magik_eval
+# eval_rubric is a string that contains the rubric by which to evaluate the output
+@magik_eval(rubric=lambda eval_rubric: eval_rubric)
 def grade_using_llm(eval_rubric, output_to_test=None):
-    openai = OpenAI()
-    # eval_rubric is a string that contains the rubric by which to evaluate the output
-    evaluation_prompt = generate_grading_prompt(output_to_test, eval_rubric)
-    llm_response = openai.openai_chat_completion_message(
-        model=OPEN_AI_DEFAULT_MODEL, prompt=evaluation_prompt
-    )
-
-    # llm_response_dict is a dictionary that contains the response from the LLM
-    llm_response_dict = ast.literal_eval(llm_response)
-
-    # result is the true / false value from the LLM
-    result = llm_response_dict["test_result"]
-    reason = llm_response_dict["reason"]
-
-    # output the result of the evaluation
-    if result != True and result != False:
-        result = False
-        reason = "LLM response does not contain a boolean value"
-    return {"result": result, "reason": reason}
+    return get_grader().grade([(output_to_test, eval_rubric)])[0]
 
 
 @magik_eval
 def is_email(output_to_test=None):
-    return regex(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$")(output_to_test)
+    return _search_pattern(get_pattern("is_email"), output_to_test)
 
 
 @magik_eval
 def is_phone_number(output_to_test=None):
-    return regex(r"^\+?1?\d{9,15}$")(output_to_test)
+    return _search_pattern(get_pattern("is_phone_number"), output_to_test)
 
 
 # Generated by chatGPT (regex might need some work)
 @magik_eval
 def contains_email(output_to_test=None):
-    return regex(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")(output_to_test)
+    return _search_pattern(get_pattern("email_address"), output_to_test)
 
 
 # Generated by chatGPT (regex might need some work)
 @magik_eval
 def contains_phone_number(output_to_test=None):
-    pattern = r"\+?\d{1,3}[-\s]?\(?\d{3}\)?[-\s]?\d{3}[-\s]?\d{2,4}|\(\d{3}\)\s?\d{3}[-\s]?\d{4}"
-    return regex(pattern)(output_to_test)
+    return _search_pattern(get_pattern("phone_number_in_text"), output_to_test)
 
 
 # Placeholder function to be replaced by an actual sentiment score function
-@magik_eval
+positive_sentiment_rubric = """
+    If the string has a positive sentiment, then the test_result is True. Otherwise, it is false.
+"""
+
+
+@magik_eval(rubric=lambda: positive_sentiment_rubric)
 def is_positive_sentiment(output_to_test=None):
-    sentiment_grading_prompt = """
-        If the string has a positive sentiment, then the test_result is True. Otherwise, it is false.
-    """
-    return grade_using_llm(sentiment_grading_prompt)(output_to_test)
+    return grade_using_llm(positive_sentiment_rubric)(output_to_test)
 
 
 # Placeholder function to be replaced by an actual sentiment score function
-@magik_eval
+negative_sentiment_rubric = """
+    If the string has a negative sentiment, then the test passed. Otherwise, the test failed.
+"""
+
+
+@magik_eval(rubric=lambda: negative_sentiment_rubric)
 def is_negative_sentiment(output_to_test=None):
-    sentiment_grading_prompt = """
-        If the string has a negative sentiment, then the test passed. Otherwise, the test failed.
-    """
-    return grade_using_llm(sentiment_grading_prompt)(output_to_test)
+    return grade_using_llm(negative_sentiment_rubric)(output_to_test)
 
 
-@magik_eval
+contains_pii_rubric = """
+    If the string contains information that looks like personally identifiable information, then the test passed. Otherwise, the test failed.
+"""
+
+
+@magik_eval(rubric=lambda: contains_pii_rubric)
 def contains_pii(output_to_test=None):
-    pii_grading_prompt = """
-        If the string contains information that looks like personally identifiable information, then the test passed. Otherwise, the test failed.
-    """
-    return grade_using_llm(pii_grading_prompt)(output_to_test)
+    return grade_using_llm(contains_pii_rubric)(output_to_test)
 
 
-@magik_eval
+not_contains_pii_rubric = """
+    If the string contains information that looks like personally identifiable information, then the test failed. Otherwise, the test passed.
+"""
+
+
+@magik_eval(rubric=lambda: not_contains_pii_rubric)
 def not_contains_pii(output_to_test=None):
-    pii_grading_prompt = """
-        If the string contains information that looks like personally identifiable information, then the test failed. Otherwise, the test passed.
-    """
-    return grade_using_llm(pii_grading_prompt)(output_to_test)
+    return grade_using_llm(not_contains_pii_rubric)(output_to_test)
 
 
 @magik_eval
 def contains_link(output_to_test=None):
-    pattern = r"(?!.*@)(?:https?://)?(?:www\.)?\S+\.\S+"
-    result = bool(re.search(pattern, output_to_test))
+    result = bool(get_pattern("link").search(output_to_test))
     if result:
         return {"result": True, "reason": "Link found in output"}
     else:
         return {"result": False, "reason": "No link found in output"}
 
 
+def _check_links(outputs_to_test):
+    # The links of every output are checked together, each link once
+    links_by_output = [extract_links(output) for output in outputs_to_test]
+    with time_phase(PHASE_LINK_CHECK):
+        results = get_link_checker().check_many(
+            [link for links in links_by_output for link in links]
+        )
+    return links_by_output, results
+
+
+def _describe_links(links):
+    if len(links) == 1:
+        return f"link {links[0]}"
+    return "links " + ", ".join(links)
+
+
+def _no_invalid_links_batch(outputs_to_test=None):
+    links_by_output, results = _check_links(outputs_to_test)
+    eval_results = []
+    for links in links_by_output:
+        invalid_links = [link for link in links if not results[link]["valid"]]
+        if not links:
+            eval_results.append({"result": True, "reason": "no link found in output"})
+        elif invalid_links:
+            verb = "is" if len(invalid_links) == 1 else "are"
+            eval_results.append(
+                {
+                    "result": False,
+                    "reason": f"{_describe_links(invalid_links)} found in output but {verb} invalid",
+                }
+            )
+        else:
+            verb = "is" if len(links) == 1 else "are"
+            eval_results.append(
+                {
+                    "result": True,
+                    "reason": f"{_describe_links(links)} found in output and {verb} valid",
+                }
+            )
+    return eval_results
+
+
 # Checks that there are no invalid links in the output
 # If there is no link, this test will pass
-# If there is a valid link, this test will pass
+# If all the links are valid, this test will pass
 # If there is an invalid link (ex: 404), this test will fail
-@magik_eval
+@magik_eval(batch=_no_invalid_links_batch)
 def no_invalid_links(output_to_test=None):
-    pattern = r"(?!.*@)(?:https?://)?(?:www\.)?\S+\.\S+"
-    link_match = re.search(pattern=pattern, string=output_to_test)
-    if link_match:
-        matched_url = link_match.group()
-        if matched_url:
-            standardized_url = standardize_url(matched_url)
-            try:
-                response = requests.head(standardized_url)
-                if response.status_code == 200:
-                    return {
-                        "result": True,
-                        "reason": f"link {matched_url} found in output and is valid",
-                    }
-                else:
-                    return {
-                        "result": False,
-                        "reason": f"link {matched_url} found in output but is invalid",
-                    }
-            except:
-                return {
+    return _no_invalid_links_batch([output_to_test])[0]
+
+
+def _contains_valid_link_batch(outputs_to_test=None):
+    links_by_output, results = _check_links(outputs_to_test)
+    eval_results = []
+    for links in links_by_output:
+        valid_links = [link for link in links if results[link]["valid"]]
+        if valid_links:
+            verb = "is" if len(valid_links) == 1 else "are"
+            eval_results.append(
+                {
+                    "result": True,
+                    "reason": f"{_describe_links(valid_links)} found in output and {verb} valid",
+                }
+            )
+        elif links:
+            verb = "is" if len(links) == 1 else "are"
+            eval_results.append(
+                {
                     "result": False,
-                    "reason": f"link {matched_url} found in output but is invalid",
+                    "reason": f"{_describe_links(links)} found in output but {verb} invalid",
                 }
-    return {"result": True, "reason": f"no link found in output"}
+            )
+        else:
+            eval_results.append({"result": False, "reason": "no link found in output"})
+    return eval_results
 
 
-@magik_eval
+@magik_eval(batch=_contains_valid_link_batch)
 def contains_valid_link(output_to_test=None):
-    pattern = r"(?!.*@)(?:https?://)?(?:www\.)?\S+\.\S+"
-    link_match = re.search(pattern=pattern, string=output_to_test)
-    if link_match:
-        matched_url = link_match.group()
-        if matched_url:
-            standardized_url = standardize_url(matched_url)
-            try:
-                response = requests.head(standardized_url)
-                if response.status_code == 200:
-                    return {
-                        "result": True,
-                        "reason": f"link {matched_url} found in output and is valid",
-                    }
-                else:
-                    return {
-                        "result": False,
-                        "reason": f"link {matched_url} found in output but is invalid",
-                    }
-            except:
-                return {
-                    "result": False,
-                    "reason": f"link {matched_url} found in output but is invalid",
-                }
-    return {"result": False, "reason": f"no link found in output"}
+    return _contains_valid_link_batch([output_to_test])[0]
 
 
 @magik_eval
 def contains_credit_card_number(output_to_test=None):
-    pattern = r"\b(?:\d[ -]*?){13,16}\b"
-    result = bool(re.search(pattern, output_to_test))
+    result = bool(get_pattern("credit_card_number").search(output_to_test))
     if result:
         return {"result": True, "reason": f"credit card number found in output"}
     else:
@@ -360,8 +406,7 @@ def is_json(output_to_test=None):
 @magik_eval
 def contains_json(output_to_test=None):
     trimmed_output = output_to_test.strip()
-    pattern = r"^\{.*\}$|^\[.*\]$"
-    result = bool(re.search(pattern, trimmed_output, re.DOTALL))
+    result = bool(get_pattern("json_document").search(trimmed_output))
     if result:
         return {
             "result": True,
@@ -374,7 +419,16 @@ def contains_json(output_to_test=None):
         }
 
 
-@magik_eval
+def _similarity_embedding_texts(
+    compare_against: str,
+    threshold: float,
+    model="text-embedding-ada-002",
+    outputs_to_test=None,
+):
+    return {model: [*outputs_to_test, compare_against]}
+
+
+@magik_eval(embeddings=_similarity_embedding_texts)
 def cosine_similarity_above_threshold(
     compare_against: str,
     threshold: float,
@@ -389,7 +443,7 @@ def cosine_similarity_above_threshold(
     }
 
 
-@magik_eval
+@magik_eval(embeddings=_similarity_embedding_texts)
 def cosine_similarity_below_threshold(
     compare_against: str,
     threshold: float,
@@ -404,6 +458,68 @@ def cosine_similarity_below_threshold(
     }
 
 
+def _prepare_reference_index(
+    references: list[str],
+    threshold: float,
+    model="text-embedding-ada-002",
+):
+    # The references are embedded on the first evaluation, along with the
+    # outputs when the runner embeds the texts of a run in batches
+    return {"reference_index": SimilarityIndex(texts=references, model=model)}
+
+
+def _reference_embedding_texts(
+    references: list[str],
+    threshold: float,
+    model="text-embedding-ada-002",
+    reference_index=None,
+    outputs_to_test=None,
+):
+    return {model: [*outputs_to_test, *references]}
+
+
+def _max_similarity_result(score, reference_index_position, threshold):
+    result = bool(score > threshold)
+    return {
+        "result": result,
+        "reason": f"max cosine similarity score is {score} (reference {reference_index_position}) and is {'above' if result else 'not above'} threshold {threshold}",
+    }
+
+
+def _max_similarities_above_threshold(
+    references: list[str],
+    threshold: float,
+    model="text-embedding-ada-002",
+    reference_index=None,
+    outputs_to_test=None,
+):
+    embeddings = get_embeddings(outputs_to_test, model)
+    scores, indices = reference_index.max_similarity(embeddings)
+    return [
+        _max_similarity_result(score, index, threshold)
+        for score, index in zip(scores, indices)
+    ]
+
+
+# Passes if the output is similar enough to any of the references
+@magik_eval(
+    prepare=_prepare_reference_index,
+    batch=_max_similarities_above_threshold,
+    embeddings=_reference_embedding_texts,
+)
+def max_similarity_above_threshold(
+    references: list[str],
+    threshold: float,
+    model="text-embedding-ada-002",
+    reference_index=None,
+    output_to_test=None,
+):
+    scores, indices = reference_index.max_similarity(
+        get_embeddings([output_to_test], model)
+    )
+    return _max_similarity_result(scores[0], indices[0], threshold)
+
+
 @magik_eval
 def matches_desired_classification(
     classification_labels_and_descriptions: list[dict],
@@ -433,7 +549,7 @@ def api_call(
     output_to_test=None,
 ):
     payload["output_to_test"] = output_to_test
-    response = requests.post(url, json=payload, headers=headers)
+    response = send_http_request("POST", url, json=payload, headers=headers)
     result = response.json().get("result")
     reason = response.json().get("reason")
 
@@ -443,18 +559,19 @@ def api_call(
     }
 
 
-@magik_eval
-def levenshtein_distance_below_threshold(
-    compare_against: str,
-    threshold: float,
-    output_to_test=None,
-):
-    distance = levenshtein_distance(output_to_test, compare_against)
+def _format_distance(distance, max_distance):
+    # Distances above max_distance are only known to be at least max_distance + 1
+    if max_distance is not None and distance > max_distance:
+        return f"at least {distance}"
+    return str(distance)
+
+
+def _levenshtein_below_threshold_result(distance, threshold, max_distance=None):
     result = distance < threshold
     reason = (
         f"levenshtein distance is {distance} and is below threshold {threshold}"
         if result
-        else f"levenshtein distance is {distance} and is not below threshold {threshold}"
+        else f"levenshtein distance is {_format_distance(distance, max_distance)} and is not below threshold {threshold}"
     )
     return {
         "result": result,
@@ -462,16 +579,10 @@ def levenshtein_distance_below_threshold(
     }
 
 
-@magik_eval
-def levenshtein_distance_above_threshold(
-    compare_against: str,
-    threshold: float,
-    output_to_test=None,
-):
-    distance = levenshtein_distance(output_to_test, compare_against)
+def _levenshtein_above_threshold_result(distance, threshold, max_distance=None):
     result = distance > threshold
     reason = (
-        f"levenshtein distance is {distance} and is above threshold {threshold}"
+        f"levenshtein distance is {_format_distance(distance, max_distance)} and is above threshold {threshold}"
         if result
         else f"levenshtein distance is {distance} and is not above threshold {threshold}"
     )
@@ -481,7 +592,68 @@ def levenshtein_distance_above_threshold(
     }
 
 
-@magik_eval
+def _levenshtein_distances_below_threshold(
+    compare_against: str,
+    threshold: float,
+    outputs_to_test=None,
+):
+    distances = levenshtein_distances(
+        outputs_to_test, [compare_against] * len(outputs_to_test)
+    )
+    return [
+        _levenshtein_below_threshold_result(distance, threshold)
+        for distance in distances
+    ]
+
+
+def _levenshtein_distances_above_threshold(
+    compare_against: str,
+    threshold: float,
+    outputs_to_test=None,
+):
+    distances = levenshtein_distances(
+        outputs_to_test, [compare_against] * len(outputs_to_test)
+    )
+    return [
+        _levenshtein_above_threshold_result(distance, threshold)
+        for distance in distances
+    ]
+
+
+@magik_eval(batch=_levenshtein_distances_below_threshold)
+def levenshtein_distance_below_threshold(
+    compare_against: str,
+    threshold: float,
+    output_to_test=None,
+):
+    # Any distance of at least ceil(threshold) fails, so stop computing there
+    max_distance = max(0, math.ceil(threshold) - 1)
+    distance = levenshtein_distance(output_to_test, compare_against, max_distance)
+    return _levenshtein_below_threshold_result(distance, threshold, max_distance)
+
+
+@magik_eval(batch=_levenshtein_distances_above_threshold)
+def levenshtein_distance_above_threshold(
+    compare_against: str,
+    threshold: float,
+    output_to_test=None,
+):
+    # Any distance above floor(threshold) passes, so stop computing there
+    max_distance = max(0, math.floor(threshold))
+    distance = levenshtein_distance(output_to_test, compare_against, max_distance)
+    return _levenshtein_above_threshold_result(distance, threshold, max_distance)
+
+
+def _combined_embedding_texts(functions: list[Any], outputs_to_test=None):
+    texts_by_model = {}
+    for fn in functions:
+        if hasattr(fn, "embedding_texts"):
+            for model, texts in fn.embedding_texts(outputs_to_test).items():
+                texts_by_model.setdefault(model, []).extend(texts)
+    return texts_by_model
+
+
+@magik_eval(embeddings=_combined_embedding_texts)
 def _and(functions: list[Any], output_to_test=None):
     for fn in functions:
         fn_res = fn(output_to_test)
@@ -495,7 +667,7 @@ def _and(functions: list[Any], output_to_test=None):
     return {"result": True, "reason": "All functions returned True"}
 
 
-@magik_eval
+@magik_eval(embeddings=_combined_embedding_texts)
 def _or(functions: list[Any], output_to_test=None):
     for fn in functions:
         fn_res = fn(output_to_test)
@@ -0,0 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Sequence
+
+
+def map_concurrently(
+    fn: Callable[[Any], Any], items: Sequence[Any], concurrency: int = 1
+) -> List[Any]:
+    """
+    Apply fn to every item using up to `concurrency` worker threads.
+
+    Results are returned in the same order as items, regardless of the order
+    in which the workers finish.
+    """
+    if concurrency <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as pool:
+        return list(pool.map(fn, items))
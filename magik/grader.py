@@ -0,0 +1,349 @@
+import ast
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .internal_logger import logger
+from .cache import CACHE_MODE_OFF, CACHE_MODE_ON, DiskCache, make_cache_key
+from .cassette import is_recording
+from .config import get_cache_ttl_seconds
+from .constants import (
+    DEFAULT_VERDICT_CACHE_MAX_SIZE_MB,
+    GRADING_BATCH_MAX_TOKENS,
+    GRADING_BATCH_SIZE,
+    OPEN_AI_DEFAULT_MODEL,
+    VERDICT_CACHE_DIR,
+)
+from .executor import map_concurrently
+from .openai_helper import OpenAI, get_shared_openai
+from .rate_limiter import estimate_tokens
+from .types.test_run import EvalResult
+from .usage import current_trackers, use_trackers
+from .utils import generate_grading_prompt
+
+# An output to grade and the rubric to grade it by
+GradingItem = Tuple[str, str]
+
+UNPARSABLE_VERDICT_REASON = "LLM response does not contain a boolean value"
+
+batch_grading_prompt = """
+    You are grading response strings, each according to the grading criteria listed for it.
+
+    For each string and each of its grading criteria, if the grading criteria is true, then the test_result is True. Otherwise, it is false.
+
+    Explain the reason for each test_result in the reason field.
+
+    Respond with a JSON array, with one object per string and grading criteria, that looks like this:
+    [{"index": 0, "criteria": 1, "test_result": true, "reason": "..."}, {"index": 0, "criteria": 2, "test_result": false, "reason": "..."}]
+    Respond with the JSON array only.
+
+    Example:
+
+    Grading Criteria 1: If the fact is true, then the test_result is True. Otherwise, it is false.
+    Grading Criteria 2: Mentions the sun
+    String 0 (Grading Criteria 1, 2): "Earth is the second planet from the sun."
+    String 1 (Grading Criteria 1): "Earth is the third planet."
+    [{"index": 0, "criteria": 1, "test_result": false, "reason": "The string is factually inaccurate - Earth is actually the third planet from the sun."}, {"index": 0, "criteria": 2, "test_result": true, "reason": "The string mentions the sun."}, {"index": 1, "criteria": 1, "test_result": true, "reason": "The string is factually accurate."}]
+
+    Now grade these strings, which are JSON encoded:
+"""
+
+# Objects without nested braces, to pick verdicts out of a malformed response
+_OBJECT = re.compile(r"\{[^{}]*\}")
+
+
+class VerdictCache:
+    """
+    Caches the verdicts of graded outputs keyed by grader model, rubric and
+    output.
+    """
+
+    def __init__(self, disk_cache: DiskCache, mode: str = CACHE_MODE_ON):
+        self.disk_cache = disk_cache
+        self.mode = mode
+
+    def get(self, model: str, rubric: str, output: str) -> Optional[EvalResult]:
+        # While recording, requests must reach the cassette
+        if self.mode != CACHE_MODE_ON or is_recording():
+            return None
+        return self.disk_cache.get(self._key(model, rubric, output))
+
+    def set(self, model: str, rubric: str, output: str, verdict: EvalResult):
+        if self.mode == CACHE_MODE_OFF:
+            return
+        self.disk_cache.set(self._key(model, rubric, output), verdict)
+
+    def _key(self, model: str, rubric: str, output: str) -> str:
+        return make_cache_key("verdict", model, rubric, output)
+
+
+class BatchGrader:
+    """
+    Grades outputs with an LLM, according to a rubric per output.
+
+    Many (output, rubric) items are packed into a single prompt, which asks
+    for an indexed verdict per item. An output graded by several rubrics
+    (ex: by several evaluators of a run) is listed once. Items whose verdict
+    is missing from the response, or can't be parsed, are graded one by one.
+    Verdicts are cached, so an output is graded once per rubric and grader
+    model.
+    """
+
+    def __init__(
+        self,
+        openai: OpenAI,
+        verdict_cache: Optional[VerdictCache] = None,
+        model: str = OPEN_AI_DEFAULT_MODEL,
+        max_batch_size: int = GRADING_BATCH_SIZE,
+        max_batch_tokens: int = GRADING_BATCH_MAX_TOKENS,
+    ):
+        self.openai = openai
+        self.verdict_cache = verdict_cache
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+    def grade(
+        self, items: Sequence[GradingItem], concurrency: int = 1
+    ) -> List[EvalResult]:
+        """
+        Returns a verdict per (output, rubric) item. Up to concurrency
+        grading requests are sent at once.
+        """
+        verdicts: Dict[GradingItem, EvalResult] = {}
+        missing_items = []
+        for item in dict.fromkeys(items):
+            verdict = self._cached_verdict(item)
+            if verdict is None:
+                missing_items.append(item)
+            else:
+                verdicts[item] = verdict
+
+        # Requests sent by the workers count in the usage of this thread
+        trackers = current_trackers()
+
+        def grade_items(batch: List[GradingItem]) -> Dict[GradingItem, EvalResult]:
+            with use_trackers(trackers):
+                return self._grade_items(batch)
+
+        batch_verdicts = map_concurrently(
+            grade_items, self._split_batches(missing_items), concurrency=concurrency
+        )
+        for batch_verdict in batch_verdicts:
+            verdicts.update(batch_verdict)
+        return [verdicts[item] for item in items]
+
+    def _grade_items(self, batch: List[GradingItem]) -> Dict[GradingItem, EvalResult]:
+        if len(batch) == 1:
+            return {batch[0]: self._grade_one(batch[0])}
+        verdicts = {}
+        batch_verdicts = self._grade_batch(batch)
+        for index, item in enumerate(batch):
+            verdict = batch_verdicts.get(index)
+            if verdict is None:
+                verdict = self._grade_one(item)
+            else:
+                self._cache_verdict(item, verdict)
+            verdicts[item] = verdict
+        return verdicts
+
+    def _grade_batch(self, batch: List[GradingItem]) -> Dict[int, EvalResult]:
+        # Each output is listed once, with every rubric it is graded by, and
+        # each rubric once, so several rubrics on an output share the prompt
+        rubric_numbers: Dict[str, int] = {}
+        output_indices: Dict[str, int] = {}
+        rubrics_by_output: Dict[str, List[int]] = {}
+        for output, rubric in batch:
+            rubric_number = rubric_numbers.setdefault(rubric, len(rubric_numbers) + 1)
+            output_indices.setdefault(output, len(output_indices))
+            rubrics_by_output.setdefault(output, []).append(rubric_number)
+        lines = [
+            f"Grading Criteria {number}: {rubric.strip()}"
+            for rubric, number in rubric_numbers.items()
+        ]
+        lines.extend(
+            f"String {output_indices[output]} (Grading Criteria {', '.join(map(str, numbers))}): {json.dumps(output, ensure_ascii=False)}"
+            for output, numbers in rubrics_by_output.items()
+        )
+        prompt = batch_grading_prompt + "\n".join(lines)
+        llm_response = self.openai.openai_chat_completion_message(
+            model=self.model, prompt=prompt
+        )
+
+        keys = [
+            (output_indices[output], rubric_numbers[rubric]) for output, rubric in batch
+        ]
+        verdicts = parse_verdicts(llm_response, keys)
+        if len(verdicts) < len(batch):
+            logger.debug(
+                f"Grading {len(batch) - len(verdicts)} of {len(batch)} items one by one, their verdicts could not be parsed"
+            )
+        return {
+            position: verdicts[key]
+            for position, key in enumerate(keys)
+            if key in verdicts
+        }
+
+    def _grade_one(self, item: GradingItem) -> EvalResult:
+        output, rubric = item
+        llm_response = self.openai.openai_chat_completion_message(
+            model=self.model, prompt=generate_grading_prompt(output, rubric)
+        )
+        verdict = parse_verdict(llm_response)
+        if verdict is None:
+            return {"result": False, "reason": UNPARSABLE_VERDICT_REASON}
+        self._cache_verdict(item, verdict)
+        return verdict
+
+    def _split_batches(self, items: List[GradingItem]) -> List[List[GradingItem]]:
+        # The rubrics of an output stay in the same batch. Like
+        # split_embedding_batches, an output larger than the limits on its
+        # own gets a batch of its own.
+        rubrics_by_output: Dict[str, List[str]] = {}
+        for output, rubric in items:
+            rubrics_by_output.setdefault(output, []).append(rubric)
+
+        batches: List[List[GradingItem]] = []
+        batch: List[GradingItem] = []
+        batch_tokens = 0
+        for output, rubrics in rubrics_by_output.items():
+            tokens = estimate_tokens(output) + sum(map(estimate_tokens, rubrics))
+            if batch and (
+                len(batch) + len(rubrics) > self.max_batch_size
+                or batch_tokens + tokens > self.max_batch_tokens
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.extend((output, rubric) for rubric in rubrics)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _cached_verdict(self, item: GradingItem) -> Optional[EvalResult]:
+        if self.verdict_cache is None:
+            return None
+        output, rubric = item
+        return self.verdict_cache.get(self.model, rubric, output)
+
+    def _cache_verdict(self, item: GradingItem, verdict: EvalResult):
+        if self.verdict_cache is not None:
+            output, rubric = item
+            self.verdict_cache.set(self.model, rubric, output, verdict)
+
+
+def parse_verdicts(
+    llm_response: str, keys: Sequence[Tuple[int, int]]
+) -> Dict[Tuple[int, int], EvalResult]:
+    """
+    Parse the verdicts of a batch grading response, by (string index,
+    grading criteria number) key. Verdicts that are missing, malformed or not
+    in keys are left out.
+    """
+    objects = None
+    start, end = llm_response.find("["), llm_response.rfind("]")
+    if start != -1 and end > start:
+        objects = _parse_literal(llm_response[start : end + 1])
+    if not isinstance(objects, list):
+        # Ex: a response cut short, or with a stray character in one verdict
+        objects = [_parse_literal(match) for match in _OBJECT.findall(llm_response)]
+    objects = [item for item in objects if isinstance(item, dict)]
+
+    criteria_by_index: Dict[int, List[int]] = {}
+    for index, criteria in keys:
+        criteria_by_index.setdefault(index, []).append(criteria)
+
+    # Verdicts without an index are taken in order, if there is one per key
+    positional = len(objects) == len(keys) and all(
+        "index" not in item for item in objects
+    )
+    verdicts: Dict[Tuple[int, int], EvalResult] = {}
+    for position, item in enumerate(objects):
+        if positional:
+            key = keys[position]
+        else:
+            index = _parse_index(item.get("index"))
+            criteria = _parse_index(item.get("criteria"))
+            # The criteria can be left out for a string with a single one
+            if criteria is None and len(criteria_by_index.get(index, [])) == 1:
+                criteria = criteria_by_index[index][0]
+            key = (index, criteria)
+        verdict = _to_verdict(item)
+        if verdict is None or key[1] not in criteria_by_index.get(key[0], ()):
+            continue
+        verdicts.setdefault(key, verdict)
+    return verdicts
+
+
+def parse_verdict(llm_response: str) -> Optional[EvalResult]:
+    """
+    Parse the verdict of a single item grading response.
+    Returns None if it doesn't contain one.
+    """
+    start, end = llm_response.find("{"), llm_response.rfind("}")
+    if start == -1 or end < start:
+        return None
+    item = _parse_literal(llm_response[start : end + 1])
+    if not isinstance(item, dict):
+        return None
+    return _to_verdict(item)
+
+
+def _parse_literal(text: str) -> Any:
+    # JSON, or a Python literal (ex: True instead of true, single quotes)
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def _parse_index(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def _to_verdict(item: Dict[str, Any]) -> Optional[EvalResult]:
+    result = item.get("test_result")
+    if isinstance(result, str) and result.strip().lower() in ("true", "false"):
+        result = result.strip().lower() == "true"
+    if not isinstance(result, bool):
+        return None
+    reason = item.get("reason")
+    return {"result": result, "reason": reason if isinstance(reason, str) else ""}
+
+
+# Process-wide grader, so verdicts are shared by every evaluator of a run
+_grader: Optional[BatchGrader] = None
+_grader_lock = threading.Lock()
+
+
+def get_grader() -> BatchGrader:
+    global _grader
+    with _grader_lock:
+        if _grader is None:
+            verdict_cache = VerdictCache(
+                DiskCache(
+                    cache_dir=VERDICT_CACHE_DIR,
+                    max_size_bytes=DEFAULT_VERDICT_CACHE_MAX_SIZE_MB * 1024 * 1024,
+                    ttl_seconds=get_cache_ttl_seconds(),
+                )
+            )
+            _grader = BatchGrader(get_shared_openai(), verdict_cache)
+        return _grader
+
+
+def set_grading_cache_mode(mode: str):
+    """
+    Apply a cache mode (on, off or refresh) to the verdict cache.
+    """
+    get_grader().verdict_cache.mode = mode
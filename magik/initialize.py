@@ -105,7 +105,7 @@ def _add_to_gitignore():
 
     with open(gitignore_path, "a") as gitignore_file:
         gitignore_file.write(
-            "\n# Magik config file\nmagik_config.json\nmagik_tests/test_runs/*\n"
+            "\n# Magik config file\nmagik_config.json\nmagik_tests/test_runs/*\nmagik_tests/.cache/\n"
         )
 
     logger.info(f"✅ Added {CONFIG_FILE_PATH} to {gitignore_path}")
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from .internal_logger import logger
+from .utils import json_default
+from .types.test_run import TestRunDetails, TestRunUnit
+
+
+def generate_run_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+class RunJournal:
+    """
+    An append-only JSONL record of every completed (test, repetition) of a run.
+
+    The first line holds the settings the run was started with, and every
+    following line holds the result of one test run. If a run dies halfway,
+    the journal can be loaded again to skip the work that was already done.
+    """
+
+    def __init__(self, path: str, run_id: str, settings: Dict[str, Any]):
+        self.path = path
+        self.run_id = run_id
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._results: Dict[Tuple[int, int], Dict[str, Any]] = {}
+
+    @classmethod
+    def create(cls, test_runs_dir: str, settings: Dict[str, Any]) -> "RunJournal":
+        run_id = generate_run_id()
+        path = cls._journal_path(test_runs_dir, run_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        journal = cls(path, run_id, settings)
+        journal._write_line({"run_id": run_id, "settings": settings})
+        return journal
+
+    @classmethod
+    def load(cls, test_runs_dir: str, run_id: str) -> "RunJournal":
+        path = cls._journal_path(test_runs_dir, run_id)
+        if not os.path.isfile(path):
+            raise Exception(f"No run found with id {run_id} at {path}")
+
+        with open(path, "r") as file:
+            content = file.read()
+        if not content.endswith("\n"):
+            # Terminate a partially written last line before appending to it
+            with open(path, "a") as file:
+                file.write("\n")
+        lines = content.splitlines()
+
+        header = json.loads(lines[0])
+        journal = cls(path, run_id, header["settings"])
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line may be incomplete if the run was killed mid-write
+                logger.debug(f"Skipping unreadable journal line: {line}")
+                continue
+            journal._results[(entry["test_index"], entry["run_index"])] = entry
+        return journal
+
+    @staticmethod
+    def _journal_path(test_runs_dir: str, run_id: str) -> str:
+        return f"{test_runs_dir}/journals/{run_id}.jsonl"
+
+    def get_completed_run_details(
+        self, unit: TestRunUnit, description: str
+    ) -> Optional[TestRunDetails]:
+        """
+        Returns the journaled run details for a unit, or None if it still
+        needs to run. Errored runs and runs of a test whose description has
+        changed since they were journaled are run again.
+        """
+        entry = self._results.get((unit["test_index"], unit["run_index"]))
+        if entry is None or entry["description"] != description:
+            return None
+        if entry["run_details"]["result"] is None:
+            return None
+        return entry["run_details"]
+
+    @property
+    def completed_count(self) -> int:
+        return sum(
+            1
+            for entry in self._results.values()
+            if entry["run_details"]["result"] is not None
+        )
+
+    def append(self, unit: TestRunUnit, description: str, run_details: TestRunDetails):
+        entry = {
+            "test_index": unit["test_index"],
+            "run_index": unit["run_index"],
+            "description": description,
+            "run_details": run_details,
+        }
+        with self._lock:
+            self._results[(unit["test_index"], unit["run_index"])] = entry
+            self._write_line(entry)
+
+    def _write_line(self, data: Dict[str, Any]):
+        with open(self.path, "a") as file:
+            file.write(json.dumps(data, default=json_default) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
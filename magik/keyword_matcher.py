@@ -0,0 +1,149 @@
+from collections import deque
+from typing import Dict, List, Sequence, Set
+
+# Below this many keywords, one C-level `in` scan per keyword beats a single
+# pass of the automaton in Python (the crossover is around 100 keywords)
+AUTOMATON_MIN_KEYWORDS = 64
+
+
+def _is_word_character(character: str) -> bool:
+    return character.isalnum() or character == "_"
+
+
+class KeywordMatcher:
+    """
+    Finds which of a set of keywords occur in a text.
+
+    Large keyword sets are compiled into an Aho-Corasick automaton, which finds
+    every keyword in a single pass over the text, so matching is linear in the
+    length of the text regardless of the number of keywords.
+
+    Matching is case insensitive unless case_sensitive is set. With
+    whole_words, a keyword only matches if it is not directly preceded or
+    followed by a letter, digit or underscore.
+    """
+
+    def __init__(
+        self,
+        keywords: Sequence[str],
+        case_sensitive: bool = False,
+        whole_words: bool = False,
+    ):
+        self.case_sensitive = case_sensitive
+        self.whole_words = whole_words
+        # Keywords as they are matched (lowercased if case insensitive)
+        self.keywords: List[str] = [self._normalize(keyword) for keyword in keywords]
+        self._use_automaton = (
+            whole_words or len(self.keywords) >= AUTOMATON_MIN_KEYWORDS
+        )
+        if self._use_automaton:
+            self._build_automaton()
+
+    def _normalize(self, text: str) -> str:
+        return text if self.case_sensitive else text.lower()
+
+    def _build_automaton(self):
+        # Trie of the distinct keywords. State 0 is the root.
+        transitions: List[Dict[str, int]] = [{}]
+        # Indices (into self.keywords) of the keywords ending at each state
+        outputs: List[List[int]] = [[]]
+        for keyword_index, keyword in enumerate(self.keywords):
+            state = 0
+            for character in keyword:
+                next_state = transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(transitions)
+                    transitions[state][character] = next_state
+                    transitions.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(keyword_index)
+
+        # Breadth first, resolve failure links into a complete transition
+        # table, so matching never has to follow failure links at runtime.
+        # Characters missing from a state's table lead back to the root.
+        failure = [0] * len(transitions)
+        queue = deque()
+        for state in transitions[0].values():
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[failure[state]]
+            for character, next_state in list(transitions[state].items()):
+                queue.append(next_state)
+                fallback = failure[state]
+                while fallback and character not in transitions[fallback]:
+                    fallback = failure[fallback]
+                failure[next_state] = transitions[fallback].get(character, 0)
+                if failure[next_state] == next_state:
+                    failure[next_state] = 0
+            # Inherit the transitions of the failure state
+            for character, next_state in transitions[failure[state]].items():
+                transitions[state].setdefault(character, next_state)
+
+        self._transitions = transitions
+        self._outputs = outputs
+        self._lengths = [len(keyword) for keyword in self.keywords]
+
+    def find(self, text: str) -> Set[int]:
+        """
+        Returns the indices of the keywords that occur in text.
+        """
+        text = self._normalize(text)
+        if not self._use_automaton:
+            return {
+                keyword_index
+                for keyword_index, keyword in enumerate(self.keywords)
+                if keyword in text
+            }
+
+        # The empty keyword is in every text
+        found = {
+            keyword_index
+            for keyword_index, keyword in enumerate(self.keywords)
+            if not keyword
+        }
+        transitions = self._transitions
+        outputs = self._outputs
+        root = transitions[0]
+        state = 0
+        for position, character in enumerate(text):
+            state = transitions[state].get(character)
+            if state is None:
+                state = root.get(character, 0)
+            if outputs[state]:
+                for keyword_index in outputs[state]:
+                    if not self.whole_words or self._is_whole_word(
+                        text, position - self._lengths[keyword_index] + 1, position
+                    ):
+                        found.add(keyword_index)
+        return found
+
+    def _is_whole_word(self, text: str, start: int, end: int) -> bool:
+        if start > 0 and _is_word_character(text[start - 1]):
+            return False
+        if end + 1 < len(text) and _is_word_character(text[end + 1]):
+            return False
+        return True
+
+    def found_keywords(self, text: str) -> List[str]:
+        """
+        Returns the keywords that occur in text, in the order they were given.
+        """
+        found = self.find(text)
+        return [
+            keyword
+            for keyword_index, keyword in enumerate(self.keywords)
+            if keyword_index in found
+        ]
+
+    def missing_keywords(self, text: str) -> List[str]:
+        """
+        Returns the keywords that don't occur in text, in the order they were given.
+        """
+        found = self.find(text)
+        return [
+            keyword
+            for keyword_index, keyword in enumerate(self.keywords)
+            if keyword_index not in found
+        ]
@@ -0,0 +1,207 @@
+import ipaddress
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, TypedDict
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from .cache import CACHE_MODE_OFF, CACHE_MODE_ON, DiskCache, make_cache_key
+from .cassette import is_recording, send_http_request
+from .config import get_link_cache_ttl_seconds
+from .constants import (
+    DEFAULT_LINK_CACHE_MAX_SIZE_MB,
+    DEFAULT_LINK_CACHE_TTL_SECONDS,
+    LINK_CACHE_DIR,
+    LINK_CHECK_CONCURRENCY,
+    LINK_CHECK_MAX_CONNECTIONS_PER_HOST,
+    LINK_CHECK_TIMEOUT,
+)
+from .executor import map_concurrently
+from .patterns import get_pattern
+from .utils import standardize_url
+
+# Characters around a link that belong to the surrounding text
+LEADING_PUNCTUATION = "(<[{\"'"
+TRAILING_PUNCTUATION = ".,;:!?)>]}\"'"
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_HOST_NAME = re.compile(r"^[a-z0-9-]+(?:\.[a-z0-9-]+)+$")
+_TOP_LEVEL_DOMAIN = re.compile(r"^(?:[a-z]{2,63}|xn--[a-z0-9-]+)$")
+
+
+class LinkCheckResult(TypedDict):
+    valid: bool
+    status_code: Optional[int]  # None if the server couldn't be reached
+    error: Optional[str]
+
+
+def extract_links(text: str) -> List[str]:
+    """
+    Returns the unique links found in text, in order.
+    """
+    links = []
+    for match in get_pattern("link").finditer(text):
+        # The domain of an email address
+        if match.start() > 0 and text[match.start() - 1] == "@":
+            continue
+        link = match.group().lstrip(LEADING_PUNCTUATION).rstrip(TRAILING_PUNCTUATION)
+        if _has_valid_host(link):
+            links.append(link)
+    return list(dict.fromkeys(links))
+
+
+def _has_valid_host(link: str) -> bool:
+    # The link pattern matches any dotted token (ex: "e.g", "1.2.3"), so only
+    # hosts with a top level domain of letters, or IP addresses, are links
+    try:
+        host = urlsplit(standardize_url(link)).hostname
+    except ValueError:
+        return False
+    if not host:
+        return False
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        pass
+    return bool(
+        _HOST_NAME.match(host) and _TOP_LEVEL_DOMAIN.match(host.rsplit(".", 1)[-1])
+    )
+
+
+def normalize_url(url: str) -> str:
+    """
+    Returns the URL with a scheme, a lowercase host, no default port and no
+    fragment, which the server never sees.
+    """
+    parts = urlsplit(standardize_url(url))
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    default_port = _DEFAULT_PORTS.get(scheme)
+    if default_port is not None and netloc.endswith(f":{default_port}"):
+        netloc = netloc[: -len(f":{default_port}")]
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+class LinkChecker:
+    """
+    Checks that links resolve, concurrently, through a pooled session.
+
+    A link is checked with a HEAD request, then with a GET of its first byte
+    if HEAD didn't succeed, since some servers don't support HEAD. Redirects
+    are followed. The session keeps at most max_connections_per_host
+    connections to each host, and reuses them.
+
+    Results are cached by normalized URL, for the TTL of the cache. Timeouts
+    are not cached, since the next check may well succeed.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[DiskCache] = None,
+        mode: str = CACHE_MODE_ON,
+        timeout: float = LINK_CHECK_TIMEOUT,
+        concurrency: int = LINK_CHECK_CONCURRENCY,
+        max_connections_per_host: int = LINK_CHECK_MAX_CONNECTIONS_PER_HOST,
+    ):
+        self.cache = cache
+        self.mode = mode
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        # With pool_block, requests to a busy host wait for one of its
+        # connections instead of opening more
+        adapter = HTTPAdapter(
+            pool_connections=concurrency,
+            pool_maxsize=max_connections_per_host,
+            pool_block=True,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def check(self, url: str) -> LinkCheckResult:
+        return self.check_many([url])[url]
+
+    def check_many(self, urls: Sequence[str]) -> Dict[str, LinkCheckResult]:
+        """
+        Returns the result of every link, by link. Each normalized URL is
+        checked once.
+        """
+        normalized_urls = {url: normalize_url(url) for url in urls}
+        unique_urls = list(dict.fromkeys(normalized_urls.values()))
+        results = map_concurrently(
+            self._check_normalized_url, unique_urls, concurrency=self.concurrency
+        )
+        results_by_url = dict(zip(unique_urls, results))
+        return {url: results_by_url[normalized_urls[url]] for url in urls}
+
+    def _check_normalized_url(self, url: str) -> LinkCheckResult:
+        key = make_cache_key("link", url)
+        # While recording, requests must reach the cassette
+        if self.cache is not None and self.mode == CACHE_MODE_ON and not is_recording():
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
+        try:
+            response = self._send("HEAD", url)
+            if not _is_success(response.status_code):
+                response = self._send("GET", url, headers={"Range": "bytes=0-0"})
+            result: LinkCheckResult = {
+                "valid": _is_success(response.status_code),
+                "status_code": response.status_code,
+                "error": None,
+            }
+        except requests.exceptions.Timeout as e:
+            return {"valid": False, "status_code": None, "error": str(e)}
+        except Exception as e:
+            # Ex: the host doesn't exist
+            result = {"valid": False, "status_code": None, "error": str(e)}
+
+        if self.cache is not None and self.mode != CACHE_MODE_OFF:
+            self.cache.set(key, result)
+        return result
+
+    def _send(self, method: str, url: str, **kwargs):
+        return send_http_request(
+            method,
+            url,
+            session=self.session,
+            allow_redirects=True,
+            timeout=self.timeout,
+            **kwargs,
+        )
+
+
+def _is_success(status_code: int) -> bool:
+    return 200 <= status_code < 300
+
+
+# Process-wide checker, so every evaluator shares the connections and results
+_link_checker: Optional[LinkChecker] = None
+_link_checker_lock = threading.Lock()
+
+
+def get_link_checker() -> LinkChecker:
+    global _link_checker
+    with _link_checker_lock:
+        if _link_checker is None:
+            ttl_seconds = get_link_cache_ttl_seconds()
+            if ttl_seconds is None:
+                ttl_seconds = DEFAULT_LINK_CACHE_TTL_SECONDS
+            _link_checker = LinkChecker(
+                DiskCache(
+                    cache_dir=LINK_CACHE_DIR,
+                    max_size_bytes=DEFAULT_LINK_CACHE_MAX_SIZE_MB * 1024 * 1024,
+                    ttl_seconds=ttl_seconds,
+                )
+            )
+        return _link_checker
+
+
+def set_link_cache_mode(mode: str):
+    """
+    Apply a cache mode (on, off or refresh) to the link check cache.
+    """
+    get_link_checker().mode = mode
@@ -4,3 +4,14 @@ ssn = r"\d{3}-\d{2}-\d{4}"
 domain = r"(http:\/\/www\.|https:\/\/www\.|http:\/\/|https:\/\/)?[a-z0-9]+([\-\.]{1}[a-z0-9]+)*\.[a-z]{2,5}(:[0-9]{1,5})?(\/.*)?"
 phone_number = r"\+?[\d\s()-]*\d[\d\s()-]*"
 us_phone_number = r"(\+?1\s?)?((\(\d{3}\)|\d{3}))?[\s.-]?\d{3}[\s.-]?\d{4}"
+
+# Patterns used by the evaluators
+email_address = r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+"
+international_phone_number = r"\+?1?\d{9,15}"
+# Generated by chatGPT (regex might need some work)
+phone_number_in_text = (
+    r"\+?\d{1,3}[-\s]?\(?\d{3}\)?[-\s]?\d{3}[-\s]?\d{2,4}|\(\d{3}\)\s?\d{3}[-\s]?\d{4}"
+)
+link = r"(?!.*@)(?:https?://)?(?:www\.)?\S+\.\S+"
+credit_card_number = r"\b(?:\d[ -]*?){13,16}\b"
+json_document = r"^\{.*\}$|^\[.*\]$"
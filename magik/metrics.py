@@ -1,3 +1,7 @@
+import math
+from typing import List, Optional
+
+
 def calculate_flakiness_index(pass_rate_percentage: float):
     """
     Calculate the Flakiness Index from the pass rate percentage.
@@ -18,3 +22,75 @@ def calculate_flakiness_index(pass_rate_percentage: float):
     flakiness_index = (1 - abs(normalized_prp)) * 100
 
     return flakiness_index
+
+
+def calculate_pass_rate_interval(
+    passed: int, failed: int, z: float = 1.96
+) -> Optional[List[float]]:
+    """
+    Calculate the Wilson score confidence interval for the pass rate.
+
+    Parameters:
+        passed (int): The number of runs that passed.
+        failed (int): The number of runs that failed.
+        z (float): The z-score for the confidence level (1.96 for 95%).
+
+    Returns:
+        list: The [lower, upper] bounds of the pass rate as percentages between 0 and 100,
+        or None if there were no successful runs.
+    """
+    number_of_runs = passed + failed
+    if number_of_runs == 0:
+        return None
+
+    pass_rate = passed / number_of_runs
+    z_squared = z * z
+    denominator = 1 + z_squared / number_of_runs
+    center = (pass_rate + z_squared / (2 * number_of_runs)) / denominator
+    margin = (
+        z
+        * math.sqrt(
+            pass_rate * (1 - pass_rate) / number_of_runs
+            + z_squared / (4 * number_of_runs * number_of_runs)
+        )
+        / denominator
+    )
+
+    lower = max(0.0, center - margin) * 100
+    upper = min(1.0, center + margin) * 100
+    return [round(lower, 2), round(upper, 2)]
+
+
+def is_pass_rate_settled(
+    pass_rate_interval: List[float], target_width: float, threshold: float
+) -> bool:
+    """
+    Decide whether more runs of a test would still be informative.
+
+    Parameters:
+        pass_rate_interval (list): The [lower, upper] pass rate interval in percent.
+        target_width (float): Stop once the interval is narrower than this (in percentage points).
+        threshold (float): Stop once the interval lies entirely above or below this pass rate.
+
+    Returns:
+        bool: True if sampling for this test can stop.
+    """
+    lower, upper = pass_rate_interval
+    return upper - lower < target_width or lower > threshold or upper < threshold
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+
+    Parameters:
+        sorted_values (list): The values, sorted in ascending order.
+        percent (float): The percentile to compute, between 0 and 100.
+
+    Returns:
+        float: The smallest value that is greater than or equal to `percent` percent of the values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
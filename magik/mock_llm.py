@@ -0,0 +1,300 @@
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from .internal_logger import logger
+from .rate_limiter import TokenBucket, estimate_tokens
+
+DEFAULT_RESPONSE_TEMPLATE = "Mock response {index} from {model} to: {prompt}"
+DEFAULT_EMBEDDING_DIMENSIONS = 1536
+
+LATENCY_FIXED = "fixed"
+LATENCY_UNIFORM = "uniform"
+LATENCY_NORMAL = "normal"
+LATENCY_LOGNORMAL = "lognormal"
+LATENCY_DISTRIBUTIONS = [
+    LATENCY_FIXED,
+    LATENCY_UNIFORM,
+    LATENCY_NORMAL,
+    LATENCY_LOGNORMAL,
+]
+
+
+class MockLLM:
+    """
+    Generates OpenAI-shaped responses without calling a model.
+
+    Responses are deterministic: a prompt found in `responses` gets its canned
+    response, and any other prompt is rendered with `template` (which can use
+    {prompt}, {model}, {index} and {hash}). Latency, server errors and 429s
+    are injected at random according to the settings, seeded by `seed`.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        latency_jitter_ms: float = 0,
+        latency_distribution: str = LATENCY_FIXED,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        retry_after: float = 1,
+        responses: Optional[Dict[str, str]] = None,
+        template: str = DEFAULT_RESPONSE_TEMPLATE,
+        embedding_dimensions: int = DEFAULT_EMBEDDING_DIMENSIONS,
+        seed: Optional[int] = None,
+    ):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Invalid latency distribution: {latency_distribution}, "
+                f"expected one of {LATENCY_DISTRIBUTIONS}"
+            )
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_distribution = latency_distribution
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.responses = responses or {}
+        self.template = template
+        self.embedding_dimensions = embedding_dimensions
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.stats: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def handle(self, path: str, body: Dict[str, Any]) -> Tuple[int, Dict, Dict]:
+        """
+        Handle a request to an OpenAI endpoint.
+        Returns the status code, the extra headers and the JSON body of the response.
+        """
+        if path.endswith("/chat/completions"):
+            prompt = "\n".join(
+                str(message.get("content", "")) for message in body.get("messages", [])
+            )
+            endpoint = "chat_completion"
+        elif path.endswith("/completions"):
+            prompt = body.get("prompt", "")
+            if isinstance(prompt, list):
+                prompt = "\n".join(prompt)
+            endpoint = "completion"
+        elif path.endswith("/embeddings"):
+            inputs = body.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            prompt = "\n".join(inputs)
+            endpoint = "embedding"
+        else:
+            return 404, {}, _error_body(f"Unknown endpoint {path}", "invalid_request")
+
+        with self._lock:
+            latency = self._sample_latency()
+            failure = self._sample_failure(estimate_tokens(prompt))
+        time.sleep(latency)
+
+        if failure is not None:
+            self._count(failure)
+            if failure == "rate_limit":
+                return (
+                    429,
+                    {"Retry-After": str(self.retry_after)},
+                    _error_body("Rate limit reached (mock)", "requests"),
+                )
+            return 500, {}, _error_body("Server error (mock)", "server_error")
+
+        self._count(endpoint)
+        model = body.get("model", "")
+        if endpoint == "embedding":
+            return 200, {}, self._embedding_response(model, inputs)
+        return 200, {}, self._completion_response(endpoint, model, prompt, body)
+
+    def _sample_latency(self) -> float:
+        mean = self.latency_ms
+        jitter = self.latency_jitter_ms
+        if self.latency_distribution == LATENCY_UNIFORM:
+            latency = self._random.uniform(mean - jitter, mean + jitter)
+        elif self.latency_distribution == LATENCY_NORMAL:
+            latency = self._random.gauss(mean, jitter)
+        elif self.latency_distribution == LATENCY_LOGNORMAL and mean > 0:
+            # Long tailed, like real model latencies. The jitter is the
+            # standard deviation of the distribution.
+            sigma = math.sqrt(math.log(1 + (jitter / mean) ** 2))
+            latency = self._random.lognormvariate(math.log(mean) - sigma**2 / 2, sigma)
+        else:
+            latency = mean
+        return max(0.0, latency) / 1000
+
+    def _sample_failure(self, tokens: int) -> Optional[str]:
+        if self.request_bucket is not None and self.request_bucket.reserve(1) > 0:
+            self.request_bucket.refund(1)
+            return "rate_limit"
+        if self.token_bucket is not None and self.token_bucket.reserve(tokens) > 0:
+            self.token_bucket.refund(tokens)
+            return "rate_limit"
+        if self._random.random() < self.rate_limit_rate:
+            return "rate_limit"
+        if self._random.random() < self.error_rate:
+            return "server_error"
+        return None
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def render_response(self, model: str, prompt: str, index: int) -> str:
+        if prompt in self.responses:
+            return self.responses[prompt]
+        digest = hashlib.sha256(f"{model}\0{prompt}\0{index}".encode("utf-8"))
+        return self.template.format(
+            prompt=prompt, model=model, index=index, hash=digest.hexdigest()[:8]
+        )
+
+    def _completion_response(
+        self, endpoint: str, model: str, prompt: str, body: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        n = int(body.get("n") or 1)
+        choices = []
+        completion_tokens = 0
+        for index in range(n):
+            text = self.render_response(model, prompt, index)
+            completion_tokens += estimate_tokens(text)
+            if endpoint == "chat_completion":
+                choices.append(
+                    {
+                        "index": index,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                )
+            else:
+                choices.append(
+                    {
+                        "index": index,
+                        "text": text,
+                        "finish_reason": "stop",
+                        "logprobs": None,
+                    }
+                )
+
+        prompt_tokens = estimate_tokens(prompt)
+        return {
+            "id": f"mock-{uuid.uuid4().hex}",
+            "object": (
+                "chat.completion"
+                if endpoint == "chat_completion"
+                else "text_completion"
+            ),
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _embedding_response(self, model: str, inputs: List[str]) -> Dict[str, Any]:
+        prompt_tokens = sum(estimate_tokens(text) for text in inputs)
+        return {
+            "object": "list",
+            "model": model,
+            "data": [
+                {"object": "embedding", "index": index, "embedding": self.embed(text)}
+                for index, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+    def embed(self, text: str) -> List[float]:
+        """
+        A deterministic unit vector for a text. Equal texts get equal vectors,
+        anything else is close to orthogonal.
+        """
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16)
+        generator = random.Random(seed)
+        vector = [generator.gauss(0, 1) for _ in range(self.embedding_dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+
+def _error_body(message: str, error_type: str) -> Dict[str, Any]:
+    return {
+        "error": {"message": message, "type": error_type, "param": None, "code": None}
+    }
+
+
+def _make_handler(mock_llm: MockLLM):
+    class MockLLMRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._respond(
+                    400, {}, _error_body("Invalid JSON body", "invalid_request")
+                )
+                return
+            status, headers, response = mock_llm.handle(self.path, body)
+            self._respond(status, headers, response)
+
+        def _respond(self, status: int, headers: Dict[str, str], body: Dict[str, Any]):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            logger.debug(f"mock-llm: {format % args}")
+
+    return MockLLMRequestHandler
+
+
+class MockLLMServer:
+    """
+    An HTTP server that speaks the OpenAI chat completion, completion and
+    embedding APIs, backed by a MockLLM. Point OPEN_AI_API_BASE at its
+    api_base to run tests against it.
+    """
+
+    def __init__(self, mock_llm: MockLLM, host: str = "127.0.0.1", port: int = 8000):
+        self.mock_llm = mock_llm
+        self.server = ThreadingHTTPServer((host, port), _make_handler(mock_llm))
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self) -> "MockLLMServer":
+        """
+        Serve in a background thread, for use from benchmarks.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
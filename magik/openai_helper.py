@@ -1,10 +1,31 @@
 import openai
-from tenacity import retry, stop_after_attempt, wait_fixed
-from .constants import API_BASE_URL
+import threading
+from typing import Dict, List, Optional, TypedDict
+import numpy as np
+from .constants import (
+    API_BASE_URL,
+    OPEN_AI_DEFAULT_MAX_RETRIES,
+    OPEN_AI_DEFAULT_REQUEST_TIMEOUT,
+)
 from .config import (
     get_open_ai_api_key,
     get_open_ai_default_model,
     get_magik_api_key,
+    get_open_ai_rate_limits,
+    get_open_ai_max_retries,
+    get_open_ai_request_timeout,
+    get_open_ai_api_base,
+)
+from .cache import ResponseCache
+from .cassette import get_active_cassette
+from .embedding_store import get_embedding_store
+from .embedding_batcher import get_batched_embedding, split_embedding_batches
+from .retry_policy import RetryPolicy
+from .usage import record_usage
+from .rate_limiter import (
+    DEFAULT_COMPLETION_TOKENS_ESTIMATE,
+    RateLimiter,
+    estimate_tokens,
 )
 
 chat_completion_models = ["gpt-3.5-turbo", "gpt-4"]
@@ -13,66 +34,275 @@ is_chat_model = lambda model: model in chat_completion_models
 is_completion_model = lambda model: model in completion_models
 
 
+class OpenAIChoices(TypedDict):
+    choices: List[str]
+    usage: Dict[str, int]
+
+
+# Process-wide rate limiter shared by every OpenAI instance, so concurrent
+# test runs and evaluators queue up instead of failing with 429s
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(get_open_ai_rate_limits())
+        return _rate_limiter
+
+
+# Process-wide retry policy, so retry counters cover every request of a run
+_retry_policy: Optional[RetryPolicy] = None
+_retry_policy_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    global _retry_policy
+    with _retry_policy_lock:
+        if _retry_policy is None:
+            max_retries = get_open_ai_max_retries()
+            if max_retries is None:
+                max_retries = OPEN_AI_DEFAULT_MAX_RETRIES
+            _retry_policy = RetryPolicy(
+                max_attempts=max_retries + 1,
+                request_timeout=get_open_ai_request_timeout()
+                or OPEN_AI_DEFAULT_REQUEST_TIMEOUT,
+            )
+        return _retry_policy
+
+
 class OpenAI:
-    def __init__(self):
+    def __init__(self, response_cache: Optional[ResponseCache] = None):
         self.openai = openai
+        self.response_cache = response_cache
+        self.embedding_store = get_embedding_store()
+        self.rate_limiter = get_rate_limiter()
+        self.retry_policy = get_retry_policy()
         self.default_model = get_open_ai_default_model()
         self.magik_api_key = get_magik_api_key()
         self.openai.api_key = get_open_ai_api_key()
+        # Lets requests go to an OpenAI compatible server, like magik mock-llm
+        api_base = get_open_ai_api_base()
+        if api_base:
+            self.openai.api_base = api_base
 
     # Methods that call OpenAI API
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
-    def openai_chat_completion(self, model, prompt):
+    def openai_chat_completion(self, model, prompt, **params):
         """
         Call the OpenAI API to generate a chat completion for models like GPT 3.5 turbo and GPT 4
         """
-        return self.openai.ChatCompletion.create(
-            model=model, messages=[{"role": "user", "content": prompt}]
+        return self._create(
+            self.openai.ChatCompletion,
+            model=model,
+            estimated_tokens=self._estimate_request_tokens(prompt, params),
+            messages=[{"role": "user", "content": prompt}],
+            **params,
         )
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
-    def openai_completion(self, model, prompt):
+    def openai_completion(self, model, prompt, **params):
         """
         Call the OpenAI API to generate a completion for models like text davinci 003
         """
-        return self.openai.Completion.create(model=model, prompt=prompt)
+        return self._create(
+            self.openai.Completion,
+            model=model,
+            estimated_tokens=self._estimate_request_tokens(prompt, params),
+            prompt=prompt,
+            **params,
+        )
+
+    def get_embeddings(
+        self, texts: List[str], model="text-embedding-ada-002"
+    ) -> List[np.ndarray]:
+        """
+        Returns the embedding of every text. Texts that aren't in the batch of
+        the run being evaluated or in the embedding store are deduplicated and
+        sent in batched requests.
+        """
+        embeddings = {}
+        missing_texts = []
+        for text in dict.fromkeys(texts):
+            embedding = get_batched_embedding(model, text)
+            if embedding is None:
+                embedding = self.embedding_store.get(model, text)
+            if embedding is None:
+                missing_texts.append(text)
+            else:
+                embeddings[text] = embedding
+
+        for batch in split_embedding_batches(missing_texts):
+            response = self._create(
+                self.openai.Embedding,
+                model=model,
+                estimated_tokens=sum(estimate_tokens(text) for text in batch),
+                input=batch,
+            )
+            for item in response["data"]:
+                text = batch[item["index"]]
+                embeddings[text] = self.embedding_store.set(
+                    model, text, item["embedding"]
+                )
+        return [embeddings[text] for text in texts]
+
+    def _create(self, endpoint, model, estimated_tokens, **kwargs):
+        """
+        Send a request to an OpenAI endpoint, retrying transient errors
+        according to the retry policy
+        """
+        send = lambda: self.retry_policy.call(
+            self._send, endpoint, model, estimated_tokens, **kwargs
+        )
+        cassette = get_active_cassette()
+        if cassette is not None:
+            response = cassette.call(
+                "openai",
+                {"endpoint": endpoint.__name__, "model": model, **kwargs},
+                send,
+                serialize=lambda response: response.to_dict_recursive(),
+                deserialize=self.openai.util.convert_to_openai_object,
+            )
+        else:
+            response = send()
+        record_usage(model, response.get("usage"))
+        return response
+
+    def _send(self, endpoint, model, estimated_tokens, **kwargs):
+        """
+        Send a single request to an OpenAI endpoint within the rate limits for the model
+        """
+        if self.retry_policy.request_timeout:
+            kwargs.setdefault("request_timeout", self.retry_policy.request_timeout)
+        self.rate_limiter.acquire(model, estimated_tokens)
+        try:
+            response = endpoint.create(model=model, **kwargs)
+        except Exception:
+            # Failed requests don't consume tokens
+            self.rate_limiter.reconcile(model, estimated_tokens, 0)
+            raise
+        usage = response.get("usage") or {}
+        self.rate_limiter.reconcile(
+            model, estimated_tokens, usage.get("total_tokens", estimated_tokens)
+        )
+        return response
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
-    def get_embedding(self, text: str, model="text-embedding-ada-002") -> list[float]:
-        return self.openai.Embedding.create(input=[text], model=model)["data"][0][
-            "embedding"
-        ]
+    def _estimate_request_tokens(self, prompt, params) -> int:
+        completion_tokens = params.get("max_tokens", DEFAULT_COMPLETION_TOKENS_ESTIMATE)
+        return estimate_tokens(prompt) + completion_tokens * params.get("n", 1)
 
     # Convenience method to call openai completion or chat completion
-    def get_openai_response(self, model, prompt):
+    def get_openai_response(self, model, prompt, **params):
         if is_chat_model(model):
-            return self.openai_chat_completion(model=model, prompt=prompt)
+            return self.openai_chat_completion(model=model, prompt=prompt, **params)
         elif is_completion_model(model):
-            return self.openai_completion(model=model, prompt=prompt)
+            return self.openai_completion(model=model, prompt=prompt, **params)
         else:
             raise ValueError("Invalid model: {}".format(model))
 
     # Convenience methods that call OpenAI and return just the message content string
-    def get_openai_response_message(self, model, prompt):
+    def get_openai_response_message(self, model, prompt, run_index=0, **params):
+        """
+        Returns the message content string for a prompt.
+
+        Responses are looked up in the response cache (if any) by model, prompt,
+        sampling params and run_index, so each repetition of a test gets its own
+        cached response.
+        """
+        if self.response_cache is not None:
+            cached_message = self.response_cache.get(model, prompt, params, run_index)
+            if cached_message is not None:
+                return cached_message
+
         if is_chat_model(model):
-            return self.openai_chat_completion_message(model=model, prompt=prompt)
+            message = self.openai_chat_completion_message(
+                model=model, prompt=prompt, **params
+            )
         elif is_completion_model(model):
-            return self.openai_completion_message(model=model, prompt=prompt)
+            message = self.openai_completion_message(
+                model=model, prompt=prompt, **params
+            )
         else:
             raise ValueError("Invalid model: {}".format(model))
 
-    def openai_chat_completion_message(self, model, prompt):
+        if self.response_cache is not None:
+            self.response_cache.set(model, prompt, params, run_index, message)
+        return message
+
+    def get_openai_response_messages(
+        self, model, prompt, run_indices: List[int], **params
+    ) -> List[str]:
+        """
+        Returns one message content string per run index for a prompt.
+
+        Cached responses are reused, and all missing responses are requested
+        together as n choices of a single API call.
+        """
+        messages: Dict[int, str] = {}
+        if self.response_cache is not None:
+            for run_index in run_indices:
+                cached_message = self.response_cache.get(
+                    model, prompt, params, run_index
+                )
+                if cached_message is not None:
+                    messages[run_index] = cached_message
+
+        missing_run_indices = [i for i in run_indices if i not in messages]
+        if missing_run_indices:
+            response = self.get_openai_response_choices(
+                model, prompt, n=len(missing_run_indices), **params
+            )
+            for run_index, message in zip(missing_run_indices, response["choices"]):
+                messages[run_index] = message
+                if self.response_cache is not None:
+                    self.response_cache.set(model, prompt, params, run_index, message)
+
+        return [messages[run_index] for run_index in run_indices]
+
+    def get_openai_response_choices(
+        self, model, prompt, n=1, **params
+    ) -> OpenAIChoices:
+        """
+        Generate n choices for a prompt in a single API call.
+        Returns all the message content strings along with the token usage
+        """
+        if n > 1:
+            params["n"] = n
+        response = self.get_openai_response(model, prompt, **params)
+        choices = sorted(response.choices, key=lambda choice: choice.index)
+        if is_chat_model(model):
+            messages = [choice.message.content for choice in choices]
+        else:
+            messages = [choice.text for choice in choices]
+        if len(messages) < n:
+            raise ValueError(f"Expected {n} choices but received {len(messages)}")
+        return {"choices": messages, "usage": dict(response.get("usage", {}))}
+
+    def openai_chat_completion_message(self, model, prompt, **params):
         """
         Call the OpenAI API to generate a chat completion for models like GPT 3.5 turbo and GPT 4
         Returns just the message content string
         """
-        response = self.openai_chat_completion(model, prompt)
+        response = self.openai_chat_completion(model, prompt, **params)
         return response.choices[0].message.content
 
-    def openai_completion_message(self, model, prompt):
+    def openai_completion_message(self, model, prompt, **params):
         """
         Call the OpenAI API to generate a completion for models like text davinci 003
         Returns just the message content string
         """
-        response = self.openai_completion(model, prompt)
+        response = self.openai_completion(model, prompt, **params)
         return response.choices[0].text
+
+
+# Process-wide client for evaluators, so they don't load the config on every call
+_shared_openai: Optional[OpenAI] = None
+_shared_openai_lock = threading.Lock()
+
+
+def get_shared_openai() -> OpenAI:
+    global _shared_openai
+    with _shared_openai_lock:
+        if _shared_openai is None:
+            _shared_openai = OpenAI()
+        return _shared_openai
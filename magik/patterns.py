@@ -0,0 +1,202 @@
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple, Union
+from . import matchers
+
+PatternLike = Union[str, Pattern]
+
+# Above this many characters, separate searches beat the combined regex,
+# since an alternation loses the literal prefix optimizations of each pattern
+COMBINED_SCAN_MAX_LENGTH = 512
+
+# Backreferences can't be renumbered when patterns are combined
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class PatternRegistry:
+    """
+    Compiles regex patterns once and keeps them by name.
+
+    Named patterns can be grouped into named sets (ex: "pii"), to be scanned
+    together with a PatternScanner.
+    """
+
+    def __init__(self):
+        self._compiled: Dict[Tuple[str, int], Pattern] = {}
+        self._named: Dict[str, Pattern] = {}
+        self._sets: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def compile(self, pattern: PatternLike, flags: int = 0) -> Pattern:
+        """
+        Returns the compiled pattern, compiling it on first use.
+        Precompiled patterns are returned as is.
+        """
+        if isinstance(pattern, re.Pattern):
+            return pattern
+        key = (pattern, flags)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = re.compile(pattern, flags)
+            with self._lock:
+                self._compiled[key] = compiled
+        return compiled
+
+    def register(
+        self,
+        name: str,
+        pattern: PatternLike,
+        flags: int = 0,
+        sets: Iterable[str] = (),
+    ) -> Pattern:
+        compiled = self.compile(pattern, flags)
+        with self._lock:
+            self._named[name] = compiled
+            for set_name in sets:
+                names = self._sets.setdefault(set_name, [])
+                if name not in names:
+                    names.append(name)
+        return compiled
+
+    def get(self, name: str) -> Pattern:
+        try:
+            return self._named[name]
+        except KeyError:
+            raise KeyError(f"No pattern registered with name {name}")
+
+    def get_set(self, set_name: str) -> Dict[str, Pattern]:
+        try:
+            names = self._sets[set_name]
+        except KeyError:
+            raise KeyError(f"No pattern set registered with name {set_name}")
+        return {name: self._named[name] for name in names}
+
+    def scanner(self, set_name: str) -> "PatternScanner":
+        return PatternScanner(self.get_set(set_name))
+
+
+class PatternScanner:
+    """
+    Reports which of many patterns occur in a text.
+
+    The patterns are combined into a single alternation, so a text where none
+    of them occur (the common case for blocklists) is scanned in one pass.
+    Matches consume text, so a pattern that only occurs inside the match of
+    another one can be hidden by it. Patterns that were not seen are searched
+    separately whenever the combined pass found something. Each pattern keeps
+    the semantics of re.search on the whole text, with its own flags.
+
+    Texts longer than COMBINED_SCAN_MAX_LENGTH, and patterns that can't be
+    combined (ex: patterns with backreferences), are searched separately.
+    """
+
+    def __init__(self, patterns: Dict[str, PatternLike]):
+        self.patterns: Dict[str, Pattern] = {
+            name: registry.compile(pattern) for name, pattern in patterns.items()
+        }
+        self._group_names: Dict[str, str] = {}
+        self._separate: Dict[str, Pattern] = {}
+        alternatives = []
+        for index, (name, pattern) in enumerate(self.patterns.items()):
+            if not isinstance(pattern.pattern, str) or _BACKREFERENCE.search(
+                pattern.pattern
+            ):
+                self._separate[name] = pattern
+                continue
+            group_name = f"_magik_pattern_{index}"
+            self._group_names[group_name] = name
+            alternatives.append(f"(?P<{group_name}>{_scoped(pattern)})")
+
+        self._combined: Optional[Pattern] = None
+        if alternatives:
+            try:
+                self._combined = re.compile("|".join(alternatives))
+            except re.error:
+                # Ex: two patterns define the same group name
+                self._separate.update(
+                    {name: self.patterns[name] for name in self._group_names.values()}
+                )
+                self._group_names = {}
+
+    def scan(self, text: str) -> Set[str]:
+        """
+        Returns the names of the patterns found in text.
+        """
+        if self._combined is None or len(text) > COMBINED_SCAN_MAX_LENGTH:
+            return {
+                name for name, pattern in self.patterns.items() if pattern.search(text)
+            }
+
+        found = set()
+        combined_names = set(self._group_names.values())
+        for match in self._combined.finditer(text):
+            found.add(self._group_names[match.lastgroup])
+            if len(found) == len(combined_names):
+                break
+        if found:
+            for name in combined_names - found:
+                if self.patterns[name].search(text):
+                    found.add(name)
+        for name, pattern in self._separate.items():
+            if pattern.search(text):
+                found.add(name)
+        return found
+
+
+def _scoped(pattern: Pattern) -> str:
+    # Apply the pattern's own flags to its part of the combined regex only
+    flags = ""
+    if pattern.flags & re.IGNORECASE:
+        flags += "i"
+    if pattern.flags & re.MULTILINE:
+        flags += "m"
+    if pattern.flags & re.DOTALL:
+        flags += "s"
+    if pattern.flags & re.VERBOSE:
+        flags += "x"
+    if pattern.flags & re.ASCII:
+        flags += "a"
+    if flags:
+        return f"(?{flags}:{pattern.pattern})"
+    return f"(?:{pattern.pattern})"
+
+
+# The registry shared by the evaluators
+registry = PatternRegistry()
+
+
+def compile_pattern(pattern: PatternLike, flags: int = 0) -> Pattern:
+    return registry.compile(pattern, flags)
+
+
+def register_pattern(
+    name: str, pattern: PatternLike, flags: int = 0, sets: Iterable[str] = ()
+) -> Pattern:
+    return registry.register(name, pattern, flags, sets)
+
+
+def get_pattern(name: str) -> Pattern:
+    return registry.get(name)
+
+
+def get_pattern_set(set_name: str) -> Dict[str, Pattern]:
+    return registry.get_set(set_name)
+
+
+# Patterns from matchers.py
+register_pattern("email", matchers.email, sets=["matchers", "pii"])
+register_pattern("ssn", matchers.ssn, sets=["matchers", "pii"])
+register_pattern("domain", matchers.domain, sets=["matchers"])
+register_pattern("phone_number", matchers.phone_number, sets=["matchers"])
+register_pattern("us_phone_number", matchers.us_phone_number, sets=["matchers", "pii"])
+
+# Patterns of the evaluators
+register_pattern("is_email", f"^{matchers.email_address}$")
+register_pattern("is_phone_number", f"^{matchers.international_phone_number}$")
+register_pattern("email_address", matchers.email_address, sets=["contact"])
+register_pattern(
+    "phone_number_in_text", matchers.phone_number_in_text, sets=["contact"]
+)
+register_pattern("link", matchers.link, sets=["contact"])
+register_pattern("credit_card_number", matchers.credit_card_number, sets=["pii"])
+register_pattern("json_document", matchers.json_document, flags=re.DOTALL)
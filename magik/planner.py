@@ -0,0 +1,93 @@
+from typing import Dict, List, Optional, Sequence, Tuple, TypedDict
+from .types.test_run import TokenUsage
+
+
+class GenerationJob(TypedDict):
+    model: str
+    prompt: str
+    run_index: int
+
+
+class GenerationBatch(TypedDict):
+    model: str
+    prompt: str
+    # Indices into GenerationPlan.jobs, one per choice requested
+    job_indices: List[int]
+    run_indices: List[int]
+
+
+class GenerationResult(TypedDict):
+    response: Optional[str]
+    error: Optional[str]
+    # Usage of the request that generated the response. A request for several
+    # choices is counted once, on the result of its first job.
+    usage: Optional[TokenUsage]
+    # How long the request took, for every job it generated
+    duration_ms: float
+
+
+class GenerationPlan:
+    """
+    Maps every (test, repetition) unit of a run onto a unique generation job.
+
+    Units that render to the same prompt for the same repetition share a single
+    job, so each distinct completion is generated exactly once per run.
+    """
+
+    def __init__(self):
+        self.jobs: List[GenerationJob] = []
+        # Index into self.jobs for every unit, in the order the units were added
+        self.unit_jobs: List[int] = []
+        self._job_indices: Dict[Tuple[str, str, int], int] = {}
+
+    def add_unit(self, model: str, prompt: str, run_index: int) -> int:
+        key = (model, prompt, run_index)
+        job_index = self._job_indices.get(key)
+        if job_index is None:
+            job_index = len(self.jobs)
+            self._job_indices[key] = job_index
+            self.jobs.append({"model": model, "prompt": prompt, "run_index": run_index})
+        self.unit_jobs.append(job_index)
+        return job_index
+
+    def batches(self, max_choices_per_request: int = 1) -> List[GenerationBatch]:
+        """
+        Group jobs for the same model and prompt (i.e. different repetitions)
+        so they can be requested as multiple choices of a single API call.
+        Each batch holds at most max_choices_per_request jobs.
+        """
+        grouped_job_indices: Dict[Tuple[str, str], List[int]] = {}
+        for job_index, job in enumerate(self.jobs):
+            key = (job["model"], job["prompt"])
+            grouped_job_indices.setdefault(key, []).append(job_index)
+
+        batch_size = max(1, max_choices_per_request)
+        batches: List[GenerationBatch] = []
+        for (model, prompt), job_indices in grouped_job_indices.items():
+            for start in range(0, len(job_indices), batch_size):
+                batch_job_indices = job_indices[start : start + batch_size]
+                batches.append(
+                    {
+                        "model": model,
+                        "prompt": prompt,
+                        "job_indices": batch_job_indices,
+                        "run_indices": [
+                            self.jobs[job_index]["run_index"]
+                            for job_index in batch_job_indices
+                        ],
+                    }
+                )
+        return batches
+
+
+def build_generation_plan(
+    model: str, prompts: Sequence[str], run_indices: Sequence[int]
+) -> GenerationPlan:
+    """
+    Build a plan for units given as parallel lists of rendered prompts and
+    repetition indices.
+    """
+    plan = GenerationPlan()
+    for prompt, run_index in zip(prompts, run_indices):
+        plan.add_unit(model, prompt, run_index)
+    return plan
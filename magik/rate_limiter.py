@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from .internal_logger import logger
+
+# Rough number of characters per token for English text
+CHARS_PER_TOKEN = 4
+# Tokens assumed for a completion when the request sets no max_tokens
+DEFAULT_COMPLETION_TOKENS_ESTIMATE = 256
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap estimate of the number of tokens in a string, used to budget
+    requests before they are sent. Actual usage is reconciled afterwards.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class TokenBucket:
+    """
+    A token bucket that refills continuously up to `per_minute` tokens.
+
+    Callers reserve tokens up front. The bucket is allowed to go into debt, and
+    reserve() returns how long the caller has to wait for the debt to be paid
+    off. This keeps waiting callers in FIFO order without a polling loop.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.refill_rate = self.capacity / 60  # tokens per second
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take `amount` tokens and return the number of seconds to wait before
+        they are available.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.refill_rate
+
+    def refund(self, amount: float):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+
+
+class RateLimiter:
+    """
+    Enforces requests-per-minute and tokens-per-minute budgets per model.
+
+    Limits are configured as {model: {"rpm": int, "tpm": int}}. The "*" entry
+    applies to every model that has no entry of its own. Models without any
+    limits are not throttled.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = limits or {}
+        self._buckets: Dict[
+            str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]
+        ] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, model: str, estimated_tokens: int):
+        """
+        Block until a request of estimated_tokens tokens can be sent for model.
+        """
+        request_bucket, token_bucket = self._get_buckets(model)
+        wait_seconds = 0.0
+        if request_bucket is not None:
+            wait_seconds = max(wait_seconds, request_bucket.reserve(1))
+        if token_bucket is not None:
+            wait_seconds = max(wait_seconds, token_bucket.reserve(estimated_tokens))
+
+        if wait_seconds > 0:
+            logger.debug(f"Rate limit reached for {model}, waiting {wait_seconds:.2f}s")
+            time.sleep(wait_seconds)
+
+    def reconcile(self, model: str, estimated_tokens: int, actual_tokens: int):
+        """
+        Correct the token budget once the actual usage of a request is known.
+        """
+        _, token_bucket = self._get_buckets(model)
+        if token_bucket is None:
+            return
+        difference = actual_tokens - estimated_tokens
+        if difference > 0:
+            # Used more than estimated - go into debt for later requests
+            token_bucket.reserve(difference)
+        elif difference < 0:
+            token_bucket.refund(-difference)
+
+    def _get_buckets(
+        self, model: str
+    ) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        with self._lock:
+            if model not in self._buckets:
+                model_limits = self.limits.get(model, self.limits.get("*", {}))
+                rpm = model_limits.get("rpm")
+                tpm = model_limits.get("tpm")
+                self._buckets[model] = (
+                    TokenBucket(rpm) if rpm else None,
+                    TokenBucket(tpm) if tpm else None,
+                )
+            return self._buckets[model]
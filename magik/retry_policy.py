@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional
+import openai
+from tenacity import (
+    RetryCallState,
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+)
+from .internal_logger import logger
+
+# Error classes
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_TIMEOUT = "timeout"
+ERROR_CONNECTION = "connection"
+ERROR_SERVER = "server_error"
+ERROR_QUOTA = "insufficient_quota"
+ERROR_BAD_REQUEST = "bad_request"
+ERROR_AUTH = "auth"
+ERROR_UNKNOWN = "unknown"
+
+RETRYABLE_ERROR_CLASSES = {
+    ERROR_RATE_LIMIT,
+    ERROR_TIMEOUT,
+    ERROR_CONNECTION,
+    ERROR_SERVER,
+}
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Classify an exception raised by an API call, to decide whether retrying
+    it can help.
+    """
+    if isinstance(error, openai.error.RateLimitError):
+        # Running out of quota is reported as a rate limit, but never recovers
+        if getattr(error, "code", None) == "insufficient_quota":
+            return ERROR_QUOTA
+        return ERROR_RATE_LIMIT
+    if isinstance(error, (openai.error.Timeout, TimeoutError)):
+        return ERROR_TIMEOUT
+    if isinstance(error, (openai.error.APIConnectionError, ConnectionError)):
+        return ERROR_CONNECTION
+    if isinstance(error, (openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+        return ERROR_SERVER
+    if isinstance(
+        error, (openai.error.AuthenticationError, openai.error.PermissionError)
+    ):
+        return ERROR_AUTH
+    if isinstance(error, openai.error.InvalidRequestError):
+        return ERROR_BAD_REQUEST
+
+    http_status = getattr(error, "http_status", None)
+    if http_status == 429:
+        return ERROR_RATE_LIMIT
+    if http_status is not None and http_status >= 500:
+        return ERROR_SERVER
+    if http_status in (401, 403):
+        return ERROR_AUTH
+    if http_status is not None and http_status >= 400:
+        return ERROR_BAD_REQUEST
+    return ERROR_UNKNOWN
+
+
+def get_retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    Returns the delay requested by the server through a Retry-After header.
+    """
+    headers = getattr(error, "headers", None) or {}
+    headers = {str(key).lower(): value for key, value in dict(headers).items()}
+
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        # Retry-After can also be an HTTP date
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Retries transient API errors with exponential backoff and decorrelated
+    jitter, honoring Retry-After hints from the server.
+
+    Errors like bad requests or invalid API keys are raised immediately.
+    The number of retries per error class is kept in retry_counts.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        request_timeout: Optional[float] = 60.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+        self.retry_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        # Delays of this call so far, for the decorrelated jitter
+        delays = [self.base_delay]
+        retrying = Retrying(
+            stop=stop_after_attempt(self.max_attempts),
+            wait=lambda retry_state: self._wait(retry_state, delays),
+            retry=retry_if_exception(self.is_retryable),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+        return retrying(fn, *args, **kwargs)
+
+    def is_retryable(self, error: BaseException) -> bool:
+        return classify_error(error) in RETRYABLE_ERROR_CLASSES
+
+    def _wait(self, retry_state: RetryCallState, delays: List[float]) -> float:
+        # Decorrelated jitter: grow from the previous delay, but randomly
+        delay = min(self.max_delay, random.uniform(self.base_delay, delays[-1] * 3))
+        delays.append(delay)
+
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        retry_after = get_retry_after_seconds(error) if error else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _before_sleep(self, retry_state: RetryCallState):
+        error = retry_state.outcome.exception()
+        error_class = classify_error(error)
+        with self._lock:
+            self.retry_counts[error_class] = self.retry_counts.get(error_class, 0) + 1
+        logger.debug(
+            f"Retrying after {error_class} error in {retry_state.next_action.sleep:.2f}s "
+            f"(attempt {retry_state.attempt_number}): {error}"
+        )
+
+    def get_retry_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.retry_counts)
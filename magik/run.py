@@ -1,32 +1,82 @@
+import threading
 import requests
 from .internal_logger import logger
 from .utils import substitute_vars
 from .openai_helper import OpenAI
 from .test_loader import TestLoader
-from .config import get_magik_api_key
-from .constants import RUN_URL
-from .metrics import calculate_flakiness_index
+from .config import get_magik_api_key, get_open_ai_max_choices_per_request
+from .constants import (
+    RUN_URL,
+    OPEN_AI_DEFAULT_MAX_CHOICES_PER_REQUEST,
+    ADAPTIVE_MIN_RUNS,
+    ADAPTIVE_DEFAULT_CI_WIDTH,
+    ADAPTIVE_DEFAULT_PASS_THRESHOLD,
+)
+from .metrics import (
+    calculate_flakiness_index,
+    calculate_pass_rate_interval,
+    is_pass_rate_settled,
+)
+from .executor import map_concurrently
+from .usage import add_usage, empty_usage, track_usage
+from .timing import (
+    PHASE_EVALUATION,
+    PHASE_GENERATION,
+    PHASE_LOGGING,
+    PHASES,
+    calculate_timing_stats,
+    collect_timings,
+    time_phase,
+)
+from .cache import CACHE_MODE_ON, create_response_cache
+from .embedding_store import set_embedding_cache_mode
+from .grader import get_grader, set_grading_cache_mode
+from .link_checker import set_link_cache_mode
+from .embedding_batcher import EmbeddingBatcher, use_embedding_batcher
+from .similarity import get_embeddings
+from .journal import RunJournal
+from .sharding import (
+    parse_shard,
+    read_shard_results,
+    shard_for_unit,
+    write_shard_results,
+)
+from .planner import GenerationBatch, GenerationResult, build_generation_plan
 from .types.test_run import (
+    BatchEvaluation,
     Test,
     TestSuiteResults,
     EvalResult,
     IndividualTestRunResult,
+    PrefetchedEmbeddings,
+    TestRunDetails,
+    TestRunStats,
+    TestRunUnit,
+    TokenUsage,
 )
 from .run_logger import (
     log_test_suite_results,
     log_test_run,
+    log_retry_counts,
+    log_timings,
     _log_test_suite_results_as_csv,
+    _log_timings_as_json,
 )
-from typing import TypedDict, Any, List, Dict, Optional
+from typing import TypedDict, Any, Callable, List, Dict, Optional, Tuple
 
 
 # This class is responsible for running tests
 class Run:
-    def __init__(self, test_dir: str, test_runs_dir: str):
-        self.saved_prompt_response = ""
+    def __init__(
+        self, test_dir: str, test_runs_dir: str, cache_mode: str = CACHE_MODE_ON
+    ):
         self.test_loader = TestLoader(test_dir=test_dir)
         self.test_runs_dir = test_runs_dir
-        self.openai = OpenAI()
+        self.openai = OpenAI(response_cache=create_response_cache(cache_mode))
+        set_embedding_cache_mode(cache_mode)
+        set_grading_cache_mode(cache_mode)
+        set_link_cache_mode(cache_mode)
+        self._log_lock = threading.Lock()
 
     def run_tests(
         self,
@@ -35,32 +85,123 @@ class Run:
         response: Optional[str] = None,
         number_of_runs: int = 1,
         csv_file_path: Optional[str] = None,
+        concurrency: int = 1,
+        timings_json_path: Optional[str] = None,
+        adaptive: bool = False,
+        ci_width: float = ADAPTIVE_DEFAULT_CI_WIDTH,
+        pass_threshold: float = ADAPTIVE_DEFAULT_PASS_THRESHOLD,
+        shard: Optional[str] = None,
+        shard_output: Optional[str] = None,
+        journal: Optional[RunJournal] = None,
     ):
+        if shard is not None:
+            parse_shard(shard)  # fail fast on an invalid shard spec
+            if adaptive:
+                raise ValueError("--adaptive cannot be combined with --shard")
+
+        if journal is None:
+            journal = RunJournal.create(
+                self.test_runs_dir,
+                settings={
+                    "test_name": test_name,
+                    "model": model,
+                    "response": response,
+                    "number_of_runs": number_of_runs,
+                    "adaptive": adaptive,
+                    "ci_width": ci_width,
+                    "pass_threshold": pass_threshold,
+                    "shard": shard,
+                    "shard_output": shard_output,
+                },
+            )
+        logger.info(
+            f"Run ID: {journal.run_id} (resume with --resume {journal.run_id})\n"
+        )
+
         test_context = self.test_loader._load_context(test_name)
         test_suite = self.test_loader._load_test_suite(
             test_name, test_context=test_context
         )
         raw_prompt = self.test_loader._load_prompt(test_name)
         log_file_path = self._log_file_path()
-        if response:
-            self._run_tests_for_prompt_response(
-                test_suite=test_suite,
-                raw_prompt=raw_prompt,
-                prompt_response=response,
-                log_file_path=log_file_path,
-                number_of_runs=number_of_runs,
-                csv_file_path=csv_file_path,
+        self._run_test_suite(
+            test_name=test_name,
+            test_suite=test_suite,
+            raw_prompt=raw_prompt,
+            model=model,
+            prompt_response=response if response else None,
+            log_file_path=log_file_path,
+            number_of_runs=number_of_runs,
+            csv_file_path=csv_file_path,
+            concurrency=concurrency,
+            timings_json_path=timings_json_path,
+            adaptive=adaptive,
+            ci_width=ci_width,
+            pass_threshold=pass_threshold,
+            shard=shard,
+            shard_output=shard_output,
+            journal=journal,
+        )
+
+    def resume_tests(
+        self,
+        test_name: str,
+        run_id: str,
+        csv_file_path: Optional[str] = None,
+        concurrency: int = 1,
+        timings_json_path: Optional[str] = None,
+    ):
+        """
+        Resume a run from its journal, with the settings it was started with.
+        Only test runs that did not complete successfully are run again.
+        """
+        journal = RunJournal.load(self.test_runs_dir, run_id)
+        settings = journal.settings
+        if settings["test_name"] != test_name:
+            raise ValueError(
+                f"Run {run_id} was started for test {settings['test_name']}, not {test_name}"
             )
-        else:
-            self._run_tests_for_prompt(
-                test_suite=test_suite,
-                raw_prompt=raw_prompt,
-                model=model,
-                log_file_path=log_file_path,
-                number_of_runs=number_of_runs,
-                csv_file_path=csv_file_path,
+
+        logger.info(
+            f"Resuming run {run_id}: {journal.completed_count} test runs already completed\n"
+        )
+        self.run_tests(
+            test_name,
+            model=settings["model"],
+            response=settings["response"],
+            number_of_runs=settings["number_of_runs"],
+            csv_file_path=csv_file_path,
+            concurrency=concurrency,
+            timings_json_path=timings_json_path,
+            adaptive=settings["adaptive"],
+            ci_width=settings["ci_width"],
+            pass_threshold=settings["pass_threshold"],
+            shard=settings.get("shard"),
+            shard_output=settings.get("shard_output"),
+            journal=journal,
+        )
+
+    def merge_shard_results(
+        self, shard_result_paths: List[str], csv_file_path: Optional[str] = None
+    ):
+        """
+        Combine the partial results written by `magik run --shard` into the
+        results of the whole test suite.
+        """
+        tests, results = read_shard_results(shard_result_paths)
+        test_suite_results = self._initialize_test_suite_result(tests)
+        for result in results:
+            test = tests[result["test_index"]]
+            test_suite_results[test["description"]]["run_details"].append(
+                result["run_details"]
             )
 
+        self._calculate_test_run_stats(test_suite_results)
+        log_test_suite_results(test_suite_results)
+
+        if csv_file_path:
+            _log_test_suite_results_as_csv(test_suite_results, csv_file_path)
+
     def run_tests_in_prod(self, start_date, end_date, prompt_slug, test_slug):
         request_data = {
             "source": "CLI",
@@ -100,6 +241,13 @@ class Run:
                 else:
                     stats["failed"] += 1
 
+            stats["number_of_runs"] = len(test_run_result["run_details"])
+            self._calculate_usage_stats(stats, test_run_result["run_details"])
+            self._calculate_timing_stats(stats, test_run_result["run_details"])
+            stats["pass_rate_interval"] = calculate_pass_rate_interval(
+                stats["passed"], stats["failed"]
+            )
+
             number_of_successful_runs = stats["passed"] + stats["failed"]
             if number_of_successful_runs > 0:
                 pass_rate_percentage: float = round(
@@ -108,139 +256,706 @@ class Run:
                 stats["pass_rate"] = pass_rate_percentage
                 stats["flakiness"] = calculate_flakiness_index(pass_rate_percentage)
 
-    def _run_tests_for_prompt(
+    def _calculate_usage_stats(
+        self, stats: TestRunStats, run_details: List[TestRunDetails]
+    ):
+        usage = empty_usage()
+        has_usage = False
+        for test_run_instance in run_details:
+            # Results journaled before usage was tracked have no usage
+            for key in ["generation_usage", "evaluation_usage"]:
+                if test_run_instance.get(key) is not None:
+                    usage = add_usage(usage, test_run_instance[key])
+                    has_usage = True
+        if has_usage:
+            stats["usage"] = usage
+
+    def _calculate_timing_stats(
+        self, stats: TestRunStats, run_details: List[TestRunDetails]
+    ):
+        durations_by_phase: Dict[str, List[float]] = {}
+        totals = []
+        for test_run_instance in run_details:
+            timings = test_run_instance.get("timings")
+            if timings is None:
+                continue
+            for phase in PHASES:
+                durations_by_phase.setdefault(phase, []).append(timings.get(phase, 0.0))
+            totals.append(sum(timings.values()))
+        if not totals:
+            return
+
+        stats["runtime"] = round(sum(totals))
+        stats["timings"] = {
+            phase: calculate_timing_stats(durations)
+            for phase, durations in durations_by_phase.items()
+        }
+        stats["timings"]["total"] = calculate_timing_stats(totals)
+
+    def _run_test_suite(
         self,
-        test_suite: list,
+        test_name: str,
+        test_suite: List[Test],
         raw_prompt: str,
         model: str,
+        prompt_response: Optional[str],
         log_file_path: str,
         number_of_runs: int,
         csv_file_path: Optional[str],
+        concurrency: int = 1,
+        timings_json_path: Optional[str] = None,
+        adaptive: bool = False,
+        ci_width: float = ADAPTIVE_DEFAULT_CI_WIDTH,
+        pass_threshold: float = ADAPTIVE_DEFAULT_PASS_THRESHOLD,
+        shard: Optional[str] = None,
+        shard_output: Optional[str] = None,
+        journal: Optional[RunJournal] = None,
     ):
         # Use this object to store the stats for each test
         test_suite_results = self._initialize_test_suite_result(test_suite)
 
-        # Run the tests for the specified number of runs
-        for test in test_suite:
-            for _ in range(number_of_runs):
-                test_run_result = self._run_individual_test_for_prompt(
-                    test=test,
-                    raw_prompt=raw_prompt,
-                    model=model,
-                    log_file_path=log_file_path,
-                )
-                test_suite_results[test["description"]]["run_details"].append(
-                    test_run_result["run_details"]
-                )
+        run_units = lambda units: self._run_units(
+            test_suite=test_suite,
+            units=units,
+            raw_prompt=raw_prompt,
+            model=model,
+            prompt_response=prompt_response,
+            log_file_path=log_file_path,
+            concurrency=concurrency,
+            journal=journal,
+        )
+        if adaptive:
+            units, test_run_results = self._run_units_adaptively(
+                test_suite=test_suite,
+                number_of_runs=number_of_runs,
+                run_units=run_units,
+                ci_width=ci_width,
+                pass_threshold=pass_threshold,
+            )
+        else:
+            # Run the tests for the specified number of runs
+            units = self._test_run_units(test_suite, number_of_runs)
+            if shard is not None:
+                units = self._units_for_shard(test_suite, units, shard)
+            test_run_results = run_units(units)
+
+        if shard is not None:
+            shard_output = shard_output or self._shard_output_path(test_name, shard)
+            write_shard_results(
+                shard_output,
+                test_name=test_name,
+                shard=shard,
+                tests=[self._generate_test_object(test) for test in test_suite],
+                units=units,
+                results=test_run_results,
+            )
+            logger.info(f"Wrote results for shard {shard} to {shard_output}\n")
+
+        for unit, test_run_result in zip(units, test_run_results):
+            test = test_suite[unit["test_index"]]
+            test_suite_results[test["description"]]["run_details"].append(
+                test_run_result["run_details"]
+            )
 
         self._calculate_test_run_stats(test_suite_results)
         log_test_suite_results(test_suite_results)
+        log_timings(test_suite_results)
+        log_retry_counts(self.openai.retry_policy.get_retry_counts())
 
         if csv_file_path:
             _log_test_suite_results_as_csv(test_suite_results, csv_file_path)
+        if timings_json_path:
+            _log_timings_as_json(test_suite_results, timings_json_path)
 
-    def _run_tests_for_prompt_response(
+    def _run_units(
         self,
-        test_suite: list,
+        test_suite: List[Test],
+        units: List[TestRunUnit],
         raw_prompt: str,
-        prompt_response: str,
+        model: str,
+        prompt_response: Optional[str],
         log_file_path: str,
-        number_of_runs: int,
-        csv_file_path: Optional[str],
-    ):
-        # Use this object to store the stats for each test
-        test_suite_results = self._initialize_test_suite_result(test_suite)
+        concurrency: int = 1,
+        journal: Optional[RunJournal] = None,
+    ) -> List[IndividualTestRunResult]:
+        if journal is None:
+            return self._execute_units(
+                test_suite=test_suite,
+                units=units,
+                raw_prompt=raw_prompt,
+                model=model,
+                prompt_response=prompt_response,
+                log_file_path=log_file_path,
+                concurrency=concurrency,
+            )
 
-        for test in test_suite:
-            for _ in range(number_of_runs):
-                test_run_result = self._run_individual_test_for_prompt_response(
-                    test=test,
+        # Reuse results from the journal and only run what is missing
+        results: List[Optional[IndividualTestRunResult]] = []
+        pending_unit_indices = []
+        for unit_index, unit in enumerate(units):
+            test = test_suite[unit["test_index"]]
+            run_details = journal.get_completed_run_details(unit, test["description"])
+            if run_details is None:
+                pending_unit_indices.append(unit_index)
+                results.append(None)
+            else:
+                results.append(
+                    {
+                        "test": self._generate_test_object(test),
+                        "run_details": run_details,
+                    }
+                )
+
+        pending_units = [units[unit_index] for unit_index in pending_unit_indices]
+        pending_results = self._execute_units(
+            test_suite=test_suite,
+            units=pending_units,
+            raw_prompt=raw_prompt,
+            model=model,
+            prompt_response=prompt_response,
+            log_file_path=log_file_path,
+            concurrency=concurrency,
+            on_unit_complete=lambda unit, result: journal.append(
+                unit, result["test"]["description"], result["run_details"]
+            ),
+        )
+        for unit_index, result in zip(pending_unit_indices, pending_results):
+            results[unit_index] = result
+        return results
+
+    def _execute_units(
+        self,
+        test_suite: List[Test],
+        units: List[TestRunUnit],
+        raw_prompt: str,
+        model: str,
+        prompt_response: Optional[str],
+        log_file_path: str,
+        concurrency: int = 1,
+        on_unit_complete: Optional[
+            Callable[[TestRunUnit, IndividualTestRunResult], None]
+        ] = None,
+    ) -> List[IndividualTestRunResult]:
+        if not units:
+            return []
+
+        if prompt_response is not None:
+            # The response was provided, so there is nothing to generate
+            responses = [prompt_response] * len(units)
+
+            def run_unit(unit_index, batch_evaluation):
+                return self._run_individual_test_for_prompt_response(
+                    test=test_suite[units[unit_index]["test_index"]],
                     prompt=raw_prompt,
                     prompt_response=prompt_response,
                     log_file_path=log_file_path,
+                    batch_evaluation=batch_evaluation,
                 )
-                test_suite_results[test["description"]]["run_details"].append(
-                    test_run_result["run_details"]
+
+        else:
+            prompts = [
+                self._render_prompt(raw_prompt, test_suite[unit["test_index"]])
+                for unit in units
+            ]
+
+            # Generate each unique (model, prompt, repetition) once and share the
+            # response with every test run that needs it
+            plan = build_generation_plan(
+                model, prompts, [unit["run_index"] for unit in units]
+            )
+            batches = plan.batches(self._max_choices_per_request())
+            generations: List[GenerationResult] = [None] * len(plan.jobs)
+            batch_generations = map_concurrently(
+                self._generate_batch, batches, concurrency=concurrency
+            )
+            for batch, batch_generation in zip(batches, batch_generations):
+                for job_index, generation in zip(
+                    batch["job_indices"], batch_generation
+                ):
+                    generations[job_index] = generation
+            logger.info(
+                f"Generated {len(plan.jobs)} responses for {len(units)} test runs "
+                f"using at most {len(batches)} requests "
+                f"({len(units) - len(batches)} LLM calls saved)\n"
+            )
+
+            # A response shared by several test runs is paid for by the first one
+            first_unit_of_job: Dict[int, int] = {}
+            for unit_index, job_index in enumerate(plan.unit_jobs):
+                first_unit_of_job.setdefault(job_index, unit_index)
+
+            responses = [
+                (
+                    generations[job_index]["response"]
+                    if generations[job_index]["error"] is None
+                    else None
                 )
+                for job_index in plan.unit_jobs
+            ]
 
-        self._calculate_test_run_stats(test_suite_results)
-        log_test_suite_results(test_suite_results)
+            def run_unit(unit_index, batch_evaluation):
+                job_index = plan.unit_jobs[unit_index]
+                return self._run_individual_test_for_prompt(
+                    test=test_suite[units[unit_index]["test_index"]],
+                    prompt=prompts[unit_index],
+                    generation=generations[job_index],
+                    log_file_path=log_file_path,
+                    is_first_use=first_unit_of_job[job_index] == unit_index,
+                    batch_evaluation=batch_evaluation,
+                )
 
-        if csv_file_path:
-            _log_test_suite_results_as_csv(test_suite_results, csv_file_path)
+        # Embed the texts of every evaluator in a few requests, and evaluate
+        # (or grade) the tests that support it in batches, before running the
+        # units
+        with use_embedding_batcher(EmbeddingBatcher()) as batcher:
+            prefetches = self._prefetch_embeddings(
+                test_suite, units, responses, batcher
+            )
+            batch_evaluations = self._evaluate_in_batches(test_suite, units, responses)
+            batch_evaluations.update(
+                self._grade_in_batches(test_suite, units, responses, concurrency)
+            )
 
-    def _run_individual_test_for_prompt(
-        self, test: Test, raw_prompt: str, model: str, log_file_path: str
-    ) -> IndividualTestRunResult:
-        prompt_vars = test["prompt_vars"]
-        prompt = substitute_vars(raw_prompt, prompt_vars) if prompt_vars else raw_prompt
-        prompt_response = None
+            def run(unit_index: int) -> IndividualTestRunResult:
+                result = run_unit(unit_index, batch_evaluations.get(unit_index))
+                prefetch = prefetches.get(unit_index)
+                if prefetch is not None:
+                    run_details = result["run_details"]
+                    run_details["evaluation_usage"] = add_usage(
+                        run_details["evaluation_usage"] or empty_usage(),
+                        prefetch["usage"],
+                    )
+                    timings = run_details.setdefault("timings", {})
+                    for phase, duration_ms in prefetch["timings"].items():
+                        timings[phase] = timings.get(phase, 0.0) + duration_ms
+                if on_unit_complete is not None:
+                    on_unit_complete(units[unit_index], result)
+                return result
 
+            return map_concurrently(run, range(len(units)), concurrency=concurrency)
+
+    def _unit_indices_by_test(
+        self,
+        test_suite: List[Test],
+        units: List[TestRunUnit],
+        responses: List[Optional[str]],
+        evaluator_attribute: str,
+    ) -> Dict[int, List[int]]:
+        # Units with a response, grouped by test, for the tests whose evaluator
+        # has the attribute
+        unit_indices_by_test: Dict[int, List[int]] = {}
+        for unit_index, (unit, response) in enumerate(zip(units, responses)):
+            evaluator = test_suite[unit["test_index"]]["eval"]
+            if response is not None and hasattr(evaluator, evaluator_attribute):
+                unit_indices_by_test.setdefault(unit["test_index"], []).append(
+                    unit_index
+                )
+        return unit_indices_by_test
+
+    def _prefetch_embeddings(
+        self,
+        test_suite: List[Test],
+        units: List[TestRunUnit],
+        responses: List[Optional[str]],
+        batcher: EmbeddingBatcher,
+    ) -> Dict[int, PrefetchedEmbeddings]:
+        """
+        Embed the texts that evaluators will embed (see magik_eval), for all
+        the units, in a few batched requests. Returns the cost of the requests
+        by unit index: the usage goes to the first unit, the time is split
+        evenly between the units.
+        """
+        unit_indices_by_test = self._unit_indices_by_test(
+            test_suite, units, responses, "embedding_texts"
+        )
+        if not unit_indices_by_test:
+            return {}
+
+        prefetched_unit_indices = []
         try:
-            # Use cached response ONLY if there are no prompt vars
-            # AND if there is a cached response with length > 0
-            if not prompt_vars and len(self.saved_prompt_response) > 0:
-                prompt_response = self.saved_prompt_response
-            else:
-                self.saved_prompt_response = self.openai.get_openai_response_message(
-                    model, prompt
+            for test_index, unit_indices in unit_indices_by_test.items():
+                texts_by_model = test_suite[test_index]["eval"].embedding_texts(
+                    [responses[unit_index] for unit_index in unit_indices]
                 )
-                prompt_response = self.saved_prompt_response
+                for embedding_model, texts in texts_by_model.items():
+                    batcher.add(embedding_model, texts)
+                prefetched_unit_indices.extend(unit_indices)
+            with track_usage() as tracker, collect_timings() as phase_timings:
+                with time_phase(PHASE_EVALUATION):
+                    text_count = batcher.flush(get_embeddings)
+        except Exception as e:
+            # The evaluators will embed their texts one by one
+            logger.error(
+                f"ERROR: Failed to embed texts in batches with error: {str(e)}"
+            )
+            return {}
 
-            return self._run_individual_test_for_prompt_response(
-                test=test,
-                prompt=prompt,
-                prompt_response=prompt_response,
-                log_file_path=log_file_path,
+        logger.info(
+            f"Fetched the embeddings of {text_count} texts for {len(prefetched_unit_indices)} test runs "
+            f"using {tracker.usage['requests']} requests\n"
+        )
+        timings = {
+            phase: duration_ms / len(prefetched_unit_indices)
+            for phase, duration_ms in phase_timings.timings.items()
+        }
+        return {
+            unit_index: {
+                "usage": tracker.usage if position == 0 else empty_usage(),
+                "timings": timings,
+            }
+            for position, unit_index in enumerate(sorted(prefetched_unit_indices))
+        }
+
+    def _evaluate_in_batches(
+        self,
+        test_suite: List[Test],
+        units: List[TestRunUnit],
+        responses: List[Optional[str]],
+    ) -> Dict[int, BatchEvaluation]:
+        """
+        Evaluate all the responses of a test in a single call, for tests whose
+        evaluator supports it (see magik_eval). Returns the evaluations by
+        unit index. Other units, including those of a batch that failed, are
+        evaluated one by one.
+        """
+        unit_indices_by_test = self._unit_indices_by_test(
+            test_suite, units, responses, "evaluate_many"
+        )
+
+        batch_evaluations: Dict[int, BatchEvaluation] = {}
+        for test_index, unit_indices in unit_indices_by_test.items():
+            if len(unit_indices) < 2:
+                continue
+            test = test_suite[test_index]
+            try:
+                with track_usage() as tracker, collect_timings() as phase_timings:
+                    with time_phase(PHASE_EVALUATION):
+                        eval_results = test["eval"].evaluate_many(
+                            [responses[unit_index] for unit_index in unit_indices]
+                        )
+            except Exception as e:
+                logger.error(
+                    f"ERROR: Failed to evaluate test: {test['description']} in a batch with error: {str(e)}"
+                )
+                continue
+
+            timings = {
+                phase: duration_ms / len(unit_indices)
+                for phase, duration_ms in phase_timings.timings.items()
+            }
+            for position, (unit_index, eval_result) in enumerate(
+                zip(unit_indices, eval_results)
+            ):
+                batch_evaluations[unit_index] = {
+                    "eval_result": eval_result,
+                    "usage": tracker.usage if position == 0 else empty_usage(),
+                    "timings": timings,
+                }
+        return batch_evaluations
+
+    def _grade_in_batches(
+        self,
+        test_suite: List[Test],
+        units: List[TestRunUnit],
+        responses: List[Optional[str]],
+        concurrency: int,
+    ) -> Dict[int, BatchEvaluation]:
+        """
+        Grade the responses of all the LLM-graded tests (see magik_eval)
+        together, so a response checked by several of them is sent once with
+        all their rubrics. Up to concurrency grading requests are sent at
+        once. Returns the evaluations by unit index: the usage
+        goes to the first unit, the time is split evenly between the units. If
+        grading fails, the units are evaluated one by one.
+        """
+        unit_indices_by_test = self._unit_indices_by_test(
+            test_suite, units, responses, "grading_rubric"
+        )
+        graded_unit_indices = sorted(
+            unit_index
+            for unit_indices in unit_indices_by_test.values()
+            for unit_index in unit_indices
+        )
+        if len(graded_unit_indices) < 2:
+            return {}
+
+        items = [
+            (
+                responses[unit_index],
+                test_suite[units[unit_index]["test_index"]]["eval"].grading_rubric,
             )
+            for unit_index in graded_unit_indices
+        ]
+        try:
+            with track_usage() as tracker, collect_timings() as phase_timings:
+                with time_phase(PHASE_EVALUATION):
+                    eval_results = get_grader().grade(items, concurrency=concurrency)
         except Exception as e:
             logger.error(
-                f"ERROR: Failed to run test: {test['description']} with error: {str(e)}"
-            )
-            return self._generate_test_run_result(
-                test=test,
-                eval_result={
-                    "result": None,
-                    "reason": f"Error running test {str(e)}",
-                },
-                prompt=prompt,
-                prompt_response=prompt_response,
+                f"ERROR: Failed to grade responses in batches with error: {str(e)}"
             )
+            return {}
 
-    def _run_individual_test_for_prompt_response(
-        self, test: Test, prompt: str, prompt_response: str, log_file_path: str
-    ) -> IndividualTestRunResult:
-        try:
-            eval_result = test["eval"](prompt_response)
-            individual_test_run_result = self._generate_test_run_result(
-                test=test,
-                eval_result=eval_result,
-                prompt=prompt,
-                prompt_response=prompt_response,
+        logger.info(
+            f"Graded {len(items)} test runs of {len(unit_indices_by_test)} tests "
+            f"using {tracker.usage['requests']} requests\n"
+        )
+        timings = {
+            phase: duration_ms / len(graded_unit_indices)
+            for phase, duration_ms in phase_timings.timings.items()
+        }
+        return {
+            unit_index: {
+                "eval_result": eval_result,
+                "usage": tracker.usage if position == 0 else empty_usage(),
+                "timings": timings,
+            }
+            for position, (unit_index, eval_result) in enumerate(
+                zip(graded_unit_indices, eval_results)
             )
+        }
 
-            log_test_run(
-                individual_test_run_result=individual_test_run_result,
-                log_file_path=log_file_path,
+    def _run_units_adaptively(
+        self,
+        test_suite: List[Test],
+        number_of_runs: int,
+        run_units: Callable[[List[TestRunUnit]], List[IndividualTestRunResult]],
+        ci_width: float,
+        pass_threshold: float,
+    ) -> Tuple[List[TestRunUnit], List[IndividualTestRunResult]]:
+        """
+        Run tests in rounds, and stop sampling a test once the confidence
+        interval on its pass rate is narrower than ci_width or lies entirely
+        above or below pass_threshold.
+
+        The total budget is number_of_runs runs per test. Runs that settled
+        tests don't use are spent on the tests that are still undecided.
+        """
+        budget = number_of_runs * len(test_suite)
+        run_counts = [0] * len(test_suite)
+        passed = [0] * len(test_suite)
+        failed = [0] * len(test_suite)
+        active_test_indices = list(range(len(test_suite)))
+        all_units: List[TestRunUnit] = []
+        all_results: List[IndividualTestRunResult] = []
+
+        while active_test_indices and len(all_units) < budget:
+            # Every test gets the minimum number of runs in the first round,
+            # and one more run per round after that
+            units: List[TestRunUnit] = []
+            for test_index in active_test_indices:
+                runs_this_round = max(1, ADAPTIVE_MIN_RUNS - run_counts[test_index])
+                for _ in range(runs_this_round):
+                    if len(all_units) + len(units) >= budget:
+                        break
+                    units.append(
+                        {
+                            "test_index": test_index,
+                            "run_index": run_counts[test_index],
+                        }
+                    )
+                    run_counts[test_index] += 1
+
+            results = run_units(units)
+            for unit, result in zip(units, results):
+                # Like _calculate_test_run_stats: evaluators may return truthy
+                # values that aren't bools, like numpy.bool_
+                if result["run_details"]["result"] is None:
+                    continue
+                elif result["run_details"]["result"]:
+                    passed[unit["test_index"]] += 1
+                else:
+                    failed[unit["test_index"]] += 1
+            all_units.extend(units)
+            all_results.extend(results)
+
+            still_active_test_indices = []
+            for test_index in active_test_indices:
+                interval = calculate_pass_rate_interval(
+                    passed[test_index], failed[test_index]
+                )
+                if interval is None:
+                    # Stop sampling tests that only ever error out
+                    if run_counts[test_index] < ADAPTIVE_MIN_RUNS:
+                        still_active_test_indices.append(test_index)
+                elif not is_pass_rate_settled(interval, ci_width, pass_threshold):
+                    still_active_test_indices.append(test_index)
+            active_test_indices = still_active_test_indices
+
+        logger.info(f"Adaptive sampling used {len(all_units)} of {budget} test runs\n")
+        return all_units, all_results
+
+    def _test_run_units(
+        self, test_suite: List[Test], number_of_runs: int
+    ) -> List[TestRunUnit]:
+        # Every (test, repetition) pair is an independent unit of work
+        return [
+            {"test_index": test_index, "run_index": run_index}
+            for test_index in range(len(test_suite))
+            for run_index in range(number_of_runs)
+        ]
+
+    def _units_for_shard(
+        self, test_suite: List[Test], units: List[TestRunUnit], shard: str
+    ) -> List[TestRunUnit]:
+        shard_index, shard_count = parse_shard(shard)
+        return [
+            unit
+            for unit in units
+            if shard_for_unit(
+                test_suite[unit["test_index"]]["description"], unit, shard_count
             )
+            == shard_index
+        ]
 
-            return individual_test_run_result
-        except Exception as e:
+    def _shard_output_path(self, test_name: str, shard: str) -> str:
+        shard_index, shard_count = parse_shard(shard)
+        return f"{self.test_runs_dir}/shards/{test_name}-shard-{shard_index}-of-{shard_count}.json"
+
+    def _render_prompt(self, raw_prompt: str, test: Test) -> str:
+        prompt_vars = test["prompt_vars"]
+        return substitute_vars(raw_prompt, prompt_vars) if prompt_vars else raw_prompt
+
+    def _max_choices_per_request(self) -> int:
+        max_choices = get_open_ai_max_choices_per_request()
+        if max_choices:
+            return int(max_choices)
+        return OPEN_AI_DEFAULT_MAX_CHOICES_PER_REQUEST
+
+    def _generate_batch(self, batch: GenerationBatch) -> List[GenerationResult]:
+        # Every job in a batch is a different repetition of the same prompt
+        responses = None
+        error = None
+        with track_usage() as tracker, collect_timings() as phase_timings:
+            with time_phase(PHASE_GENERATION):
+                try:
+                    responses = self.openai.get_openai_response_messages(
+                        batch["model"],
+                        batch["prompt"],
+                        run_indices=batch["run_indices"],
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"ERROR: Failed to generate response with error: {str(e)}"
+                    )
+                    error = str(e)
+        if responses is None:
+            responses = [None] * len(batch["job_indices"])
+        # Like the usage, the time of the request is shared by its choices
+        duration_ms = phase_timings.timings[PHASE_GENERATION] / len(responses)
+        return [
+            {
+                "response": response,
+                "error": error,
+                "usage": tracker.usage if choice_index == 0 else None,
+                "duration_ms": duration_ms,
+            }
+            for choice_index, response in enumerate(responses)
+        ]
+
+    def _run_individual_test_for_prompt(
+        self,
+        test: Test,
+        prompt: str,
+        generation: GenerationResult,
+        log_file_path: str,
+        is_first_use: bool = True,
+        batch_evaluation: Optional[BatchEvaluation] = None,
+    ) -> IndividualTestRunResult:
+        generation_usage = (
+            generation["usage"] or empty_usage() if is_first_use else empty_usage()
+        )
+        if generation["error"] is not None:
             logger.error(
-                f"ERROR: Failed to run test: {test['description']} with error: {str(e)}"
+                f"ERROR: Failed to run test: {test['description']} with error: {generation['error']}"
             )
             return self._generate_test_run_result(
                 test=test,
                 eval_result={
                     "result": None,
-                    "reason": f"Error running test {str(e)}",
+                    "reason": f"Error running test {generation['error']}",
                 },
                 prompt=prompt,
-                prompt_response=prompt_response,
+                prompt_response=None,
+                generation_usage=generation_usage,
+                timings={PHASE_GENERATION: generation["duration_ms"]},
             )
 
+        return self._run_individual_test_for_prompt_response(
+            test=test,
+            prompt=prompt,
+            prompt_response=generation["response"],
+            log_file_path=log_file_path,
+            generation_usage=generation_usage,
+            generation_duration_ms=generation["duration_ms"],
+            batch_evaluation=batch_evaluation,
+        )
+
+    def _run_individual_test_for_prompt_response(
+        self,
+        test: Test,
+        prompt: str,
+        prompt_response: str,
+        log_file_path: str,
+        generation_usage: Optional[TokenUsage] = None,
+        generation_duration_ms: Optional[float] = None,
+        batch_evaluation: Optional[BatchEvaluation] = None,
+    ) -> IndividualTestRunResult:
+        evaluation_usage = None
+        with collect_timings() as phase_timings:
+            try:
+                if batch_evaluation is not None:
+                    eval_result = batch_evaluation["eval_result"]
+                    evaluation_usage = batch_evaluation["usage"]
+                else:
+                    with track_usage() as evaluation, time_phase(PHASE_EVALUATION):
+                        # Updated in place as the evaluator sends requests
+                        evaluation_usage = evaluation.usage
+                        eval_result = test["eval"](prompt_response)
+                individual_test_run_result = self._generate_test_run_result(
+                    test=test,
+                    eval_result=eval_result,
+                    prompt=prompt,
+                    prompt_response=prompt_response,
+                    generation_usage=generation_usage,
+                    evaluation_usage=evaluation_usage,
+                )
+
+                # Keep the output of concurrent test runs from interleaving
+                with time_phase(PHASE_LOGGING), self._log_lock:
+                    log_test_run(
+                        individual_test_run_result=individual_test_run_result,
+                        log_file_path=log_file_path,
+                    )
+            except Exception as e:
+                logger.error(
+                    f"ERROR: Failed to run test: {test['description']} with error: {str(e)}"
+                )
+                individual_test_run_result = self._generate_test_run_result(
+                    test=test,
+                    eval_result={
+                        "result": None,
+                        "reason": f"Error running test {str(e)}",
+                    },
+                    prompt=prompt,
+                    prompt_response=prompt_response,
+                    generation_usage=generation_usage,
+                    evaluation_usage=evaluation_usage,
+                )
+
+        timings = dict(phase_timings.timings)
+        if batch_evaluation is not None:
+            timings.update(batch_evaluation["timings"])
+        if generation_duration_ms is not None:
+            timings[PHASE_GENERATION] = generation_duration_ms
+        individual_test_run_result["run_details"]["timings"] = timings
+        return individual_test_run_result
+
     def _generate_test_object(self, test: Test) -> Test:
-        test_function_name = test["eval"].__name__
+        # Tests loaded from shard results already have the eval function name
+        test_function_name = (
+            test["eval"] if isinstance(test["eval"], str) else test["eval"].__name__
+        )
         return {
             "description": test["description"],
             "eval": test_function_name,
@@ -249,7 +964,14 @@ class Run:
         }
 
     def _generate_test_run_result(
-        self, test: Test, eval_result: EvalResult, prompt, prompt_response
+        self,
+        test: Test,
+        eval_result: EvalResult,
+        prompt,
+        prompt_response,
+        generation_usage: Optional[TokenUsage] = None,
+        evaluation_usage: Optional[TokenUsage] = None,
+        timings: Optional[Dict[str, float]] = None,
     ) -> IndividualTestRunResult:
         did_test_pass = eval_result["result"]
         eval_result_reason = eval_result["reason"]
@@ -262,6 +984,9 @@ class Run:
                 "failure_labels": failure_labels,
                 "prompt": prompt,
                 "prompt_response": prompt_response,
+                "generation_usage": generation_usage,
+                "evaluation_usage": evaluation_usage,
+                "timings": timings,
             },
         }
 
@@ -282,7 +1007,10 @@ class Run:
                     "error": 0,
                     "pass_rate": None,
                     "flakiness": None,
+                    "pass_rate_interval": None,
                     "runtime": None,
+                    "usage": None,
+                    "timings": None,
                 },
                 "run_details": [],
             }
@@ -1,7 +1,10 @@
+import json
 import sys
-from typing import Optional
-from .types.test_run import TestSuiteResults, IndividualTestRunResult
+from typing import Dict, Optional
+from .types.test_run import TestSuiteResults, IndividualTestRunResult, TokenUsage
 from .internal_logger import logger
+from .usage import add_usage, empty_usage
+from .timing import PHASES
 from .sys_exec import create_file
 
 
@@ -13,13 +16,108 @@ def log_test_suite_results(test_suite_result_stats: TestSuiteResults):
     for test_name, test_run_result in test_suite_result_stats.items():
         stats = test_run_result["run_stats"]
         logger.info(f"{test_name}:")
+        logger.info(f" Runs: {stats['number_of_runs']}")
         logger.info(f" ✅ {stats['passed']} passed")
         logger.info(f" ❌ {stats['failed']} failed")
         logger.info(f" ! {stats['error']} error")
         logger.info(f" Pass Rate: {stats['pass_rate']}%")
         logger.info(f" Flake Rate: {stats['flakiness']}%")
+        if stats["pass_rate_interval"] is not None:
+            lower, upper = stats["pass_rate_interval"]
+            logger.info(f" Pass Rate 95% CI: {lower}% - {upper}%")
+        if stats["usage"] is not None:
+            logger.info(f" Usage: {_format_usage(stats['usage'])}")
+            logger.info(f" Runtime: {stats['runtime']} ms")
         logger.info("")
 
+    _log_suite_usage(test_suite_result_stats)
+
+
+def _format_usage(usage: TokenUsage) -> str:
+    return (
+        f"{usage['requests']} requests, {usage['prompt_tokens']} prompt tokens, "
+        f"{usage['completion_tokens']} completion tokens, ${usage['cost']:.4f}"
+    )
+
+
+def _log_suite_usage(test_suite_result_stats: TestSuiteResults):
+    generation_usage = empty_usage()
+    evaluation_usage = empty_usage()
+    has_usage = False
+    for test_run_result in test_suite_result_stats.values():
+        for run_details in test_run_result["run_details"]:
+            if run_details.get("generation_usage") or run_details.get(
+                "evaluation_usage"
+            ):
+                has_usage = True
+            generation_usage = add_usage(
+                generation_usage, run_details.get("generation_usage")
+            )
+            evaluation_usage = add_usage(
+                evaluation_usage, run_details.get("evaluation_usage")
+            )
+    if not has_usage:
+        return
+
+    logger.info("Usage:")
+    logger.info(f" Generation: {_format_usage(generation_usage)}")
+    logger.info(f" Evaluation: {_format_usage(evaluation_usage)}")
+    logger.info(
+        f" Total: {_format_usage(add_usage(generation_usage, evaluation_usage))}"
+    )
+    logger.info("")
+
+
+def log_timings(test_suite_result_stats: TestSuiteResults):
+    rows = [
+        (test_name, test_run_result["run_stats"])
+        for test_name, test_run_result in test_suite_result_stats.items()
+        if test_run_result["run_stats"]["timings"] is not None
+    ]
+    if not rows:
+        return
+
+    name_width = max(len("test"), *(len(test_name) for test_name, _ in rows))
+    header = f"{'test'.ljust(name_width)}  {'runs':>4}  {'p50':>8}  {'p90':>8}  {'p99':>8}  {'max':>8}"
+    header += "".join(f"  {phase:>10}" for phase in PHASES)
+    logger.info("TIMINGS (ms per run, phases are p50)")
+    logger.info(header)
+    for test_name, stats in rows:
+        total = stats["timings"]["total"]
+        row = (
+            f"{test_name.ljust(name_width)}  {stats['number_of_runs']:>4}  "
+            f"{total['p50']:>8.1f}  {total['p90']:>8.1f}  {total['p99']:>8.1f}  {total['max']:>8.1f}"
+        )
+        row += "".join(f"  {stats['timings'][phase]['p50']:>10.1f}" for phase in PHASES)
+        logger.info(row)
+    logger.info("")
+
+
+def _log_timings_as_json(test_suite_result_stats: TestSuiteResults, json_file_path):
+    logger.info("Logging timings to JSON: " + json_file_path)
+    timings = {
+        test_name: {
+            "runtime": test_run_result["run_stats"]["runtime"],
+            "timings": test_run_result["run_stats"]["timings"],
+            "runs": [
+                run_details.get("timings")
+                for run_details in test_run_result["run_details"]
+            ],
+        }
+        for test_name, test_run_result in test_suite_result_stats.items()
+    }
+    with open(json_file_path, "w") as json_file:
+        json.dump(timings, json_file, indent=2)
+
+
+def log_retry_counts(retry_counts: Dict[str, int]):
+    if not retry_counts:
+        return
+    retries = ", ".join(
+        f"{error_class}: {count}" for error_class, count in sorted(retry_counts.items())
+    )
+    logger.info(f"Retried API requests ({retries})\n")
+
 
 def log_test_run(
     individual_test_run_result: IndividualTestRunResult,
@@ -76,7 +174,7 @@ def _log_test_suite_results_as_csv(test_suite: TestSuiteResults, csv_file_path):
     logger.info("Logging file to CSV: " + csv_file_path)
     with open(csv_file_path, "w") as csv_file:
         logger.to_file(
-            "description,number_of_runs,passed,failed,error,pass_rate,flakiness,runtime",
+            "description,number_of_runs,passed,failed,error,pass_rate,flakiness,runtime,pass_rate_lower,pass_rate_upper,requests,prompt_tokens,completion_tokens,cost",
             csv_file,
         )
         for _, test_run_result in test_suite.items():
@@ -89,6 +187,12 @@ def _log_test_suite_results_as_csv(test_suite: TestSuiteResults, csv_file_path):
             flakiness = test_run_stats["flakiness"]
             number_of_runs = test_run_stats["number_of_runs"]
             runtime = test_run_stats["runtime"]
+            pass_rate_lower, pass_rate_upper = test_run_stats["pass_rate_interval"] or [
+                None,
+                None,
+            ]
+            usage = test_run_stats["usage"] or {}
+            cost = round(usage["cost"], 6) if usage else None
 
             logger.to_file(
                 ""
@@ -107,6 +211,18 @@ def _log_test_suite_results_as_csv(test_suite: TestSuiteResults, csv_file_path):
                 + str(flakiness)
                 + ","
                 + str(runtime)
+                + ","
+                + str(pass_rate_lower)
+                + ","
+                + str(pass_rate_upper)
+                + ","
+                + str(usage.get("requests"))
+                + ","
+                + str(usage.get("prompt_tokens"))
+                + ","
+                + str(usage.get("completion_tokens"))
+                + ","
+                + str(cost)
                 + "",
                 csv_file,
             )
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Tuple
+from .utils import json_default
+from .types.test_run import IndividualTestRunResult, Test, TestRunUnit
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Parse a shard spec like "2/4" into (shard_index, shard_count).
+    Shard indices start at 1.
+    """
+    try:
+        shard_index, shard_count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {shard}, expected the format i/N (ex: 1/4)")
+    if shard_count < 1 or not 1 <= shard_index <= shard_count:
+        raise ValueError(f"Invalid shard {shard}, i must be between 1 and N")
+    return shard_index, shard_count
+
+
+def shard_for_unit(description: str, unit: TestRunUnit, shard_count: int) -> int:
+    """
+    Deterministically assign a (test, repetition) unit to a shard (1 to shard_count).
+    Uses a stable hash so every machine computes the same assignment.
+    """
+    key = f"{description}\0{unit['test_index']}\0{unit['run_index']}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return int(digest, 16) % shard_count + 1
+
+
+def write_shard_results(
+    path: str,
+    test_name: str,
+    shard: str,
+    tests: List[Test],
+    units: List[TestRunUnit],
+    results: List[IndividualTestRunResult],
+):
+    """
+    Write the results of one shard to a JSON file that can be merged later.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    data = {
+        "test_name": test_name,
+        "shard": shard,
+        "tests": tests,
+        "results": [
+            {
+                "test_index": unit["test_index"],
+                "run_index": unit["run_index"],
+                "run_details": result["run_details"],
+            }
+            for unit, result in zip(units, results)
+        ],
+    }
+    with open(path, "w") as file:
+        json.dump(data, file, default=json_default)
+
+
+def read_shard_results(paths: List[str]) -> Tuple[List[Test], List[Dict[str, Any]]]:
+    """
+    Read partial results written by write_shard_results.
+
+    Returns the tests of the suite and the results of all shards, ordered by
+    test and repetition.
+    """
+    tests = None
+    test_name = None
+    shard_indices = set()
+    shard_count = None
+    results_by_unit: Dict[Tuple[int, int], Dict[str, Any]] = {}
+
+    for path in paths:
+        with open(path, "r") as file:
+            data = json.load(file)
+
+        if tests is None:
+            tests = data["tests"]
+            test_name = data["test_name"]
+        elif data["test_name"] != test_name or data["tests"] != tests:
+            raise ValueError(f"{path} contains results for a different test suite")
+
+        shard_index, count = parse_shard(data["shard"])
+        if shard_count is not None and count != shard_count:
+            raise ValueError(f"{path} was split into a different number of shards")
+        shard_count = count
+        shard_indices.add(shard_index)
+
+        for result in data["results"]:
+            results_by_unit[(result["test_index"], result["run_index"])] = result
+
+    missing_shards = sorted(set(range(1, (shard_count or 0) + 1)) - shard_indices)
+    if missing_shards:
+        raise ValueError(
+            f"Missing results for shards {missing_shards} of {shard_count}"
+        )
+
+    results = [results_by_unit[key] for key in sorted(results_by_unit)]
+    return tests or [], results
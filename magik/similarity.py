@@ -1,5 +1,12 @@
+import threading
+from typing import List, Optional, Sequence, Tuple
 import numpy as np
-from .openai_helper import OpenAI
+from .openai_helper import get_shared_openai
+from .constants import (
+    LOCAL_EMBEDDING_DIMENSIONS,
+    LOCAL_EMBEDDING_MODEL,
+    SIMILARITY_MAX_MATRIX_CELLS,
+)
 
 
 # Similarity score
@@ -15,38 +22,499 @@ def _cosine_similarity_from_embeddings(e1: list[float], e2: list[float]) -> floa
     magnitude_v1 = np.linalg.norm(v1)
     magnitude_v2 = np.linalg.norm(v2)
 
+    # Vectors of nothing (ex: local embeddings of an empty text) are similar
+    # to nothing
+    if magnitude_v1 == 0 or magnitude_v2 == 0:
+        return 0.0
+
     # Calculate the cosine similarity
     similarity = dot_product / (magnitude_v1 * magnitude_v2)
 
     return similarity
 
 
+class OpenAIEmbeddingBackend:
+    """
+    Embeds texts with the OpenAI embeddings API, through the embedding store
+    and the batch of the run being evaluated.
+    """
+
+    def embed(self, texts: List[str], model: str) -> List[np.ndarray]:
+        return get_shared_openai().get_embeddings(texts, model=model)
+
+
+class LocalEmbeddingBackend:
+    """
+    Embeds texts locally, without any model or network access, as hashed
+    character n-gram counts.
+
+    Every n-gram of the lowercased text is hashed into one of `dimensions`
+    buckets, with a hashed sign so that collisions tend to cancel out. Counts
+    are dampened with log(1 + count), so repeated n-grams don't dominate.
+    Texts that share many n-grams are close, which suits near-duplicate and
+    regression checks, but not semantic similarity.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = LOCAL_EMBEDDING_DIMENSIONS,
+        ngram_sizes: Sequence[int] = (2, 3, 4),
+    ):
+        self.dimensions = dimensions
+        self.ngram_sizes = ngram_sizes
+
+    def embed(self, texts: List[str], model: str) -> List[np.ndarray]:
+        return [self.embed_text(text) for text in texts]
+
+    def embed_text(self, text: str) -> np.ndarray:
+        # Pad with spaces so the first and last characters get n-grams too
+        points = np.frombuffer(
+            f" {text.lower()} ".encode("utf-32-le", errors="surrogatepass"),
+            dtype=np.uint32,
+        ).astype(np.uint64)
+        vector = np.zeros(self.dimensions, dtype=np.float64)
+        for size in self.ngram_sizes:
+            if len(points) < size:
+                continue
+            hashes = _hash_ngrams(points, size)
+            signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+            buckets = (hashes % np.uint64(self.dimensions)).astype(np.int64)
+            vector += np.bincount(buckets, weights=signs, minlength=self.dimensions)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.astype(np.float32)
+
+
+def _hash_ngrams(points: np.ndarray, size: int) -> np.ndarray:
+    # Polynomial hash of every n-gram, seeded with the size so that n-grams of
+    # different sizes don't collide, then mixed with the finalizer of
+    # MurmurHash3. uint64 arithmetic wraps around, and unlike hash() the
+    # result is the same in every process.
+    count = len(points) - size + 1
+    hashes = np.full(count, size, dtype=np.uint64)
+    for offset in range(size):
+        hashes = hashes * np.uint64(1_000_003) + points[offset : offset + count]
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= np.uint64(0xFF51AFD7ED558CCD)
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= np.uint64(0xC4CEB9FE1A85EC53)
+    hashes ^= hashes >> np.uint64(33)
+    return hashes
+
+
+# Embedding backends by model name. Models without a backend of their own are
+# embedded with OpenAI.
+_embedding_backends = {LOCAL_EMBEDDING_MODEL: LocalEmbeddingBackend()}
+_default_embedding_backend = OpenAIEmbeddingBackend()
+
+
+def register_embedding_backend(model: str, backend):
+    """
+    Embed the texts of model with backend, any object with an
+    embed(texts, model) method that returns a vector per text.
+    """
+    _embedding_backends[model] = backend
+
+
+def get_embedding_backend(model: str):
+    return _embedding_backends.get(model, _default_embedding_backend)
+
+
+def get_embeddings(texts: Sequence[str], model: str) -> List[np.ndarray]:
+    """
+    Embeddings of texts, with the backend of model.
+    """
+    return get_embedding_backend(model).embed(list(texts), model)
+
+
+class SimilarityIndex:
+    """
+    Cosine similarity of outputs to a set of reference embeddings.
+
+    The references are kept as a matrix of normalized float32 rows, so a batch
+    of outputs is scored against all of them with one matrix multiplication.
+    Outputs are scored in chunks, so the similarity matrix of a chunk has at
+    most SIMILARITY_MAX_MATRIX_CELLS cells.
+
+    The index is built from embeddings, or from texts (and their embedding
+    model), which are embedded on the first query.
+    """
+
+    def __init__(
+        self,
+        embeddings: Optional[Sequence[Sequence[float]]] = None,
+        texts: Optional[Sequence[str]] = None,
+        model: str = "text-embedding-ada-002",
+        max_matrix_cells: int = SIMILARITY_MAX_MATRIX_CELLS,
+    ):
+        if (embeddings is None) == (texts is None):
+            raise ValueError("Either embeddings or texts must be given")
+        self.texts = texts
+        self.model = model
+        self.max_matrix_cells = max_matrix_cells
+        self._matrix = None if embeddings is None else _normalize_rows(embeddings)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        if self._matrix is None:
+            return len(self.texts)
+        return len(self._matrix)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = _normalize_rows(get_embeddings(self.texts, self.model))
+            return self._matrix
+
+    def similarities(self, embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+        """
+        Cosine similarity of every output embedding to every reference, as a
+        (outputs x references) matrix.
+        """
+        return np.vstack([chunk for _, chunk in self._scored_chunks(embeddings)])
+
+    def top_k(
+        self, embeddings: Sequence[Sequence[float]], k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scores and indices of the k most similar references to every output
+        embedding, most similar first.
+        """
+        k = min(k, len(self))
+        all_scores = []
+        all_indices = []
+        for _, scores in self._scored_chunks(embeddings):
+            # Select the top k without sorting every row, then sort them
+            indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, indices, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            all_scores.append(np.take_along_axis(top_scores, order, axis=1))
+            all_indices.append(np.take_along_axis(indices, order, axis=1))
+        return np.vstack(all_scores), np.vstack(all_indices)
+
+    def max_similarity(
+        self, embeddings: Sequence[Sequence[float]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score and index of the most similar reference to every output
+        embedding.
+        """
+        all_scores = []
+        all_indices = []
+        for _, scores in self._scored_chunks(embeddings):
+            indices = scores.argmax(axis=1)
+            all_scores.append(scores[np.arange(len(scores)), indices])
+            all_indices.append(indices)
+        return np.concatenate(all_scores), np.concatenate(all_indices)
+
+    def _scored_chunks(self, embeddings):
+        matrix = self.matrix
+        if len(matrix) == 0:
+            raise ValueError("The similarity index has no references")
+        queries = _normalize_rows(embeddings)
+        if len(queries) == 0:
+            yield 0, np.zeros((0, len(matrix)), dtype=np.float32)
+            return
+        chunk_size = max(1, self.max_matrix_cells // len(matrix))
+        for start in range(0, len(queries), chunk_size):
+            yield start, queries[start : start + chunk_size] @ matrix.T
+
+
+def _normalize_rows(embeddings) -> np.ndarray:
+    matrix = np.array(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        # A single embedding, or none at all
+        matrix = matrix.reshape(1, -1) if matrix.size else matrix.reshape(0, 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Leave zero vectors as they are, they are similar to nothing
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
 def similarity_score(str1, str2, model):
-    openai = OpenAI()
-    e1 = openai.get_embedding(str1, model=model)
-    e2 = openai.get_embedding(str2, model=model)
+    e1, e2 = get_embeddings([str1, str2], model)
     score = _cosine_similarity_from_embeddings(e1, e2)
     return score
 
 
-def levenshtein_distance(str1, str2):
+# Pairs computed together by levenshtein_distances. Bounds the memory of the
+# per pair lookup tables.
+LEVENSHTEIN_BATCH_SIZE = 256
+
+# Below this many pairs, the NumPy overhead of every step outweighs computing
+# the pairs one by one with Python integers as bit vectors
+VECTORIZED_MIN_PAIRS = 64
+
+_WORD_SIZE = 64
+_HIGH_BIT = np.uint64(1 << (_WORD_SIZE - 1))
+
+
+def _strip_common_affixes(str1, str2):
+    # A common prefix or suffix doesn't change the distance. The longer string
+    # is returned first.
+    start = 0
+    end1, end2 = len(str1), len(str2)
+    while start < end1 and start < end2 and str1[start] == str2[start]:
+        start += 1
+    while end1 > start and end2 > start and str1[end1 - 1] == str2[end2 - 1]:
+        end1 -= 1
+        end2 -= 1
+    str1, str2 = str1[start:end1], str2[start:end2]
+    if len(str1) < len(str2):
+        return str2, str1
+    return str1, str2
+
+
+def levenshtein_distance(str1, str2, max_distance=None):
+    """
+    Edit distance between str1 and str2, computed with the bit-parallel
+    algorithm of Myers, in memory linear in the length of the shorter string.
+
+    With max_distance, only the diagonal band of width 2 * max_distance + 1 of
+    the dynamic programming matrix is computed (Ukkonen), using two rows, and
+    the computation stops as soon as the distance is known to be above
+    max_distance. In that case max_distance + 1 is returned.
+    """
+    str1, str2 = _strip_common_affixes(str1, str2)
     m, n = len(str1), len(str2)
-    # Create a matrix to store the distances
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
 
-    # Initialize the first row and first column
-    for i in range(m + 1):
-        dp[i][0] = i
-    for j in range(n + 1):
-        dp[0][j] = j
+    if max_distance is None:
+        return _bit_parallel_distance(str1, str2)
+    max_distance = max(0, int(max_distance))
+    if m - n > max_distance:
+        return max_distance + 1
+    if n == 0:
+        return m
+    return _banded_levenshtein_distance(str1, str2, max_distance)
+
+
+def _bit_parallel_distance(text, pattern):
+    # Myers' algorithm, with a single Python integer as the bit vector of the
+    # whole pattern. Bit i stands for row i of the dynamic programming matrix,
+    # positive/negative hold the vertical +1/-1 deltas of the current column.
+    if not pattern:
+        return len(text)
+    peq = {}
+    for row, character in enumerate(pattern):
+        peq[character] = peq.get(character, 0) | (1 << row)
+    mask = (1 << len(pattern)) - 1
+    last_row = 1 << (len(pattern) - 1)
+    positive = mask
+    negative = 0
+    score = len(pattern)
+    for character in text:
+        eq = peq.get(character, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        horizontal_positive = negative | (~(xh | positive) & mask)
+        horizontal_negative = positive & xh
+        if horizontal_positive & last_row:
+            score += 1
+        elif horizontal_negative & last_row:
+            score -= 1
+        horizontal_positive = ((horizontal_positive << 1) | 1) & mask
+        horizontal_negative = (horizontal_negative << 1) & mask
+        positive = horizontal_negative | (~(xv | horizontal_positive) & mask)
+        negative = horizontal_positive & xv
+    return score
 
-    # Calculate the distance
+
+def _banded_levenshtein_distance(str1, str2, max_distance):
+    m, n = len(str1), len(str2)
+    # Cells outside the band are at least max_distance + 1 away
+    out_of_band = max_distance + 1
+    previous_row = [min(j, out_of_band) for j in range(n + 1)]
+    current_row = [out_of_band] * (n + 1)
     for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if str1[i - 1] == str2[j - 1]:
-                dp[i][j] = dp[i - 1][j - 1]
+        char1 = str1[i - 1]
+        low = max(1, i - max_distance)
+        high = min(n, i + max_distance)
+        # Only the band and the cells right around it are ever read, so the
+        # two rows are reused without being cleared
+        current_row[low - 1] = min(i, out_of_band) if low == 1 else out_of_band
+        if high < n:
+            current_row[high + 1] = out_of_band
+        row_minimum = current_row[low - 1]
+        for j in range(low, high + 1):
+            if char1 == str2[j - 1]:
+                distance = previous_row[j - 1]
             else:
-                dp[i][j] = 1 + min(dp[i - 1][j], dp[i]
-                                   [j - 1], dp[i - 1][j - 1])
+                distance = 1 + min(
+                    previous_row[j], current_row[j - 1], previous_row[j - 1]
+                )
+            if distance > out_of_band:
+                distance = out_of_band
+            current_row[j] = distance
+            if distance < row_minimum:
+                row_minimum = distance
+        # Distances never decrease along a path, so the final distance is at
+        # least the minimum of any row
+        if row_minimum > max_distance:
+            return out_of_band
+        previous_row, current_row = current_row, previous_row
+    return previous_row[n]
+
+
+def normalized_levenshtein_distance(str1, str2):
+    """
+    Edit distance divided by the length of the longer string, between 0
+    (equal) and 1.
+    """
+    longest = max(len(str1), len(str2))
+    if longest == 0:
+        return 0.0
+    return levenshtein_distance(str1, str2) / longest
+
+
+def levenshtein_distances(strings1, strings2):
+    """
+    Edit distances between strings1[i] and strings2[i], for every i.
+
+    Many pairs are computed at once with NumPy, running the bit-parallel
+    algorithm of Myers on 64 bit words, with the blocks of Hyyrö for strings
+    longer than 64 characters.
+    """
+    if len(strings1) != len(strings2):
+        raise ValueError("strings1 and strings2 must have the same length")
+
+    distances = [0] * len(strings1)
+    pairs = []
+    for index, (str1, str2) in enumerate(zip(strings1, strings2)):
+        text, pattern = _strip_common_affixes(str1, str2)
+        if pattern:
+            pairs.append((index, text, pattern))
+        else:
+            distances[index] = len(text)
+
+    if len(pairs) < VECTORIZED_MIN_PAIRS:
+        for index, text, pattern in pairs:
+            distances[index] = _bit_parallel_distance(text, pattern)
+        return distances
+
+    # Pairs of similar sizes go together, to waste less work on padding
+    pairs.sort(key=lambda pair: (len(pair[2]), len(pair[1])))
+    for start in range(0, len(pairs), LEVENSHTEIN_BATCH_SIZE):
+        batch = pairs[start : start + LEVENSHTEIN_BATCH_SIZE]
+        batch_distances = _vectorized_bit_parallel_distances(
+            [text for _, text, _ in batch], [pattern for _, _, pattern in batch]
+        )
+        for (index, _, _), distance in zip(batch, batch_distances):
+            distances[index] = int(distance)
+    return distances
+
+
+def normalized_levenshtein_distances(strings1, strings2):
+    """
+    Normalized edit distances between strings1[i] and strings2[i], for every i.
+    """
+    distances = levenshtein_distances(strings1, strings2)
+    return [
+        distance / max(len(str1), len(str2)) if distance else 0.0
+        for distance, str1, str2 in zip(distances, strings1, strings2)
+    ]
+
+
+def _codepoints(text):
+    return np.frombuffer(
+        text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32
+    )
+
+
+def _vectorized_bit_parallel_distances(texts, patterns):
+    # Same as _bit_parallel_distance, but the pattern is split into blocks of
+    # 64 rows, each carrying its horizontal delta into the next one. Block b
+    # only depends on block b - 1 for the same text character, so blocks
+    # advance along anti-diagonals: at step t, block b processes character
+    # t - b, and all (pair, block) lanes move together.
+    pair_count = len(texts)
+    pattern_lengths = np.array([len(pattern) for pattern in patterns])
+    text_lengths = np.array([len(text) for text in texts])
+    word_counts = (pattern_lengths + _WORD_SIZE - 1) // _WORD_SIZE
+    word_count = int(word_counts.max())
+
+    # Characters are numbered per pair by their rank in the pattern's
+    # alphabet, 0 being any character that isn't in the pattern
+    pattern_codes = []
+    text_codes = np.zeros((pair_count, int(text_lengths.max())), dtype=np.int64)
+    for pair_index, (text, pattern) in enumerate(zip(texts, patterns)):
+        pattern_points = _codepoints(pattern)
+        alphabet, codes = np.unique(pattern_points, return_inverse=True)
+        pattern_codes.append(codes + 1)
+        text_points = _codepoints(text)
+        ranks = np.minimum(np.searchsorted(alphabet, text_points), len(alphabet) - 1)
+        text_codes[pair_index, : len(text)] = np.where(
+            alphabet[ranks] == text_points, ranks + 1, 0
+        )
+
+    # peq[pair, code, block] has the bits of the rows that hold that character
+    alphabet_size = max(int(codes.max()) for codes in pattern_codes) + 1
+    peq = np.zeros((pair_count, alphabet_size, word_count), dtype=np.uint64)
+    for pair_index, codes in enumerate(pattern_codes):
+        rows = np.arange(len(codes))
+        np.bitwise_or.at(
+            peq[pair_index],
+            (codes, rows // _WORD_SIZE),
+            np.left_shift(np.uint64(1), (rows % _WORD_SIZE).astype(np.uint64)),
+        )
+
+    pair_indices = np.arange(pair_count)[:, None]
+    block_indices = np.arange(word_count)[None, :]
+    # Offsets into the flattened tables, take() is faster than fancy indexing
+    text_offsets = pair_indices * text_codes.shape[1]
+    peq_offsets = pair_indices * alphabet_size * word_count + block_indices
+    flat_peq = peq.ravel()
+    block_exists = block_indices < word_counts[:, None]
+    # The bit of the last pattern row, in the last block of each pair
+    last_row_bits = np.zeros((pair_count, word_count), dtype=np.uint64)
+    last_row_bits[np.arange(pair_count), word_counts - 1] = np.left_shift(
+        np.uint64(1), ((pattern_lengths - 1) % _WORD_SIZE).astype(np.uint64)
+    )
+
+    positive = np.full((pair_count, word_count), ~np.uint64(0), dtype=np.uint64)
+    negative = np.zeros((pair_count, word_count), dtype=np.uint64)
+    # Horizontal delta out of the bottom of each block, for the next block
+    carries = np.zeros((pair_count, word_count), dtype=np.int64)
+    scores = pattern_lengths.astype(np.int64)
+    first_carry = np.ones((pair_count, 1), dtype=np.int64)
+    zero = np.uint64(0)
+    one = np.uint64(1)
+
+    steps = int((text_lengths + word_counts - 1).max())
+    for step in range(steps):
+        positions = step - block_indices
+        valid = (positions >= 0) & (positions < text_lengths[:, None]) & block_exists
+        codes = text_codes.take(
+            text_offsets + np.clip(positions, 0, text_codes.shape[1] - 1)
+        )
+        eq = flat_peq.take(peq_offsets + codes * word_count)
+        # The top row of block 0 is row 0 of the matrix, where every step is +1
+        carry_in = np.concatenate((first_carry, carries[:, :-1]), axis=1)
+        carry_in_negative = np.where(carry_in < 0, one, zero)
+        carry_in_positive = np.where(carry_in > 0, one, zero)
+
+        xv = eq | negative
+        eq = eq | carry_in_negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        horizontal_positive = negative | ~(xh | positive)
+        horizontal_negative = positive & xh
+
+        carry_out = (horizontal_positive & _HIGH_BIT != 0).astype(np.int64) - (
+            horizontal_negative & _HIGH_BIT != 0
+        )
+        score_delta = (horizontal_positive & last_row_bits != 0).astype(np.int64) - (
+            horizontal_negative & last_row_bits != 0
+        )
+        scores += np.where(valid, score_delta, 0).sum(axis=1)
+
+        horizontal_positive = (horizontal_positive << one) | carry_in_positive
+        horizontal_negative = (horizontal_negative << one) | carry_in_negative
+        positive = np.where(
+            valid, horizontal_negative | ~(xv | horizontal_positive), positive
+        )
+        negative = np.where(valid, horizontal_positive & xv, negative)
+        carries = np.where(valid, carry_out, carries)
 
-    return dp[m][n]
+    return scores
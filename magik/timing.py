@@ -0,0 +1,87 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+from .metrics import percentile
+from .types.test_run import TimingStats
+
+PHASE_GENERATION = "generation"
+PHASE_EVALUATION = "evaluation"
+PHASE_LINK_CHECK = "link_check"
+PHASE_LOGGING = "logging"
+PHASES = [PHASE_GENERATION, PHASE_EVALUATION, PHASE_LINK_CHECK, PHASE_LOGGING]
+
+
+class PhaseTimings:
+    """
+    Milliseconds spent in each phase while it is active. See collect_timings.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    def add(self, phase: str, duration_ms: float):
+        self.timings[phase] = self.timings.get(phase, 0.0) + duration_ms
+
+
+_local = threading.local()
+
+
+def _thread_state():
+    if not hasattr(_local, "collectors"):
+        _local.collectors = []
+        # [phase, time spent in nested phases] of every phase being timed
+        _local.phase_stack = []
+    return _local
+
+
+@contextmanager
+def collect_timings() -> Iterator[PhaseTimings]:
+    """
+    Collect the time spent in every phase timed by the current thread:
+
+        with collect_timings() as timings:
+            with time_phase(PHASE_EVALUATION):
+                evaluate(output)
+        timings.timings
+    """
+    collector = PhaseTimings()
+    collectors = _thread_state().collectors
+    collectors.append(collector)
+    try:
+        yield collector
+    finally:
+        collectors.remove(collector)
+
+
+@contextmanager
+def time_phase(phase: str):
+    """
+    Time a phase with a monotonic clock. Phases can be nested, the time of a
+    nested phase (ex: a link check during evaluation) is only counted once,
+    for the nested phase, so that phase timings add up to the total.
+    """
+    state = _thread_state()
+    frame = [phase, 0.0]
+    state.phase_stack.append(frame)
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started_at) * 1000
+        state.phase_stack.pop()
+        if state.phase_stack:
+            state.phase_stack[-1][1] += duration_ms
+        for collector in state.collectors:
+            collector.add(phase, duration_ms - frame[1])
+
+
+def calculate_timing_stats(durations_ms: List[float]) -> TimingStats:
+    durations_ms = sorted(durations_ms)
+    return {
+        "p50": round(percentile(durations_ms, 50), 2),
+        "p90": round(percentile(durations_ms, 90), 2),
+        "p99": round(percentile(durations_ms, 99), 2),
+        "max": round(durations_ms[-1], 2) if durations_ms else 0.0,
+        "total": round(sum(durations_ms), 2),
+    }
@@ -14,6 +14,23 @@ class Test(TypedDict):
     failure_labels: List[str]
 
 
+class TokenUsage(TypedDict):
+    requests: int  # API calls that were sent, cache hits are not counted
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float  # in USD, according to the price table
+    duration_ms: float  # wall time
+
+
+class TimingStats(TypedDict):
+    # in milliseconds
+    p50: float
+    p90: float
+    p99: float
+    max: float
+    total: float
+
+
 class TestRunStats(TypedDict):
     number_of_runs: int
     passed: int
@@ -21,7 +38,13 @@ class TestRunStats(TypedDict):
     error: int
     pass_rate: Optional[float]
     flakiness: Optional[float]
-    runtime: Optional[int]  # in milliseconds
+    pass_rate_interval: Optional[List[float]]  # 95% confidence interval, in percent
+    # Sum of the time of every run, in milliseconds. Time shared by several
+    # runs (a batched request or phase) is split evenly between them
+    runtime: Optional[int]
+    usage: Optional[TokenUsage]  # total of all runs, generation and evaluation
+    # Distribution of the time per run of each phase, and of the "total"
+    timings: Optional[Dict[str, TimingStats]]
 
 
 class TestRunDetails(TypedDict):
@@ -30,6 +53,13 @@ class TestRunDetails(TypedDict):
     failure_labels: Optional[List[str]]
     prompt: str
     prompt_response: str
+    # Usage of generating the response, counted only for the first test run
+    # that uses a shared response
+    generation_usage: Optional[TokenUsage]
+    # Usage of LLM-backed evaluators
+    evaluation_usage: Optional[TokenUsage]
+    # Milliseconds spent in each phase (generation, evaluation, ...) of the run
+    timings: Optional[Dict[str, float]]
 
 
 class TestRunResult(TypedDict):
@@ -38,6 +68,24 @@ class TestRunResult(TypedDict):
     run_details: List[TestRunDetails]
 
 
+class TestRunUnit(TypedDict):
+    test_index: int  # index of the test in the test suite
+    run_index: int  # which repetition of the test this is
+
+
+class BatchEvaluation(TypedDict):
+    # Result of an output evaluated together with others, see magik_eval
+    eval_result: EvalResult
+    usage: TokenUsage  # usage of the whole batch, on its first output only
+    timings: Dict[str, float]  # the output's share of each phase of the batch
+
+
+class PrefetchedEmbeddings(TypedDict):
+    # Cost of embedding the texts of a run in batches, see EmbeddingBatcher
+    usage: TokenUsage  # usage of all the requests, on the first test run only
+    timings: Dict[str, float]  # the test run's share of each phase
+
+
 class IndividualTestRunResult(TypedDict):
     test: Test
     run_details: TestRunDetails
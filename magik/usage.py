@@ -0,0 +1,142 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from .config import get_open_ai_prices
+from .constants import OPEN_AI_DEFAULT_PRICES
+from .types.test_run import TokenUsage
+
+
+def empty_usage() -> TokenUsage:
+    return {
+        "requests": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cost": 0.0,
+        "duration_ms": 0.0,
+    }
+
+
+def add_usage(total: TokenUsage, usage: Optional[TokenUsage]) -> TokenUsage:
+    if usage is None:
+        return total
+    return {
+        "requests": total["requests"] + usage["requests"],
+        "prompt_tokens": total["prompt_tokens"] + usage["prompt_tokens"],
+        "completion_tokens": total["completion_tokens"] + usage["completion_tokens"],
+        "cost": total["cost"] + usage["cost"],
+        "duration_ms": total["duration_ms"] + usage["duration_ms"],
+    }
+
+
+# Price per 1K tokens for every model, loaded once per process
+_prices: Optional[Dict[str, Dict[str, float]]] = None
+_prices_lock = threading.Lock()
+
+
+def get_prices() -> Dict[str, Dict[str, float]]:
+    """
+    The default price table, with the OPEN_AI_PRICES config entries on top.
+    """
+    global _prices
+    with _prices_lock:
+        if _prices is None:
+            _prices = {**OPEN_AI_DEFAULT_PRICES, **(get_open_ai_prices() or {})}
+        return _prices
+
+
+def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    # Models without a price (ex: local models) are free
+    price = get_prices().get(model, {})
+    return (
+        prompt_tokens * price.get("prompt", 0)
+        + completion_tokens * price.get("completion", 0)
+    ) / 1000
+
+
+class UsageTracker:
+    """
+    Adds up the usage of every API request sent by the current thread while
+    it is active. See track_usage.
+    """
+
+    def __init__(self):
+        self.usage = empty_usage()
+        self._started_at = time.perf_counter()
+        # Worker threads can report to the tracker too, see use_trackers
+        self._lock = threading.Lock()
+
+    def add(self, model: str, prompt_tokens: int, completion_tokens: int):
+        cost = calculate_cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["completion_tokens"] += completion_tokens
+            self.usage["cost"] += cost
+
+    def stop(self):
+        self.usage["duration_ms"] = (time.perf_counter() - self._started_at) * 1000
+
+
+_local = threading.local()
+
+
+def _active_trackers() -> List[UsageTracker]:
+    if not hasattr(_local, "trackers"):
+        _local.trackers = []
+    return _local.trackers
+
+
+@contextmanager
+def track_usage() -> Iterator[UsageTracker]:
+    """
+    Track the token usage and wall time of a block of code:
+
+        with track_usage() as tracker:
+            evaluate(output)
+        tracker.usage
+
+    Trackers can be nested, requests are counted by every active tracker.
+    """
+    tracker = UsageTracker()
+    trackers = _active_trackers()
+    trackers.append(tracker)
+    try:
+        yield tracker
+    finally:
+        trackers.remove(tracker)
+        tracker.stop()
+
+
+def current_trackers() -> List[UsageTracker]:
+    """
+    The active trackers of the current thread, to hand to worker threads.
+    """
+    return list(_active_trackers())
+
+
+@contextmanager
+def use_trackers(trackers: List[UsageTracker]) -> Iterator[None]:
+    """
+    Count the requests of the current thread in trackers of another thread,
+    for work that a thread hands to workers (see current_trackers).
+    """
+    active_trackers = _active_trackers()
+    added_trackers = [tracker for tracker in trackers if tracker not in active_trackers]
+    active_trackers.extend(added_trackers)
+    try:
+        yield
+    finally:
+        for tracker in added_trackers:
+            active_trackers.remove(tracker)
+
+
+def record_usage(model: str, usage: Optional[Dict[str, int]]):
+    """
+    Report the usage of an API response to the trackers of the current thread.
+    """
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    for tracker in _active_trackers():
+        tracker.add(model, prompt_tokens, completion_tokens)
@@ -7,6 +7,14 @@ def normalize_output_string(str):
     return str
 
 
+def json_default(value):
+    # Used as json.dumps(default=...) since evaluators sometimes return
+    # numpy scalars (e.g. numpy.bool_) instead of python values
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
 def substitute_vars(string, vars_dict):
     return string.format(**vars_dict)
 